@@ -0,0 +1,29 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import time
+from datawald_nsagency import nsagency
+
+
+def make_agency(setting, tx_map, **overrides):
+    # Build a connector-less agency the same way the process transform
+    # workers do; only the transform side is exercised.
+    setting = dict(setting, **overrides)
+    nsagency._init_transform_worker(nsagency.NSAgency, setting, tx_map)
+    agency = nsagency._transform_worker_agency
+    agency.num_async_tasks = int(setting.get("NUM_ASYNC_TASKS", 10))
+    agency.transform_mode = setting.get("TRANSFORM_MODE", "thread")
+    return agency
+
+
+def timeit(funct, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = funct()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
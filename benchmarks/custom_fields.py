@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+# @scriptId lookups on wide records: the legacy linear filter against the
+# per-record index used by get_custom_field_value inside transform_data.
+#
+#   python benchmarks/custom_fields.py --records 2000 --custom-fields 200 --mapped 60
+
+import argparse
+from common import make_agency, timeit
+
+
+def legacy_get_custom_field_value(record, script_id):
+    value = None
+    if record["customFieldList"] is None:
+        return value
+    _custom_fields = list(
+        filter(
+            lambda custom_field: (
+                custom_field["scriptId"] == script_id.replace("@", "")
+            ),
+            record["customFieldList"]["customField"],
+        )
+    )
+    if len(_custom_fields) == 1:
+        value = _custom_fields[0]["value"]
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--custom-fields", type=int, default=200)
+    parser.add_argument("--mapped", type=int, default=60)
+    args = parser.parse_args()
+
+    records = [
+        {
+            "internalId": str(n),
+            "customFieldList": {
+                "customField": [
+                    {"scriptId": f"custentity_f{i}", "value": f"{n}-{i}"}
+                    for i in range(args.custom_fields)
+                ]
+            },
+        }
+        for n in range(args.records)
+    ]
+    step = max(args.custom_fields // args.mapped, 1)
+    script_ids = [f"@custentity_f{i}" for i in range(0, args.custom_fields, step)][
+        : args.mapped
+    ]
+
+    # Only the lookups are timed: no funct evaluation and no key walking.
+    tx_map = {
+        "datamart": {
+            "customer": {
+                script_id: {
+                    "funct": "src['v']",
+                    "src": [{"key": script_id, "label": "v"}],
+                    "type": "attribute",
+                }
+                for script_id in script_ids
+            }
+        }
+    }
+    agency = make_agency({"COMPILE_TXMAP": True}, tx_map)
+    metadatas = tx_map["datamart"]["customer"]
+
+    legacy, expected = timeit(
+        lambda: [
+            {script_id: legacy_get_custom_field_value(record, script_id) for script_id in script_ids}
+            for record in records
+        ]
+    )
+    indexed, result = timeit(
+        lambda: [agency.transform_data(record, metadatas) for record in records]
+    )
+    assert result == expected
+
+    for label, elapsed in [("legacy filter", legacy), ("indexed", indexed)]:
+        print(
+            f"{label:14s} {elapsed:8.3f}s {elapsed / len(records) * 1e6:10.1f} us/record"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+# In-process stand-ins for the SuiteTalk and DataWald connectors: synthetic
+# NetSuite-shaped records served page by page, with simulated latency and
+# faults, so the agency can be measured without a NetSuite account.
+
+import random, threading, time
+from datetime import datetime, timedelta
+from pytz import timezone
+from datawald_nsagency import nsagency
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone("UTC"))
+
+
+def custom_fields(prefix, n, count):
+    return {
+        "customField": [
+            {"scriptId": f"{prefix}_f{i}", "value": f"{n}-{i}"} for i in range(count)
+        ]
+    }
+
+
+def make_transaction(n, lines=5, custom_field_count=40):
+    return {
+        "internalId": str(n),
+        "tranId": f"SO{n}",
+        "createdDate": NOW - timedelta(days=1, seconds=n),
+        "lastModifiedDate": NOW - timedelta(seconds=n),
+        "entity": {"internalId": str(n % 500), "name": f"Customer {n % 500}"},
+        "total": f"{n % 1000}.50",
+        "itemList": {
+            "item": [
+                {
+                    "item": {"internalId": str(i), "name": f"SKU{i}"},
+                    "quantity": float(i + 1),
+                    "rate": "9.99",
+                    "amount": f"{9.99 * (i + 1):.2f}",
+                }
+                for i in range(lines)
+            ]
+        },
+        "customFieldList": custom_fields("custbody", n, custom_field_count),
+    }
+
+
+def make_item(n, locations=4, lots=3, price_levels=3, custom_field_count=40):
+    # One shape covering the inventory, inventorylot and pricelevel mappings.
+    return {
+        "internalId": str(n),
+        "itemId": f"SKU{n}",
+        "createdDate": NOW - timedelta(days=1, seconds=n),
+        "lastModifiedDate": NOW - timedelta(seconds=n),
+        "isDropShipItem": n % 10 == 0,
+        "locationsList": {
+            "locations": [
+                {
+                    "locationId": {"internalId": str(i), "name": f"WH{i}"},
+                    "quantityOnHand": float((n + i) % 50),
+                    "quantityAvailable": float((n + i) % 40),
+                }
+                for i in range(locations)
+            ]
+        },
+        "inventoryNumbers": [
+            {
+                "inventoryNumber": f"LOT{n}-{j}",
+                "status": "Not in Stock" if (n + j) % 7 == 0 else "In Stock",
+                "expirationDate": NOW + timedelta(days=30 * (j + 1)),
+                "locations": [
+                    {"location": f"WH{i}", "quantityOnHand": float((n + i + j) % 5)}
+                    for i in range(locations)
+                ],
+            }
+            for j in range(lots)
+        ],
+        "pricingMatrix": {
+            "pricing": [
+                {
+                    "priceLevel": {"internalId": str(k), "name": f"Level {k}"},
+                    "priceList": {
+                        "price": [
+                            {"value": 10.0 - k - q, "quantity": None if q == 0 else q * 10}
+                            for q in range(3)
+                        ]
+                    },
+                }
+                for k in range(price_levels)
+            ]
+        },
+        "customFieldList": custom_fields("custitem", n, custom_field_count),
+    }
+
+
+def make_person(n, custom_field_count=40):
+    return {
+        "internalId": str(n),
+        "entityId": f"C{n}",
+        "email": f"customer{n}@example.com",
+        "firstName": f"First{n}",
+        "lastName": f"Last{n}",
+        "dateCreated": NOW - timedelta(days=1, seconds=n),
+        "lastModifiedDate": NOW - timedelta(seconds=n),
+        "addressbookList": {
+            "addressbook": [
+                {
+                    "defaultBilling": True,
+                    "addressbookAddress": {
+                        "addr1": f"{n} Main St",
+                        "city": "Springfield",
+                        "zip": f"{n % 100000:05d}",
+                        "country": "_unitedStates",
+                    },
+                }
+            ]
+        },
+        "customFieldList": custom_fields("custentity", n, custom_field_count),
+    }
+
+
+class ConnectorStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, call, elapsed):
+        with self.lock:
+            self.latencies.setdefault(call, []).append(elapsed)
+
+    def error(self, call):
+        with self.lock:
+            self.errors[call] = self.errors.get(call, 0) + 1
+
+
+class FakeSOAPConnector(object):
+    """Serves `records` synthetic records per search, `page_size` per page.
+
+    Every call sleeps `latency` seconds (plus up to `jitter`). A fraction
+    `error_rate` of page fetches fails with a concurrency fault, and a
+    fraction `write_error_rate` of upserts fails outright. With
+    `concurrency_limit`, any call beyond that many in flight (reads and
+    writes together, like an account limit) fails with a concurrency fault.
+    """
+
+    def __init__(
+        self,
+        records=1000,
+        page_size=100,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        write_error_rate=0.0,
+        seed=0,
+        concurrency_limit=0,
+    ):
+        self.records = records
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.write_error_rate = write_error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.concurrency_limit = concurrency_limit
+        self.in_flight = 0
+        self.stats = ConnectorStats()
+
+    def roll(self):
+        with self.random_lock:
+            return self.random.random()
+
+    def wait(self, call):
+        with self.random_lock:
+            self.in_flight += 1
+            rejected = self.concurrency_limit and self.in_flight > self.concurrency_limit
+        try:
+            delay = self.latency
+            if self.jitter:
+                delay += self.jitter * self.roll()
+            if delay > 0:
+                time.sleep(delay)
+        finally:
+            with self.random_lock:
+                self.in_flight -= 1
+        if rejected:
+            self.stats.error(f"{call}_concurrency")
+            raise Exception("WS_CONCURRENCY_EXCEEDED: fake account limit exceeded.")
+
+    def get_result(self, call, make_record, record_type, **params):
+        start = time.perf_counter()
+        self.wait(call)
+        page_index = params.get("page_index", 1)
+        if page_index > 1 and self.error_rate and self.roll() < self.error_rate:
+            self.stats.error(call)
+            raise Exception(f"WS_CONCURRENCY_EXCEEDED: fake fault on page {page_index}.")
+
+        total_pages = max(-(-self.records // self.page_size), 1)
+        first = (page_index - 1) * self.page_size
+        result = {
+            "total_records": self.records,
+            "total_pages": total_pages,
+            "search_id": f"fake-{record_type}",
+            "records": [
+                make_record(n)
+                for n in range(first, min(first + self.page_size, self.records))
+            ],
+        }
+        self.stats.record(call, time.perf_counter() - start)
+        return result
+
+    def get_transaction_result(self, record_type, **params):
+        return self.get_result("page", make_transaction, record_type, **params)
+
+    def get_item_result(self, record_type, **params):
+        return self.get_result("page", make_item, record_type, **params)
+
+    def get_person_result(self, record_type, **params):
+        return self.get_result("page", make_person, record_type, **params)
+
+    def get_records(self, record_type, records, **params):
+        return records
+
+    get_transactions = get_items = get_persons = get_records
+
+    def upsert(self, call, count):
+        start = time.perf_counter()
+        self.wait(call)
+        results = []
+        for _ in range(count):
+            if self.write_error_rate and self.roll() < self.write_error_rate:
+                self.stats.error(call)
+                results.append(Exception("Fake upsert error."))
+            else:
+                results.append(str(self.roll())[2:10])
+        self.stats.record(call, time.perf_counter() - start)
+        return results
+
+    def insert_update_transaction(self, record_type, data):
+        result = self.upsert("upsert", 1)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def insert_update_transactions(self, record_type, data_list):
+        return self.upsert("upsert_list", len(data_list))
+
+    def insert_update_person(self, record_type, data):
+        return self.insert_update_transaction(record_type, data)
+
+    def insert_update_persons(self, record_type, data_list):
+        return self.upsert("upsert_list", len(data_list))
+
+
+def make_order_row(n):
+    # A SuiteQL transaction row, dates as TO_CHAR(..., 'YYYY-MM-DD HH24:MI:SS').
+    return {
+        "id": n,
+        "tranid": f"SO{n}",
+        "entity_name": f"Customer {n % 500}",
+        "total": (n % 1000) + 0.5,
+        "createddate": (NOW - timedelta(days=1, seconds=n)).strftime("%Y-%m-%d %H:%M:%S"),
+        "lastmodified": (NOW - timedelta(seconds=n)).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+class FakeRESTConnector(object):
+    # Answers execute_suiteql with `records` rows from make_row, paged by
+    # limit/offset like the SuiteQL REST endpoint.
+    def __init__(self, records=0, latency=0.0, make_row=make_order_row, **kwargs):
+        self.records = records
+        self.latency = latency
+        self.make_row = make_row
+        self.stats = ConnectorStats()
+
+    def execute_suiteql(self, query, limit=1000, offset=0):
+        start = time.perf_counter()
+        if self.latency > 0:
+            time.sleep(self.latency)
+        items = [
+            self.make_row(n) for n in range(offset, min(offset + limit, self.records))
+        ]
+        self.stats.record("suiteql", time.perf_counter() - start)
+        return {
+            "items": items,
+            "count": len(items),
+            "offset": offset,
+            "totalResults": self.records,
+            "hasMore": offset + len(items) < self.records,
+        }
+
+
+class FakeDatawaldConnector(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+def make_fake_agency(
+    logger, soap_connector, agency_class=None, rest_connector=None, **setting
+):
+    # Construct the agency as usual; its connectors are built lazily, so the
+    # fakes are put in place (behind the governor) before anything uses them.
+    agency_class = agency_class or nsagency.NSAgency
+    rest_connector = rest_connector or FakeRESTConnector()
+    agency = agency_class(logger, **setting)
+    agency.soap_connector = nsagency.LazyConnector(
+        lambda: soap_connector, wrap=agency.governed
+    )
+    agency.rest_connector = nsagency.LazyConnector(
+        lambda: rest_connector, wrap=agency.governed
+    )
+    agency.datawald = FakeDatawaldConnector()
+    return agency
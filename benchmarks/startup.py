@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+# Cold start of a Lambda-style invocation: module import, NSAgency
+# construction and the first request, each run in a fresh process. Also
+# lists which heavy client modules the import/construction pulled in.
+#
+#   python benchmarks/startup.py --runs 5
+#   python benchmarks/startup.py --setting-file setting.json   # real NetSuite
+
+import argparse, json, logging, statistics, subprocess, sys, time
+
+HEAVY_MODULES = [
+    "boto3",
+    "botocore",
+    "requests",
+    "zeep",
+    "suitetalk_connector",
+    "datawald_connector",
+]
+
+
+def run_once(setting_file):
+    start = time.perf_counter()
+    from datawald_nsagency.nsagency import NSAgency
+
+    imported = time.perf_counter()
+    logger = logging.getLogger("startup")
+    if setting_file:
+        with open(setting_file) as f:
+            setting = json.load(f)
+        agency = NSAgency(logger, **setting)
+    else:
+        from fakes import FakeSOAPConnector, make_fake_agency
+        from sync_pipeline import SETTING
+
+        agency = make_fake_agency(
+            logger, FakeSOAPConnector(records=1, page_size=1), **SETTING
+        )
+    constructed = time.perf_counter()
+    loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    # The first request builds whatever the agency deferred (connector,
+    # TXMAP); one record keeps the search itself out of the measurement.
+    agency.tx_transactions_src(
+        tx_type="order",
+        cut_date="2024-01-01T00:00:00+0000",
+        end_date="2024-01-02T00:00:00+0000",
+        limit=1,
+    )
+    first_request = time.perf_counter()
+    return {
+        "import": imported - start,
+        "construct": constructed - imported,
+        "first_request": first_request - constructed,
+        "modules_after_construct": loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--setting-file", help="Real agency setting (JSON).")
+    parser.add_argument("--json", action="store_true", help="One JSON line per run.")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_once(args.setting_file)))
+        return
+
+    command = [sys.executable, __file__, "--child"]
+    if args.setting_file:
+        command += ["--setting-file", args.setting_file]
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            command, check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+        if args.json:
+            print(json.dumps(results[-1]))
+
+    if args.json:
+        return
+    for stage in ["import", "construct", "first_request"]:
+        seconds = [result[stage] for result in results]
+        print(
+            f"{stage:>13}: median {statistics.median(seconds) * 1000:.1f}ms, "
+            f"max {max(seconds) * 1000:.1f}ms"
+        )
+    print(f"{'modules':>13}: {results[-1]['modules_after_construct']}")
+
+
+if __name__ == "__main__":
+    main()
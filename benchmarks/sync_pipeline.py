@@ -0,0 +1,351 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+# End-to-end source pulls, transforms and target upserts against the fake
+# connectors. Each scenario/size runs in a fresh process so peak RSS is its own.
+#
+#   python benchmarks/sync_pipeline.py --sizes 1000 10000 100000
+#   python benchmarks/sync_pipeline.py --scenarios order upsert --latency 0.05 \
+#       --setting '{"PIPELINE_MODE": true, "PAGE_FETCH_WORKERS": 4}'
+
+import argparse, json, logging, resource, sys, time
+import concurrent.futures, multiprocessing
+from fakes import FakeSOAPConnector, NOW, make_fake_agency
+
+# Fields per mapping are kept close to a typical datamart TXMAP: plain keys,
+# nested keys, @scriptId custom fields and line lists.
+TXMAP = {
+    "datamart": {
+        "salesOrder": dict(
+            {
+                "tran_id": {
+                    "funct": "src['tran_id']",
+                    "src": [{"key": "tranId", "label": "tran_id"}],
+                    "type": "attribute",
+                },
+                "customer": {
+                    "funct": "src['customer']['name'] if src['customer'] is not None else ''",
+                    "src": [{"key": "entity", "label": "customer"}],
+                    "type": "attribute",
+                },
+                "total": {
+                    "funct": "float(src['total'])",
+                    "src": [{"key": "total", "label": "total"}],
+                    "type": "attribute",
+                },
+                "items": {
+                    "funct": {
+                        "sku": {
+                            "funct": "src['sku']",
+                            "src": [{"key": "item|name", "label": "sku"}],
+                            "type": "attribute",
+                        },
+                        "qty": {
+                            "funct": "src['qty']",
+                            "src": [{"key": "quantity", "label": "qty"}],
+                            "type": "attribute",
+                        },
+                        "amount": {
+                            "funct": "float(src['amount'])",
+                            "src": [{"key": "amount", "label": "amount"}],
+                            "type": "attribute",
+                        },
+                    },
+                    "src": [{"key": "itemList|item"}],
+                    "type": "list",
+                },
+            },
+            **{
+                f"f{i}": {
+                    "funct": "src['v']",
+                    "src": [{"default": "", "key": f"@custbody_f{i}", "label": "v"}],
+                    "type": "attribute",
+                }
+                for i in range(0, 40, 2)
+            },
+        ),
+        "inventory": {
+            "locations": {
+                "funct": {
+                    "warehouse": {
+                        "funct": "src['warehouse']",
+                        "src": [{"key": "locationId|name", "label": "warehouse"}],
+                        "type": "attribute",
+                    },
+                    "qty": {
+                        "funct": "src['qty']",
+                        "src": [{"key": "quantityAvailable", "label": "qty"}],
+                        "type": "attribute",
+                    },
+                    "in_stock": {
+                        "funct": "True if src.get('qty') is not None and src.get('qty') > 0 else False",
+                        "src": [{"key": "quantityAvailable", "label": "qty"}],
+                        "type": "attribute",
+                    },
+                },
+                "src": [{"key": "locationsList|locations"}],
+                "type": "list",
+            },
+            "drop_ship_item": {
+                "funct": "src['drop_ship_item']",
+                "src": [{"key": "isDropShipItem", "label": "drop_ship_item"}],
+                "type": "attribute",
+            },
+        },
+        "inventorylot": {
+            "inventoryNumbers": {
+                "funct": {
+                    "lot": {
+                        "funct": "src['lot']",
+                        "src": [{"key": "inventoryNumber", "label": "lot"}],
+                        "type": "attribute",
+                    },
+                    "status": {
+                        "funct": "src['status']",
+                        "src": [{"key": "status", "label": "status"}],
+                        "type": "attribute",
+                    },
+                    "locations": {
+                        "funct": "src['locations']",
+                        "src": [{"key": "locations", "label": "locations"}],
+                        "type": "attribute",
+                    },
+                },
+                "src": [{"key": "inventoryNumbers"}],
+                "type": "list",
+            },
+        },
+        "pricelevel": {
+            "pricelevels": {
+                "funct": "src['pricelevels']",
+                "src": [{"key": "pricingMatrix|pricing", "label": "pricelevels"}],
+                "type": "attribute",
+            },
+        },
+        "customer": dict(
+            {
+                "email": {
+                    "funct": "src['email']",
+                    "src": [{"key": "email", "label": "email"}],
+                    "type": "attribute",
+                },
+                "name": {
+                    "funct": "f\"{src['first_name']} {src['last_name']}\"",
+                    "src": [
+                        {"key": "firstName", "label": "first_name"},
+                        {"key": "lastName", "label": "last_name"},
+                    ],
+                    "type": "attribute",
+                },
+                "addresses": {
+                    "funct": {
+                        "city": {
+                            "funct": "src['city']",
+                            "src": [{"key": "addressbookAddress|city", "label": "city"}],
+                            "type": "attribute",
+                        },
+                        "zip": {
+                            "funct": "src['zip']",
+                            "src": [{"key": "addressbookAddress|zip", "label": "zip"}],
+                            "type": "attribute",
+                        },
+                    },
+                    "src": [{"key": "addressbookList|addressbook"}],
+                    "type": "list",
+                },
+            },
+            **{
+                f"f{i}": {
+                    "funct": "src['v']",
+                    "src": [{"default": "", "key": f"@custentity_f{i}", "label": "v"}],
+                    "type": "attribute",
+                }
+                for i in range(0, 40, 2)
+            },
+        ),
+    }
+}
+
+SETTING = {
+    "TXMAP": TXMAP,
+    "LIMIT_PAGES": 0,
+    "METRICS_SINKS": ["memory"],
+    "data_type": {
+        "order": "salesOrder",
+        "inventory": "inventory",
+        "inventorylot": "inventorylot",
+        "pricelevel": "pricelevel",
+        "customer": "customer",
+    },
+    "src_metadata": dict(
+        {
+            tx_type: {
+                "src_id": "internalId",
+                "created_at": "createdDate",
+                "updated_at": "lastModifiedDate",
+            }
+            for tx_type in ["order", "inventory", "inventorylot", "pricelevel"]
+        },
+        customer={
+            "src_id": "internalId",
+            "created_at": "dateCreated",
+            "updated_at": "lastModifiedDate",
+        },
+    ),
+}
+
+# scenario -> (agency method, tx_type)
+SCENARIOS = {
+    "order": ("tx_transactions_src", "order"),
+    "inventory": ("tx_assets_src", "inventory"),
+    "inventorylot": ("tx_assets_src", "inventorylot"),
+    "pricelevel": ("tx_assets_src", "pricelevel"),
+    "customer": ("tx_persons_src", "customer"),
+    "upsert": ("insert_update_transactions", "order"),
+    # An order pull and an upsert of the same size at once, sharing the
+    # account limit (see --concurrency-limit and the GOVERNOR setting).
+    "contention": ("tx_transactions_src", "order"),
+}
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not values:
+        return {f"p{point}": None for point in points}
+    values = sorted(values)
+    return {
+        f"p{point}": round(
+            values[min(int(len(values) * point / 100), len(values) - 1)] * 1000, 3
+        )
+        for point in points
+    }
+
+
+def run_scenario(scenario, size, connector_options, setting):
+    logger = logging.getLogger("benchmark")
+    soap_connector = FakeSOAPConnector(records=size, **connector_options)
+    agency = make_fake_agency(logger, soap_connector, **dict(SETTING, **setting))
+    funct_name, tx_type = SCENARIOS[scenario]
+
+    def upsert_entities():
+        return [
+            {
+                "tx_type_src_id": f"order-{n}",
+                "data": {"tranId": f"SO{n}", "total": f"{n % 1000}.50"},
+            }
+            for n in range(size)
+        ]
+
+    try:
+        if scenario == "upsert":
+            entities = upsert_entities()
+            start = time.perf_counter()
+            getattr(agency, funct_name)(entities)
+        elif scenario == "contention":
+            upserts = upsert_entities()
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                writes = executor.submit(agency.insert_update_transactions, upserts)
+                entities = executor.submit(
+                    getattr(agency, funct_name),
+                    tx_type=tx_type,
+                    target="datamart",
+                    cut_date=NOW,
+                ).result()
+                entities = entities + writes.result()
+        else:
+            start = time.perf_counter()
+            entities = getattr(agency, funct_name)(
+                tx_type=tx_type, target="datamart", cut_date=NOW
+            )
+            if not isinstance(entities, list):
+                # Streaming mode returns chunks.
+                entities = [entity for chunk in entities for entity in chunk]
+        elapsed = time.perf_counter() - start
+    finally:
+        agency.close()
+
+    stages = {}
+    for snapshot in agency.metrics.sinks[0].snapshots:
+        for timing in snapshot["timings"]:
+            stages[timing["name"]] = round(
+                stages.get(timing["name"], 0.0) + timing["total"], 3
+            )
+    failed = sum(1 for entity in entities if entity.get("tx_status") == "F")
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+    return {
+        "scenario": scenario,
+        "records": size,
+        "entities": len(entities),
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(size / elapsed, 1) if elapsed else None,
+        "call_latency_ms": {
+            call: percentiles(latencies)
+            for call, latencies in soap_connector.stats.latencies.items()
+        },
+        "connector_errors": soap_connector.stats.errors,
+        "stage_seconds": stages,
+        "peak_rss_mb": round(peak_rss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS.keys()))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000])
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--write-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--concurrency-limit",
+        type=int,
+        default=0,
+        help="Fake account limit on calls in flight (0: none).",
+    )
+    parser.add_argument("--setting", default="{}", help="JSON setting overrides.")
+    parser.add_argument("--json", action="store_true", help="One JSON line per run.")
+    args = parser.parse_args()
+
+    connector_options = {
+        "page_size": args.page_size,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "write_error_rate": args.write_error_rate,
+        "seed": args.seed,
+        "concurrency_limit": args.concurrency_limit,
+    }
+    setting = json.loads(args.setting)
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        for scenario in args.scenarios:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=context
+            ) as executor:
+                result = executor.submit(
+                    run_scenario, scenario, size, connector_options, setting
+                ).result()
+            if args.json:
+                print(json.dumps(result))
+                continue
+            print(
+                f"{result['scenario']:>12} {result['records']:>7} records: "
+                f"{result['seconds']:.3f}s, {result['records_per_second']:.0f} rec/s, "
+                f"peak RSS {result['peak_rss_mb']} MB, failed {result['failed']}"
+            )
+            for call, points in result["call_latency_ms"].items():
+                print(f"{'':>12} {call} latency ms: {points}")
+            print(f"{'':>12} stages s: {result['stage_seconds']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+# Compare the shared transform pool against the legacy per-entity asyncio.run fan-out.
+#
+#   python benchmarks/transform_engine.py --records 40000 --workers 10
+
+import argparse, asyncio, logging, time
+import concurrent.futures
+from datetime import datetime, timedelta
+from pytz import timezone
+from common import make_agency
+
+TXMAP = {
+    "datamart": {
+        "salesOrder": {
+            "tran_id": {
+                "funct": "src['tran_id']",
+                "src": [{"key": "tranId", "label": "tran_id"}],
+                "type": "attribute",
+            },
+            "customer": {
+                "funct": "src['customer']['name'] if src['customer'] is not None else ''",
+                "src": [{"key": "entity", "label": "customer"}],
+                "type": "attribute",
+            },
+            "total": {
+                "funct": "float(src['total'])",
+                "src": [{"key": "total", "label": "total"}],
+                "type": "attribute",
+            },
+        }
+    }
+}
+
+SETTING = {
+    "data_type": {"order": "salesOrder"},
+    "src_metadata": {
+        "order": {
+            "src_id": "internalId",
+            "created_at": "createdDate",
+            "updated_at": "lastModifiedDate",
+        }
+    },
+}
+
+
+def make_records(count):
+    now = datetime.now(tz=timezone("UTC"))
+    return [
+        {
+            "internalId": str(i),
+            "tranId": f"SO{i}",
+            "entity": {"name": f"Customer {i % 500}"},
+            "total": f"{i % 1000}.50",
+            "createdDate": now - timedelta(days=1),
+            "lastModifiedDate": now,
+        }
+        for i in range(count)
+    ]
+
+
+def legacy(agency, raw_entities, **kwargs):
+    async def task_wrapper(raw_entity):
+        return agency.tx_transaction_src(raw_entity, **kwargs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
+        tasks = [
+            executor.submit(asyncio.run, task_wrapper(raw_entity))
+            for raw_entity in raw_entities
+        ]
+    return [task.result() for task in concurrent.futures.as_completed(tasks)]
+
+
+def engine(agency, raw_entities, **kwargs):
+    return list(
+        agency.dispatch_tx_entity_src(agency.tx_transaction_src, raw_entities, **kwargs)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=40000)
+    parser.add_argument("--workers", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    raw_entities = make_records(args.records)
+    kwargs = {"tx_type": "order", "target": "datamart"}
+
+    for label, runner, mode in [
+        ("legacy asyncio.run per entity", legacy, "thread"),
+        ("shared pool (thread)", engine, "thread"),
+        ("shared pool (process)", engine, "process"),
+    ]:
+        agency = make_agency(
+            SETTING, TXMAP, NUM_ASYNC_TASKS=args.workers, TRANSFORM_MODE=mode
+        )
+        start = time.perf_counter()
+        entities = runner(agency, raw_entities, **kwargs)
+        elapsed = time.perf_counter() - start
+        agency.close()
+        assert len(entities) == len(raw_entities)
+        print(
+            f"{label:32s} {elapsed:8.3f}s {len(entities) / elapsed:12.0f} records/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
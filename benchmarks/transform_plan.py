@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+# Per-record transform cost of a wide customer TXMAP: Agency.transform_data
+# against the compiled TransformPlan (COMPILE_TXMAP).
+#
+#   python benchmarks/transform_plan.py --records 2000 --fields 120
+
+import argparse
+from datetime import datetime
+from pytz import timezone
+from common import make_agency, timeit
+
+
+def make_txmap(fields):
+    mapping = {}
+    for i in range(fields):
+        label = f"field_{i}"
+        if i % 3 == 0:
+            mapping[label] = {
+                "funct": f"src.get('{label}')",
+                "src": [
+                    {"default": "", "key": f"@custentity_f{i}", "label": label}
+                ],
+                "type": "attribute",
+            }
+        elif i % 3 == 1:
+            mapping[label] = {
+                "funct": f"src['{label}']['name'] if src['{label}'] is not None else ''",
+                "src": [{"key": f"ref_{i}", "label": label}],
+                "type": "attribute",
+            }
+        else:
+            mapping[label] = {
+                "funct": f"src['{label}'].astimezone(timezone('UTC')).strftime('%Y-%m-%d %H:%M:%S')",
+                "src": [{"key": "dateCreated", "label": label}],
+                "type": "attribute",
+            }
+    mapping["addresses"] = {
+        "funct": {
+            "city": {
+                "funct": "src['city']",
+                "src": [{"key": "city", "label": "city"}],
+                "type": "attribute",
+            },
+            "default_billing": {
+                "funct": "src['default_billing']",
+                "src": [{"default": False, "key": "defaultBilling", "label": "default_billing"}],
+                "type": "attribute",
+            },
+        },
+        "src": [{"key": "addressbookList|addressbook"}],
+        "type": "list",
+    }
+    return {"datamart": {"customer": mapping}}
+
+
+def make_records(count, fields):
+    now = datetime.now(tz=timezone("UTC"))
+    records = []
+    for n in range(count):
+        record = {
+            "internalId": str(n),
+            "dateCreated": now,
+            "lastModifiedDate": now,
+            "customFieldList": {
+                "customField": [
+                    {"scriptId": f"custentity_f{i}", "value": f"v{i}"}
+                    for i in range(0, fields, 3)
+                ]
+            },
+            "addressbookList": {
+                "addressbook": [{"city": "Los Angeles", "defaultBilling": True}] * 3
+            },
+        }
+        record.update({f"ref_{i}": {"name": f"n{i}"} for i in range(1, fields, 3)})
+        records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--fields", type=int, default=120)
+    args = parser.parse_args()
+
+    tx_map = make_txmap(args.fields)
+    metadatas = tx_map["datamart"]["customer"]
+    records = make_records(args.records, args.fields)
+
+    results = {}
+    for label, compile_txmap in [("transform_data", False), ("compiled plan", True)]:
+        agency = make_agency({"COMPILE_TXMAP": compile_txmap}, tx_map)
+        elapsed, results[label] = timeit(
+            lambda: [agency.transform_data(record, metadatas) for record in records]
+        )
+        print(
+            f"{label:16s} {elapsed:8.3f}s {elapsed / len(records) * 1e6:10.1f} us/record"
+        )
+
+    assert results["transform_data"] == results["compiled plan"]
+
+
+if __name__ == "__main__":
+    main()
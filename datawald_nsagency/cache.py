@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import hashlib, json, os, threading, time
+
+# Process-level caches; they outlive NSAgency instances on warm containers.
+_objects = {}
+_values = {}
+_lock = threading.RLock()
+
+
+class ObjectNotModified(Exception):
+    # Shaped like the botocore ClientError S3 raises for a matching IfNoneMatch.
+    def __init__(self, bucket, key):
+        Exception.__init__(self, f"{bucket}/{key} not modified.")
+        self.response = {
+            "Error": {"Code": "304", "Message": "Not Modified"},
+            "ResponseMetadata": {"HTTPStatusCode": 304},
+        }
+
+
+def is_not_modified(exception):
+    response = getattr(exception, "response", None) or {}
+    return (
+        response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304
+        or response.get("Error", {}).get("Code") in ("304", "NotModified")
+    )
+
+
+class FileSystemObjectStore(object):
+    """Local stand-in for the S3 client: `root/<Bucket>/<Key>` files served
+    through get_object with ETag/IfNoneMatch support."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_object(self, Bucket=None, Key=None, IfNoneMatch=None):
+        with open(os.path.join(self.root, Bucket, Key), "rb") as f:
+            body = f.read()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise ObjectNotModified(Bucket, Key)
+        return {"Body": _Body(body), "ETag": etag}
+
+
+class _Body(object):
+    def __init__(self, content):
+        self.content = content
+
+    def read(self):
+        return self.content
+
+
+def get_json_object(get_client, bucket, key, ttl=300):
+    """Return the parsed JSON object at bucket/key, cached for the process.
+
+    Within `ttl` seconds the cached value is returned without touching S3;
+    after that it is revalidated with a conditional GET on its ETag and only
+    downloaded and parsed again when it changed.
+    """
+    with _lock:
+        entry = _objects.get((bucket, key))
+        if entry is not None and time.monotonic() - entry["checked_at"] < ttl:
+            return entry["value"]
+
+        params = {"Bucket": bucket, "Key": key}
+        if entry is not None and entry.get("etag"):
+            params["IfNoneMatch"] = entry["etag"]
+        try:
+            obj = get_client().get_object(**params)
+        except Exception as e:
+            if entry is None or not is_not_modified(e):
+                raise
+            entry["checked_at"] = time.monotonic()
+            return entry["value"]
+
+        entry = {
+            "etag": obj.get("ETag"),
+            "value": json.loads(obj["Body"].read().decode("utf8")),
+            "checked_at": time.monotonic(),
+        }
+        _objects[(bucket, key)] = entry
+        return entry["value"]
+
+
+def get_value(key, loader, ttl=300):
+    """Return loader() cached for the process under `key` for `ttl` seconds."""
+    with _lock:
+        entry = _values.get(key)
+        if entry is not None and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+
+    value = loader()
+    with _lock:
+        _values[key] = (time.monotonic(), value)
+    return value
+
+
+def clear():
+    with _lock:
+        _objects.clear()
+        _values.clear()
@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import hashlib, json, os, sqlite3, tempfile, threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+
+# tx_*_src kwargs that control a run rather than what its search returns.
+RUN_PARAMS = {
+    "target",
+    "tx_type",
+    "cut_date",
+    "end_date",
+    "hours",
+    "stream",
+    "pipeline",
+    "chunk_size",
+    "checkpoint",
+    "resume",
+    "fixed_window",
+}
+
+
+def checkpoint_key(**kwargs):
+    """`target:tx_type`, plus a hash of any other search params (e.g.
+    subsidiary), so differently filtered syncs keep separate watermarks."""
+    key = f"{kwargs.get('target')}:{kwargs.get('tx_type')}"
+    params = {k: v for k, v in kwargs.items() if k not in RUN_PARAMS}
+    if not params:
+        return key
+    digest = hashlib.sha1(
+        json.dumps(params, sort_keys=True, default=str).encode("utf8")
+    ).hexdigest()
+    return f"{key}:{digest[:16]}"
+
+
+class CheckpointStore(ABC):
+    """Stores one JSON-serializable checkpoint per sync key (checkpoint_key)."""
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def put(self, key, checkpoint):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+
+class FileCheckpointStore(CheckpointStore):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _save(self, checkpoints):
+        # Write to a sibling file and rename so a crash never leaves half a file.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, "w") as f:
+            json.dump(checkpoints, f)
+        os.replace(tmp, self.path)
+
+    def get(self, key):
+        with self.lock:
+            return self._load().get(key)
+
+    def put(self, key, checkpoint):
+        with self.lock:
+            checkpoints = self._load()
+            checkpoints[key] = checkpoint
+            self._save(checkpoints)
+
+    def delete(self, key):
+        with self.lock:
+            checkpoints = self._load()
+            if checkpoints.pop(key, None) is not None:
+                self._save(checkpoints)
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        with self.lock, self.connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM checkpoints WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, checkpoint):
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (key, value) VALUES (?, ?)",
+                (key, json.dumps(checkpoint)),
+            )
+
+    def delete(self, key):
+        with self.lock, self.connect() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+
+
+def get_checkpoint_store(setting):
+    config = setting.get("CHECKPOINT_STORE")
+    if not config:
+        return None
+    if isinstance(config, CheckpointStore):
+        return config
+
+    store_type = config.get("type", "sqlite")
+    assert store_type in ("file", "sqlite"), f"{store_type} checkpoint store is not supported."
+    if store_type == "file":
+        return FileCheckpointStore(config.get("path", "/tmp/nsagency_checkpoints.json"))
+    return SQLiteCheckpointStore(config.get("path", "/tmp/nsagency_checkpoints.db"))
+
+
+class SyncCheckpoint(object):
+    """Progress of one tx_*_src run for a target/tx_type.
+
+    While a run is in flight the checkpoint keeps its window, search_id and
+    completed page indexes so a re-invoked sync can resume the same search;
+    once the run is committed only the high-water lastModifiedDate remains
+    and becomes the cut_date floor of the next incremental run.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.state = store.get(key) or {}
+        # Pages finish out of order, so only a committed run moves the floor.
+        self.committed_watermark = self.state.get("watermark")
+        self.watermark = self.state.get("pending_watermark") or self.committed_watermark
+
+    @property
+    def resume(self):
+        if self.state.get("status") != "running" or not self.state.get("search_id"):
+            return None
+        return {
+            "cut_date": self.state["cut_date"],
+            "end_date": self.state["end_date"],
+            "search_id": self.state["search_id"],
+            "total_pages": self.state["total_pages"],
+            "completed_pages": self.state.get("completed_pages", []),
+        }
+
+    def start(self, cut_date, end_date):
+        if self.resume is not None:
+            return
+        self.watermark = self.committed_watermark
+        self.state = {
+            "status": "running",
+            "cut_date": cut_date,
+            "end_date": end_date,
+            "watermark": self.committed_watermark,
+            "completed_pages": [],
+        }
+
+    def restart(self):
+        # The saved search is gone (e.g. expired); start the window over.
+        self.state.update({"search_id": None, "completed_pages": []})
+        self.save()
+
+    def search_started(self, search_id, total_pages):
+        if self.state.get("search_id") != search_id:
+            self.state.update(
+                {"search_id": search_id, "total_pages": total_pages, "completed_pages": []}
+            )
+            self.save()
+
+    def observe(self, updated_at):
+        if isinstance(updated_at, datetime):
+            updated_at = updated_at.strftime("%Y-%m-%dT%H:%M:%S%z")
+        # Same format and timezone (UTC) everywhere, so strings compare in order.
+        if self.watermark is None or updated_at > self.watermark:
+            self.watermark = updated_at
+
+    def page_completed(self, page_index):
+        self.state.setdefault("completed_pages", []).append(page_index)
+        self.state["pending_watermark"] = self.watermark
+        self.save()
+
+    def commit(self):
+        self.committed_watermark = self.watermark
+        self.state = {"status": "completed", "watermark": self.watermark}
+        self.save()
+
+    def save(self):
+        self.store.put(self.key, self.state)
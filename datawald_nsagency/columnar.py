@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import itertools, operator
+from operator import itemgetter
+
+# Batch form of tx_inventorylot_src for a whole page of items: the lot
+# location rows are flattened into per-key columns, the zero-stock filter
+# runs over whole columns with map/compress, and the kept rows are sliced
+# back onto their inventory numbers.
+
+
+def column(rows, key):
+    return list(map(itemgetter(key), rows))
+
+
+def row_sum(row):
+    return sum(value for value in row.values() if type(value) != str)
+
+
+def row_totals(rows):
+    """Sum of the non-string values of each row, like
+    `sum(v for v in row.values() if type(v) != str)` per row."""
+    if not rows:
+        return []
+    keys = tuple(rows[0])
+    if any(tuple(row) != keys for row in rows):
+        # Rows with other keys (or keys in another order) are totalled one by
+        # one, so every row is summed over its own values in its own order.
+        return list(map(row_sum, rows))
+
+    totals = None
+    for key in keys:
+        values = column(rows, key)
+        types = set(map(type, values))
+        if str in types:
+            if len(types) == 1:
+                continue
+            values = [0 if type(value) == str else value for value in values]
+        # Left to right from 0, in row key order, as sum() would.
+        totals = values if totals is None else list(map(operator.add, totals, values))
+
+    return [0] * len(rows) if totals is None else totals
+
+
+def filter_inventorylots(inventory_numbers):
+    # Same result as tx_inventorylot_src on each inventory number, in place.
+    rows = []
+    counts = []
+    for inventory_number in inventory_numbers:
+        if inventory_number["status"] == "Not in Stock":
+            inventory_number["locations"] = []
+        locations = inventory_number.get("locations", [])
+        rows.extend(locations)
+        counts.append(len(locations))
+
+    totals = row_totals(rows)
+    start = 0
+    for inventory_number, count in zip(inventory_numbers, counts):
+        end = start + count
+        # A zero total is falsy: zero-stock locations are dropped.
+        inventory_number["locations"] = list(
+            itertools.compress(rows[start:end], totals[start:end])
+        )
+        start = end
+    return inventory_numbers
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import hashlib, json, sqlite3, threading
+from abc import ABC, abstractmethod
+
+
+def fingerprint(data):
+    # Stable across runs: sorted keys, and datetimes/Decimals via str().
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode(
+            "utf8"
+        )
+    ).hexdigest()
+
+
+def fingerprint_key(**kwargs):
+    """`target:tx_type`: each target maps and receives its own copy of a
+    record, so what was shipped to one never hides it from another."""
+    return f"{kwargs.get('target')}:{kwargs.get('tx_type')}"
+
+
+class FingerprintStore(ABC):
+    """Last shipped fingerprint per (key, src_id); key is fingerprint_key."""
+
+    @abstractmethod
+    def get_many(self, key, src_ids):
+        pass
+
+    @abstractmethod
+    def put_many(self, key, fingerprints):
+        pass
+
+
+class MemoryFingerprintStore(FingerprintStore):
+    def __init__(self):
+        self.fingerprints = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, key, src_ids):
+        with self.lock:
+            return {
+                src_id: self.fingerprints[(key, src_id)]
+                for src_id in src_ids
+                if (key, src_id) in self.fingerprints
+            }
+
+    def put_many(self, key, fingerprints):
+        with self.lock:
+            for src_id, value in fingerprints.items():
+                self.fingerprints[(key, src_id)] = value
+
+
+class SQLiteFingerprintStore(FingerprintStore):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "sync_key TEXT NOT NULL, src_id TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                "PRIMARY KEY (sync_key, src_id))"
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, key, src_ids):
+        src_ids = [str(src_id) for src_id in src_ids]
+        found = {}
+        with self.lock, self.connect() as conn:
+            # Stay under SQLite's bound-parameter limit.
+            for i in range(0, len(src_ids), 500):
+                batch = src_ids[i : i + 500]
+                found.update(
+                    conn.execute(
+                        "SELECT src_id, fingerprint FROM fingerprints WHERE sync_key = ? "
+                        f"AND src_id IN ({','.join('?' * len(batch))})",
+                        [key] + batch,
+                    ).fetchall()
+                )
+        return found
+
+    def put_many(self, key, fingerprints):
+        with self.lock, self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (sync_key, src_id, fingerprint) VALUES (?, ?, ?)",
+                [(key, str(src_id), value) for src_id, value in fingerprints.items()],
+            )
+
+
+_memory_store = MemoryFingerprintStore()
+
+
+def get_fingerprint_store(setting):
+    config = setting.get("FINGERPRINT_STORE")
+    if not config:
+        return None
+    if isinstance(config, FingerprintStore):
+        return config
+
+    store_type = config.get("type", "memory")
+    assert store_type in ("memory", "sqlite"), f"{store_type} fingerprint store is not supported."
+    if store_type == "memory":
+        # One per process, so warm containers keep what they have seen.
+        return _memory_store
+    return SQLiteFingerprintStore(config.get("path", "/tmp/nsagency_fingerprints.db"))
@@ -0,0 +1,366 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import random, sqlite3, threading, time, uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Highest first: a waiting writer is served before readers, and readers
+# before backfill shards.
+PRIORITIES = ["write", "read", "backfill"]
+
+
+class GovernorTimeout(Exception):
+    pass
+
+
+def can_acquire(priority, limit, caps, active, waiting):
+    """Whether `priority` may take a slot now.
+
+    `active`/`waiting` count slots held and callers waiting per priority.
+    A slot is free when fewer than `limit` are held account-wide and fewer
+    than `caps[priority]` by this priority; it is left to a waiting caller
+    of higher priority if that caller could take it.
+    """
+
+    def free(name):
+        return (
+            sum(active.values()) < limit
+            and active.get(name, 0) < caps.get(name, limit)
+        )
+
+    if not free(priority):
+        return False
+    for name in PRIORITIES[: PRIORITIES.index(priority)]:
+        if waiting.get(name, 0) > 0 and free(name):
+            return False
+    return True
+
+
+class Governor(ABC):
+    """Caps the NetSuite calls in flight for one account.
+
+    `limit` is the account concurrency limit; `caps` optionally keeps a
+    priority (e.g. {"backfill": 2}) to fewer slots so the rest stay free
+    for writes and incremental reads.
+    """
+
+    def __init__(self, limit, caps=None, timeout=None):
+        self.limit = int(limit)
+        self.caps = caps or {}
+        self.timeout = timeout
+        for priority in self.caps:
+            assert priority in PRIORITIES, f"{priority} is not a governor priority."
+
+    @abstractmethod
+    def acquire(self, priority):
+        pass
+
+    @abstractmethod
+    def release(self, priority, token):
+        pass
+
+    @contextmanager
+    def slot(self, priority="read"):
+        token = self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority, token)
+
+
+class LocalGovernor(Governor):
+    # Threads of one process.
+    def __init__(self, limit, caps=None, timeout=None):
+        Governor.__init__(self, limit, caps=caps, timeout=timeout)
+        self.condition = threading.Condition()
+        self.active = {}
+        self.waiting = {}
+
+    def acquire(self, priority):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self.condition:
+            self.waiting[priority] = self.waiting.get(priority, 0) + 1
+            try:
+                while not can_acquire(
+                    priority, self.limit, self.caps, self.active, self.waiting
+                ):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise GovernorTimeout(
+                            f"No NetSuite slot for {priority} within {self.timeout}s."
+                        )
+                    self.condition.wait(remaining)
+                self.active[priority] = self.active.get(priority, 0) + 1
+            finally:
+                self.waiting[priority] -= 1
+        return None
+
+    def release(self, priority, token):
+        with self.condition:
+            self.active[priority] -= 1
+            self.condition.notify_all()
+
+
+class PollingGovernor(Governor):
+    """Slots kept in a shared store as leases, so processes that crash
+    while holding one only block it for `lease_seconds`."""
+
+    def __init__(self, limit, caps=None, timeout=None, lease_seconds=300, poll=0.05):
+        Governor.__init__(self, limit, caps=caps, timeout=timeout)
+        self.lease_seconds = float(lease_seconds)
+        self.poll = float(poll)
+
+    @abstractmethod
+    def try_acquire(self, priority, token):
+        pass
+
+    @abstractmethod
+    def cancel(self, priority, token):
+        pass
+
+    def acquire(self, priority):
+        token = uuid.uuid4().hex
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        delay = self.poll
+        while not self.try_acquire(priority, token):
+            if deadline is not None and time.monotonic() >= deadline:
+                self.cancel(priority, token)
+                raise GovernorTimeout(
+                    f"No NetSuite slot for {priority} within {self.timeout}s."
+                )
+            # Jittered so pollers from many processes do not move in step.
+            time.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, self.poll * 8)
+        return token
+
+
+class SQLiteGovernor(PollingGovernor):
+    # Processes on one host sharing a database file.
+    def __init__(
+        self, path, limit, caps=None, timeout=None, lease_seconds=300, poll=0.05
+    ):
+        PollingGovernor.__init__(
+            self,
+            limit,
+            caps=caps,
+            timeout=timeout,
+            lease_seconds=lease_seconds,
+            poll=poll,
+        )
+        self.path = path
+        with self.connect() as conn:
+            for table in ("slots", "waiters"):
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    "token TEXT PRIMARY KEY, priority TEXT NOT NULL, expires REAL NOT NULL)"
+                )
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.isolation_level = None
+        return conn
+
+    def counts(self, conn, table):
+        return dict(
+            conn.execute(
+                f"SELECT priority, COUNT(*) FROM {table} GROUP BY priority"
+            ).fetchall()
+        )
+
+    def try_acquire(self, priority, token):
+        now = time.time()
+        conn = self.connect()
+        try:
+            # BEGIN IMMEDIATE takes the write lock, so the count and the
+            # insert are atomic across processes.
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM slots WHERE expires < ?", (now,))
+            conn.execute("DELETE FROM waiters WHERE expires < ?", (now,))
+            if can_acquire(
+                priority,
+                self.limit,
+                self.caps,
+                self.counts(conn, "slots"),
+                self.counts(conn, "waiters"),
+            ):
+                conn.execute("DELETE FROM waiters WHERE token = ?", (token,))
+                conn.execute(
+                    "INSERT INTO slots (token, priority, expires) VALUES (?, ?, ?)",
+                    (token, priority, now + self.lease_seconds),
+                )
+                acquired = True
+            else:
+                # The waiter row lapses if this process stops polling.
+                conn.execute(
+                    "INSERT OR REPLACE INTO waiters (token, priority, expires) VALUES (?, ?, ?)",
+                    (token, priority, now + self.poll * 16 + 1),
+                )
+                acquired = False
+            conn.execute("COMMIT")
+            return acquired
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def cancel(self, priority, token):
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM waiters WHERE token = ?", (token,))
+        finally:
+            conn.close()
+
+    def release(self, priority, token):
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM slots WHERE token = ?", (token,))
+        finally:
+            conn.close()
+
+
+# Same rules as can_acquire, run atomically in the server. Slots and
+# waiters are sorted sets per priority scored by lease expiry.
+REDIS_ACQUIRE = """
+local prefix, token, priority = ARGV[1], ARGV[2], ARGV[3]
+local now, slot_expires, waiter_expires = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local limit, n = tonumber(ARGV[7]), tonumber(ARGV[8])
+local names, caps, active, waiting, total = {}, {}, {}, {}, 0
+for i = 1, n do
+    local name = ARGV[7 + 2 * i]
+    names[i] = name
+    caps[name] = tonumber(ARGV[8 + 2 * i])
+    redis.call('ZREMRANGEBYSCORE', prefix .. ':slots:' .. name, '-inf', now)
+    redis.call('ZREMRANGEBYSCORE', prefix .. ':waiters:' .. name, '-inf', now)
+    active[name] = redis.call('ZCARD', prefix .. ':slots:' .. name)
+    waiting[name] = redis.call('ZCARD', prefix .. ':waiters:' .. name)
+    total = total + active[name]
+end
+local function free(name)
+    return total < limit and active[name] < caps[name]
+end
+local acquired = free(priority)
+if acquired then
+    for i = 1, n do
+        if names[i] == priority then
+            break
+        end
+        if waiting[names[i]] > 0 and free(names[i]) then
+            acquired = false
+            break
+        end
+    end
+end
+if acquired then
+    redis.call('ZREM', prefix .. ':waiters:' .. priority, token)
+    redis.call('ZADD', prefix .. ':slots:' .. priority, slot_expires, token)
+    return 1
+end
+redis.call('ZADD', prefix .. ':waiters:' .. priority, waiter_expires, token)
+return 0
+"""
+
+
+class RedisGovernor(PollingGovernor):
+    # Processes and hosts sharing a Redis (or Redis-compatible) server.
+    def __init__(
+        self,
+        client,
+        limit,
+        prefix="nsagency:governor",
+        caps=None,
+        timeout=None,
+        lease_seconds=300,
+        poll=0.05,
+    ):
+        PollingGovernor.__init__(
+            self,
+            limit,
+            caps=caps,
+            timeout=timeout,
+            lease_seconds=lease_seconds,
+            poll=poll,
+        )
+        self.client = client
+        self.prefix = prefix
+
+    def try_acquire(self, priority, token):
+        now = time.time()
+        args = [
+            self.prefix,
+            token,
+            priority,
+            now,
+            now + self.lease_seconds,
+            now + self.poll * 16 + 1,
+            self.limit,
+            len(PRIORITIES),
+        ]
+        for name in PRIORITIES:
+            args.extend([name, self.caps.get(name, self.limit)])
+        return int(self.client.eval(REDIS_ACQUIRE, 0, *args)) == 1
+
+    def cancel(self, priority, token):
+        self.client.zrem(f"{self.prefix}:waiters:{priority}", token)
+
+    def release(self, priority, token):
+        self.client.zrem(f"{self.prefix}:slots:{priority}", token)
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(setting):
+    config = setting.get("GOVERNOR")
+    if not config:
+        return None
+    if isinstance(config, Governor):
+        return config
+
+    governor_type = config.get("type", "local")
+    assert governor_type in (
+        "local",
+        "sqlite",
+        "redis",
+    ), f"{governor_type} governor is not supported."
+    options = {
+        "caps": config.get("caps"),
+        "timeout": config.get("timeout"),
+    }
+    key = (
+        governor_type,
+        config.get("path"),
+        config.get("url"),
+        config.get("prefix"),
+        config.get("limit", 5),
+        tuple(sorted((config.get("caps") or {}).items())),
+    )
+    with _governors_lock:
+        # One per process and store, so every agency in the process shares it.
+        if key not in _governors:
+            if governor_type == "local":
+                _governors[key] = LocalGovernor(config.get("limit", 5), **options)
+            elif governor_type == "sqlite":
+                _governors[key] = SQLiteGovernor(
+                    config.get("path", "/tmp/nsagency_governor.db"),
+                    config.get("limit", 5),
+                    lease_seconds=config.get("lease_seconds", 300),
+                    **options,
+                )
+            else:
+                import redis
+
+                _governors[key] = RedisGovernor(
+                    redis.Redis.from_url(config["url"]),
+                    config.get("limit", 5),
+                    prefix=config.get("prefix", "nsagency:governor"),
+                    lease_seconds=config.get("lease_seconds", 300),
+                    **options,
+                )
+        return _governors[key]
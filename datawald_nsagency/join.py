@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import collections, threading
+from .suiteql import SuiteQLSource
+
+
+def get_path(record, path):
+    value = record
+    for key in path.split("|"):
+        if value is None:
+            return None
+        value = value.get(key)
+    return value
+
+
+class LRUCache(object):
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                else:
+                    missing.append(key)
+        return found, missing
+
+    def put_many(self, entries):
+        with self.lock:
+            for key, value in entries.items():
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+class JoinSpec(object):
+    """One JOIN entry: related rows fetched in bulk and merged onto the
+    records (`base`) or onto the lines of a sublist (`lines`).
+
+    {
+        "record_types": ["salesOrder"],
+        "query": "SELECT createdfrom, tranid, status FROM transaction
+                  WHERE type = 'CustInvc' AND createdfrom IN ({ids})",
+        "key": "internalId",
+        "join_key": "createdfrom",
+        "fields": ["invoice_tran_id|tranid", "invoice_status|status"],
+        "many": false,
+        "numeric_key": true
+    }
+
+    `record_types` is required: the entry only runs on pages of those record
+    types, since `key` means something else on other records. `key` is read
+    from each record (or line), `{ids}` is filled with a page's distinct
+    keys, and rows match on their `join_key` column.
+    Each `name|column` in `fields` sets `name` on the record to the first
+    match's column, or to the list of every match's column with `many`.
+    Line entries also name the `sublist` (e.g. "itemList|item"). Keys are
+    quoted unless `numeric_key` declares the join column numeric.
+    """
+
+    def __init__(self, config, lines=False):
+        self.record_types = config.get("record_types")
+        assert self.record_types, f"JOIN entry {config['query']!r} needs record_types."
+        self.query = config["query"]
+        self.key = config.get("key", "internalId")
+        self.join_key = config.get("join_key", "createdfrom")
+        self.fields = [tuple(field.split("|", 1)) for field in config["fields"]]
+        self.many = config.get("many", False)
+        self.numeric_key = config.get("numeric_key", False)
+        self.sublist = config["sublist"] if lines else None
+        self.chunk_size = int(config.get("chunk_size", 1000))
+
+    def applies(self, record_type):
+        return record_type in self.record_types
+
+    def targets(self, records):
+        if self.sublist is None:
+            return records
+        return [
+            line for record in records for line in (get_path(record, self.sublist) or [])
+        ]
+
+    def literal(self, key):
+        # Internal ids are compared as numbers so the IN list can use the index.
+        if self.numeric_key and key.isdigit():
+            return key
+        return SuiteQLSource.literal(key)
+
+    def project(self, row):
+        # Only the joined columns are indexed and cached.
+        return tuple(row.get(column) for _, column in self.fields)
+
+    def values(self, matches):
+        if self.many:
+            return {
+                name: [match[i] for match in matches]
+                for i, (name, _) in enumerate(self.fields)
+            }
+        match = matches[0] if matches else (None,) * len(self.fields)
+        return {name: match[i] for i, (name, _) in enumerate(self.fields)}
+
+
+class JoinEngine(object):
+    """Batch hash join of JOIN entries onto pages of source records.
+
+    Per entry and page: collect the distinct keys, look them up in an LRU
+    cache shared across pages, fetch the rest with one query per
+    `chunk_size` keys, index the rows by join key and merge in one pass.
+    """
+
+    def __init__(self, join, cache_size=10000):
+        self.specs = [JoinSpec(config) for config in join.get("base", [])] + [
+            JoinSpec(config, lines=True) for config in join.get("lines", [])
+        ]
+        self.cache = LRUCache(cache_size)
+
+    def enrich(self, record_type, records, fetch_all):
+        for spec in self.specs:
+            if not spec.applies(record_type):
+                continue
+            targets = spec.targets(records)
+            keys = [get_path(target, spec.key) for target in targets]
+            index = self.lookup(
+                spec, {str(key) for key in keys if key is not None}, fetch_all
+            )
+            for target, key in zip(targets, keys):
+                target.update(
+                    spec.values(index.get(str(key), []) if key is not None else [])
+                )
+        return records
+
+    def lookup(self, spec, keys, fetch_all):
+        found, missing = self.cache.get_many((spec.query, key) for key in keys)
+        index = {key: matches for (_, key), matches in found.items()}
+        missing = sorted(key for _, key in missing)
+        fetched = {key: [] for key in missing}
+        for i in range(0, len(missing), spec.chunk_size):
+            query = spec.query.format(
+                ids=", ".join(map(spec.literal, missing[i : i + spec.chunk_size]))
+            )
+            for row in fetch_all(query):
+                key = str(row.get(spec.join_key))
+                if key in fetched:
+                    fetched[key].append(spec.project(row))
+        # Keys without a match are cached too, so they are not asked again.
+        self.cache.put_many({(spec.query, key): rows for key, rows in fetched.items()})
+        index.update(fetched)
+        return index
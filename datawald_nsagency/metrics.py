@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import json, sys, threading, time
+from contextlib import contextmanager
+
+
+class Metrics(object):
+    """Aggregated timings and counters per (stage, tags), emitted on flush().
+
+    Only count/total/min/max are kept per key, so recording stays cheap and
+    memory does not grow with the number of records.
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = sinks or []
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    @staticmethod
+    def key(name, tags):
+        return (name, tuple(sorted(tags.items())))
+
+    def record(self, name, seconds, **tags):
+        self.record_key(self.key(name, tags), seconds)
+
+    def record_key(self, key, seconds):
+        # For hot paths that build their key once with Metrics.key().
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [1, seconds, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = min(timing[2], seconds)
+                timing[3] = max(timing[3], seconds)
+
+    @contextmanager
+    def timer(self, name, **tags):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, **tags)
+
+    def incr(self, name, value=1, **tags):
+        key = self.key(name, tags)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            timings, self.timings = self.timings, {}
+            counters, self.counters = self.counters, {}
+        return {
+            "timings": [
+                dict(
+                    dict(tags),
+                    name=name,
+                    count=count,
+                    total=total,
+                    min=minimum,
+                    max=maximum,
+                    avg=total / count,
+                )
+                for (name, tags), (count, total, minimum, maximum) in timings.items()
+            ],
+            "counters": [
+                dict(dict(tags), name=name, value=value)
+                for (name, tags), value in counters.items()
+            ],
+        }
+
+    def flush(self):
+        snapshot = self.snapshot()
+        if not snapshot["timings"] and not snapshot["counters"]:
+            return snapshot
+        for sink in self.sinks:
+            sink.emit(snapshot)
+        return snapshot
+
+
+class LogSummarySink(object):
+    def __init__(self, logger):
+        self.logger = logger
+
+    def emit(self, snapshot):
+        for timing in snapshot["timings"]:
+            tags = ", ".join(
+                f"{k}={v}"
+                for k, v in timing.items()
+                if k not in ("name", "count", "total", "min", "max", "avg")
+            )
+            self.logger.info(
+                f"Metrics {timing['name']}"
+                + (f" ({tags})" if tags else "")
+                + f": count={timing['count']}, total={timing['total']:.3f}s, "
+                f"avg={timing['avg'] * 1000:.2f}ms, max={timing['max'] * 1000:.2f}ms"
+            )
+        for counter in snapshot["counters"]:
+            self.logger.info(f"Metrics {counter['name']}: {counter}")
+
+
+class EMFSink(object):
+    # CloudWatch Embedded Metric Format, one JSON document per line.
+    def __init__(self, namespace="DataWald/NSAgency", stream=None):
+        self.namespace = namespace
+        self.stream = stream
+
+    def write(self, document):
+        (self.stream or sys.stdout).write(json.dumps(document, default=str) + "\n")
+
+    def emit(self, snapshot):
+        timestamp = int(time.time() * 1000)
+        for entry in snapshot["timings"] + snapshot["counters"]:
+            is_timing = "count" in entry
+            dimensions = [
+                k
+                for k in entry.keys()
+                if k not in ("count", "total", "min", "max", "avg", "value")
+            ]
+            metrics = (
+                [
+                    {"Name": "count", "Unit": "Count"},
+                    {"Name": "total_ms", "Unit": "Milliseconds"},
+                    {"Name": "max_ms", "Unit": "Milliseconds"},
+                ]
+                if is_timing
+                else [{"Name": "value", "Unit": "Count"}]
+            )
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [dimensions],
+                            "Metrics": metrics,
+                        }
+                    ],
+                },
+            }
+            document.update({k: entry[k] for k in dimensions})
+            if is_timing:
+                document.update(
+                    {
+                        "count": entry["count"],
+                        "total_ms": entry["total"] * 1000,
+                        "max_ms": entry["max"] * 1000,
+                    }
+                )
+            else:
+                document["value"] = entry["value"]
+            self.write(document)
+
+
+class InMemorySink(object):
+    def __init__(self):
+        self.snapshots = []
+
+    def emit(self, snapshot):
+        self.snapshots.append(snapshot)
+
+
+def get_metrics(setting, logger):
+    sinks = []
+    for sink in setting.get("METRICS_SINKS", ["log"]):
+        if not isinstance(sink, str):
+            sinks.append(sink)
+        elif sink == "log":
+            sinks.append(LogSummarySink(logger))
+        elif sink == "emf":
+            sinks.append(EMFSink(setting.get("METRICS_NAMESPACE", "DataWald/NSAgency")))
+        elif sink == "memory":
+            sinks.append(InMemorySink())
+        else:
+            raise AssertionError(f"{sink} metrics sink is not supported.")
+    return Metrics(sinks)
+
+
+class ProgressReporter(object):
+    """Logs progress at most once every `interval` seconds (and at 100%)."""
+
+    def __init__(self, logger, label, total, interval=10.0):
+        self.logger = logger
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.completed = 0
+        self.reported_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def advance(self, count=1):
+        with self.lock:
+            self.completed += count
+            now = time.monotonic()
+            if self.completed < self.total and now - self.reported_at < self.interval:
+                return
+            self.reported_at = now
+            completed = self.completed
+        progress_percent = (completed / self.total) * 100 if self.total else 100.0
+        self.logger.info(f"Progress ({self.label}): {progress_percent:.2f}%")
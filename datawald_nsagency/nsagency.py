@@ -4,51 +4,356 @@ from __future__ import print_function
 
 __author__ = "bibow"
 
-import traceback, boto3, json, asyncio, time, requests
+import traceback, json, time, logging, functools, os, hashlib
+import collections, itertools, mmap, queue, random, tempfile, threading
 import concurrent.futures
 from datawald_agency import Agency
-from datawald_connector import DatawaldConnector
-from suitetalk_connector import SOAPConnector, RESTConnector
 from datetime import datetime, timedelta
 from pytz import timezone
-import concurrent.futures
+from .transform_plan import TransformPlan, UnsupportedMapping
+from . import cache
+from .checkpoint import SyncCheckpoint, checkpoint_key, get_checkpoint_store
+from .backfill import merge_entities, plan_backfill_shards, run_backfill_shard
+from .fingerprint import fingerprint, fingerprint_key, get_fingerprint_store
+from .metrics import Metrics, ProgressReporter, get_metrics
+from .columnar import filter_inventorylots
+from .projection import get_field_projection
+from .suiteql import SuiteQLSource
+from .governor import get_governor
+from .join import JoinEngine
+from .target import ReferenceCache, ReferenceLookup, TargetMapping, UnmappedCode
+
+# Fault markers NetSuite returns when the account concurrency/request limit is hit.
+CONCURRENCY_FAULT_CODES = [
+    "WS_CONCURRENCY_EXCEEDED",
+    "WS_REQUEST_BLOCKED",
+    "ExceededConcurrentRequestLimitFault",
+    "ExceededRequestLimitFault",
+    "CONCURRENT_REQUEST_LIMIT_EXCEEDED",
+    "Too Many Requests",
+    "429",
+]
+
+# Faults worth retrying a page for, besides the concurrency faults above.
+TRANSIENT_FAULT_CODES = [
+    "UNEXPECTED_ERROR",
+    "SSS_REQUEST_TIME_EXCEEDED",
+    "timed out",
+    "Timeout",
+    "Connection reset",
+    "Connection aborted",
+    "RemoteDisconnected",
+    "Service Unavailable",
+    "Bad Gateway",
+    "Gateway Time-out",
+]
+
+
+class PageFetchConcurrency(object):
+    # Additive-increase/multiplicative-decrease limit for page fetches: grow by
+    # one after a full round of clean pages, halve on a concurrency fault.
+    # `generation` counts the decreases; pages submitted before the last one
+    # belong to the congestion event it already answered.
+    def __init__(self, limit, max_limit=None, adaptive=False):
+        self.limit = max(int(limit), 1)
+        self.max_limit = max(int(max_limit or limit), self.limit)
+        self.adaptive = adaptive
+        self.successes = 0
+        self.generation = 0
+
+    def on_success(self):
+        if not self.adaptive:
+            return
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self.successes = 0
+
+    def on_fault(self, generation):
+        # Whether the limit was lowered for this fault.
+        if generation < self.generation:
+            return False
+        self.successes = 0
+        self.limit = max(self.limit // 2, 1)
+        self.generation += 1
+        return True
+
+
+_DUPLICATE_CUSTOM_FIELD = object()
+# "@scriptId" mapping keys -> customFieldList scriptIds.
+_custom_field_keys = {}
+
+class RecordPage(list):
+    # One search page of records, tagged with where it came from.
+    def __init__(self, records, page_index=None, search_id=None, total_pages=None):
+        list.__init__(self, records)
+        self.page_index = page_index
+        self.search_id = search_id
+        self.total_pages = total_pages
+
+
+class EntityExtractor(object):
+    # src_metadata keys, timezone and log level resolved once per tx_type and
+    # run instead of once per record.
+    __slots__ = (
+        "tx_type",
+        "src_id",
+        "created_at",
+        "updated_at",
+        "utc",
+        "debug",
+        "metrics_key",
+    )
+
+    def __init__(self, tx_type, src_metadata, debug=False):
+        self.tx_type = tx_type
+        self.src_id = src_metadata["src_id"]
+        self.created_at = src_metadata["created_at"]
+        self.updated_at = src_metadata["updated_at"]
+        self.utc = timezone("UTC")
+        self.debug = debug
+        self.metrics_key = Metrics.key("transform", {"tx_type": tx_type})
+
+    def __call__(self, raw_entity):
+        # Entities stay plain dicts: tx_*_src fills them in and DataWald
+        # receives them as they are.
+        return {
+            "src_id": raw_entity[self.src_id],
+            "created_at": raw_entity[self.created_at].astimezone(self.utc),
+            "updated_at": raw_entity[self.updated_at].astimezone(self.utc),
+        }
+
+
+class LazyConnector(object):
+    # Stands in for a connector and builds it on first attribute access, so
+    # calls that never touch NetSuite or DataWald skip the client setup.
+    # `wrap(name, attribute)` can decorate what is handed out.
+    def __init__(self, factory, wrap=None):
+        self._factory = factory
+        self._wrap = wrap
+        self._connector = None
+        self._lock = threading.Lock()
+
+    @property
+    def connector(self):
+        if self._connector is None:
+            with self._lock:
+                if self._connector is None:
+                    self._connector = self._factory()
+        return self._connector
+
+    def __getattr__(self, name):
+        if self._wrap is None:
+            return getattr(self.connector, name)
+        return self._wrap(name, getattr(self.connector, name))
+
+
+# Connector methods that write to NetSuite (governor priority "write").
+WRITE_OPERATIONS = ("insert_update", "upsert", "add", "update", "delete")
+
+
+# Connectors kept for the process with CONNECTOR_CACHE, keyed by settings.
+_connectors = {}
+_connectors_lock = threading.Lock()
+
+
+# Per-process agency used by the "process" transform mode.
+_transform_worker_agency = None
+
+
+def _init_transform_worker(agency_class, setting, tx_map):
+    # Build a transform-only agency once per worker process; the connectors
+    # are not needed (nor picklable) for transform_data.
+    global _transform_worker_agency
+    agency = agency_class.__new__(agency_class)
+    agency.logger = logging.getLogger(agency_class.__module__)
+    agency.setting = setting
+    agency.map = tx_map
+    agency.join = setting.get("JOIN", {"base": [], "lines": []})
+    agency.num_async_tasks = int(setting.get("NUM_ASYNC_TASKS", 10))
+    agency.transform_mode = "thread"
+    agency.init_runtime()
+    _transform_worker_agency = agency
+
+
+def _tx_entity_src_worker(func_name, raw_entity, kwargs):
+    return getattr(_transform_worker_agency, func_name)(raw_entity, **kwargs)
+
 
 class NSAgency(Agency):
     def __init__(self, logger, **setting):
         self.logger = logger
         self.setting = setting
-        self.soap_connector = SOAPConnector(logger, **setting)
-        self.rest_connector = RESTConnector(logger, **setting)
-        self.datawald = DatawaldConnector(logger, **setting)
+        self.soap_connector = LazyConnector(
+            functools.partial(self.get_connector, "soap", self.build_soap_connector),
+            wrap=self.governed,
+        )
+        self.rest_connector = LazyConnector(
+            functools.partial(self.get_connector, "rest", self.build_rest_connector),
+            wrap=self.governed,
+        )
+        self.datawald = LazyConnector(
+            functools.partial(
+                self.get_connector, "datawald", self.build_datawald_connector
+            )
+        )
         Agency.__init__(self, logger, datawald=self.datawald)
         if setting.get("tx_type"):
             Agency.tx_type = setting.get("tx_type")
 
-        if setting.get("TXMAP_BUCKET") and setting.get("TXMAP_KEY"):
-            obj = self.s3(setting).get_object(
-                Bucket=setting.get("TXMAP_BUCKET"), Key=setting.get("TXMAP_KEY")
-            )
-            self.map = json.loads(obj["Body"].read().decode("utf8"))
-        else:
-            self.map = setting.get("TXMAP", {})
+        # The TXMAP is loaded on first use (see the map property).
+        self._map = None
 
         self.join = setting.get("JOIN", {"base": [], "lines": []})
-        self.num_async_tasks = setting.get("NUM_ASYNC_TASKS", 10)
+        self.num_async_tasks = int(setting.get("NUM_ASYNC_TASKS", 10))
+        self.transform_mode = setting.get("TRANSFORM_MODE", "thread")
+        assert self.transform_mode in (
+            "thread",
+            "process",
+        ), f"{self.transform_mode} is not a supported TRANSFORM_MODE."
+        self.init_runtime()
+
+    @property
+    def map(self):
+        if self._map is None:
+            if self.setting.get("TXMAP_BUCKET") and self.setting.get("TXMAP_KEY"):
+                self._map = cache.get_json_object(
+                    lambda: self.s3(self.setting),
+                    self.setting.get("TXMAP_BUCKET"),
+                    self.setting.get("TXMAP_KEY"),
+                    ttl=float(self.setting.get("TXMAP_CACHE_TTL", 300)),
+                )
+            else:
+                self._map = self.setting.get("TXMAP", {})
+        return self._map
+
+    @map.setter
+    def map(self, value):
+        self._map = value
+
+    @property
+    def soap_connector_class(self):
+        from suitetalk_connector import SOAPConnector
+
+        return SOAPConnector
+
+    def build_soap_connector(self):
+        return self.soap_connector_class(self.logger, **self.setting)
+
+    def soap_connector_has(self, operation):
+        # Ask the class of a lazy connector, so picking a write path does
+        # not build the connector.
+        if isinstance(self.soap_connector, LazyConnector):
+            return hasattr(self.soap_connector_class, operation)
+        return hasattr(self.soap_connector, operation)
+
+    def build_rest_connector(self):
+        from suitetalk_connector import RESTConnector
+
+        return RESTConnector(self.logger, **self.setting)
+
+    def build_datawald_connector(self):
+        from datawald_connector import DatawaldConnector
+
+        return DatawaldConnector(self.logger, **self.setting)
+
+    def get_connector(self, name, build):
+        # With CONNECTOR_CACHE, warm invocations with the same settings reuse
+        # the connector (and its parsed WSDL/service definitions).
+        if not self.setting.get("CONNECTOR_CACHE", False):
+            return build()
+
+        key = (
+            self.__class__.__name__,
+            name,
+            hashlib.sha1(
+                json.dumps(self.setting, sort_keys=True, default=str).encode("utf8")
+            ).hexdigest(),
+        )
+        with _connectors_lock:
+            if key not in _connectors:
+                _connectors[key] = build()
+            return _connectors[key]
+
+    @property
+    def governor(self):
+        if self._governor is None:
+            self._governor = get_governor(self.setting)
+        return self._governor
+
+    def governed(self, name, funct):
+        # Every NetSuite call holds a governor slot while it runs; writes
+        # outrank reads, and backfill reads rank last.
+        if not callable(funct) or self.governor is None:
+            return funct
+        priority = (
+            "write"
+            if name.startswith(WRITE_OPERATIONS)
+            else self.setting.get("GOVERNOR_READ_PRIORITY", "read")
+        )
+
+        @functools.wraps(funct)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            with self.governor.slot(priority):
+                self.metrics.record(
+                    "governor_wait", time.perf_counter() - start, priority=priority
+                )
+                return funct(*args, **kwargs)
+
+        return call
+
+    def init_runtime(self):
+        # Per-agency caches and pools, created lazily on first use.
+        self._transform_executor = None
+        self._transform_plans = {}
+        self._field_projections = {}
+        self._suiteql_sources = {}
+        self._custom_field_indexes = threading.local()
+        self._checkpoint_store = None
+        self._fingerprint_store = None
+        self._governor = None
+        self._join_engine = None
+        self._target_mapping = None
+        self._reference_cache = None
+        self.unmapped_codes = collections.Counter()
+        self._unmapped_codes_lock = threading.Lock()
+        self._staged_sync_state = []
+        self._entity_extractors = {}
+        self.skipped_entities = {}
+        self.failed_pages = []
+        self.read_pages = []
+        # SyncCheckpoint of the tx_*_src run in progress, kept out of kwargs
+        # since those are pickled for a process transform pool.
+        self.sync_checkpoint = None
+        self.metrics = get_metrics(self.setting, self.logger)
 
     def s3(self, setting):
-        if (
-            setting.get("region_name")
-            and setting.get("aws_access_key_id")
-            and setting.get("aws_secret_access_key")
-        ):
-            return boto3.client(
-                "s3",
-                region_name=setting.get("region_name"),
-                aws_access_key_id=setting.get("aws_access_key_id"),
-                aws_secret_access_key=setting.get("aws_secret_access_key"),
-            )
-        else:
-            return boto3.client("s3")
+        if setting.get("S3_LOCAL_ROOT"):
+            return cache.FileSystemObjectStore(setting.get("S3_LOCAL_ROOT"))
+        return get_client(
+            "s3",
+            region_name=setting.get("region_name"),
+            aws_access_key_id=setting.get("aws_access_key_id"),
+            aws_secret_access_key=setting.get("aws_secret_access_key"),
+            max_pool_connections=int(setting.get("S3_MAX_POOL_CONNECTIONS", 10)),
+            connect_timeout=float(setting.get("HTTP_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(setting.get("HTTP_READ_TIMEOUT", 60)),
+        )
+
+    @property
+    def http_session(self):
+        return get_http_session(
+            pool_size=int(self.setting.get("HTTP_POOL_SIZE", 10)),
+            max_retries=int(self.setting.get("HTTP_MAX_RETRIES", 0)),
+        )
+
+    @property
+    def http_timeout(self):
+        return (
+            float(self.setting.get("HTTP_CONNECT_TIMEOUT", 5)),
+            float(self.setting.get("HTTP_READ_TIMEOUT", 60)),
+        )
 
     @property
     def payment_methods(self):
@@ -62,96 +367,273 @@ class NSAgency(Agency):
     def countries(self):
         return self.setting.get("COUNTRIES", {"US": "_unitedStates"})
 
+    @property
+    def target_mapping(self):
+        # Built once per agency from the mapping properties above.
+        if self._target_mapping is None:
+            self._target_mapping = TargetMapping(
+                self.payment_methods,
+                self.ship_methods,
+                self.countries,
+                self.setting.get(
+                    "TERMS", {"Net 15": ["Net Terms"], "Credit Card": ["Visa"]}
+                ),
+            )
+        return self._target_mapping
+
     def get_term(self, payment_method):
-        terms = self.setting.get(
-            "TERMS", {"Net 15": ["Net Terms"], "Credit Card": ["Visa"]}
-        )
+        return self.target_mapping.terms.get(payment_method)
 
-        for term, payment_methods in terms.items():
-            if payment_method in payment_methods:
-                return term
-        return None
+    @property
+    def reference_cache(self):
+        if self._reference_cache is None:
+            self._reference_cache = ReferenceCache(
+                [
+                    ReferenceLookup(name, config)
+                    for name, config in self.setting.get(
+                        "REFERENCE_LOOKUPS", {}
+                    ).items()
+                ],
+                cache_size=int(self.setting.get("REFERENCE_CACHE_SIZE", 10000)),
+            )
+        return self._reference_cache
+
+    def resolve_references(self, transactions):
+        # Internal ids for a whole batch, one query per lookup and key set.
+        if not self.reference_cache.lookups or not transactions:
+            return transactions
+        try:
+            with self.metrics.timer("reference_lookup"):
+                unresolved = self.reference_cache.resolve(
+                    [
+                        transaction
+                        for transaction in transactions
+                        if transaction.get("tx_status") != "F"
+                    ],
+                    self.execute_suiteql_all,
+                )
+        except Exception:
+            # Treated like keys not found: the batch is written without the
+            # ids, and NetSuite fails the records that need them.
+            self.metrics.incr("reference_lookup_errors")
+            self.logger.exception("Failed to resolve references.")
+            return transactions
+        for name, keys in unresolved.items():
+            self.metrics.incr("unresolved_references", len(keys), lookup=name)
+            self.logger.warning(
+                f"{len(keys)} {name} references not found: {sorted(keys)[:20]}"
+            )
+        return transactions
+
+    def count_unmapped_code(self, exception):
+        with self._unmapped_codes_lock:
+            self.unmapped_codes[(exception.field, exception.code)] += 1
+
+    def report_unmapped_codes(self):
+        # One summary per batch instead of one error per record.
+        with self._unmapped_codes_lock:
+            unmapped_codes, self.unmapped_codes = (
+                self.unmapped_codes,
+                collections.Counter(),
+            )
+        fields = {}
+        for (field, code), count in unmapped_codes.items():
+            fields.setdefault(field, {})[code] = count
+            self.metrics.incr("unmapped_codes", count, field=field)
+        for field, codes in fields.items():
+            self.logger.error(f"Unmapped {field} codes (records): {codes}")
+        return fields
+
+    def get_product_metadatas(self, **kwargs):
+        ttl = float(self.setting.get("PRODUCT_METADATAS_CACHE_TTL", 300))
+        if ttl <= 0:
+            return super(NSAgency, self).get_product_metadatas(**kwargs)
+
+        return cache.get_value(
+            (
+                "product_metadatas",
+                self.setting.get("ACCOUNT"),
+                kwargs.get("target"),
+                kwargs.get("tx_type"),
+            ),
+            lambda: super(NSAgency, self).get_product_metadatas(**kwargs),
+            ttl=ttl,
+        )
 
     def get_record_type(self, tx_type):
         return self.setting["data_type"].get(tx_type)
 
-    # Define your asynchronous function here (async_tx_entity_src)
-    async def async_tx_entity_src(self, tx_entity_src, raw_entity, **kwargs):
-        # Your asynchronous code here
-        return tx_entity_src(raw_entity, **kwargs)
+    def get_progress_reporter(self, label, total):
+        return ProgressReporter(
+            self.logger,
+            label,
+            total,
+            interval=float(self.setting.get("PROGRESS_INTERVAL", 10)),
+        )
+
+    @property
+    def transform_executor(self):
+        # One long-lived pool per agency, shared by every tx_*_src call.
+        if self._transform_executor is None:
+            if self.transform_mode == "process":
+                self._transform_executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.num_async_tasks,
+                    initializer=_init_transform_worker,
+                    initargs=(self.__class__, self.setting, self.map),
+                )
+            else:
+                self._transform_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.num_async_tasks,
+                    thread_name_prefix="nsagency-transform",
+                )
+        return self._transform_executor
+
+    def close(self):
+        if self._transform_executor is not None:
+            self._transform_executor.shutdown(wait=True)
+            self._transform_executor = None
+
+    def dispatch_tx_entity_src(self, tx_entity_src, raw_entities, **kwargs):
+        if self.transform_mode == "process":
+            # Batch records per IPC round trip; the worker resolves the
+            # bound method on its own agency by name.
+            chunksize = max(1, len(raw_entities) // (self.num_async_tasks * 4))
+            return self.transform_executor.map(
+                _tx_entity_src_worker,
+                [tx_entity_src.__name__] * len(raw_entities),
+                raw_entities,
+                [kwargs] * len(raw_entities),
+                chunksize=chunksize,
+            )
+
+        tasks = [
+            self.transform_executor.submit(tx_entity_src, raw_entity, **kwargs)
+            for raw_entity in raw_entities
+        ]
+        return (task.result() for task in concurrent.futures.as_completed(tasks))
 
     ## We can move the decorator to the uplevel.
     def tx_entities_src_decorator():
         def decorator(func):
+            @functools.wraps(func)
             def wrapper(self, *args, **kwargs):
                 try:
+                    self._entity_extractors = {}
+                    self.failed_pages = []
+                    self.read_pages = []
                     hours = float(kwargs.get("hours", 0.0))
-                    cut_date = kwargs.get("cut_date").astimezone(
+                    cut_date = kwargs.get("cut_date")
+                    if isinstance(cut_date, str):
+                        cut_date = datetime.strptime(cut_date, "%Y-%m-%dT%H:%M:%S%z")
+                    cut_date = cut_date.astimezone(
                         timezone(self.setting.get("TIMEZONE", "UTC"))
                     )
                     end_date = datetime.now(
                         tz=timezone(self.setting.get("TIMEZONE", "UTC"))
                     )
 
+                    checkpoint = self.get_sync_checkpoint(**kwargs)
+                    self.sync_checkpoint = checkpoint
+                    resume = checkpoint.resume if checkpoint is not None else None
+                    if (
+                        checkpoint is not None
+                        and resume is None
+                        and checkpoint.committed_watermark is not None
+                        and self.setting.get("CHECKPOINT_USE_WATERMARK", True)
+                    ):
+                        # Start incremental pulls from the last committed run.
+                        cut_date = max(
+                            cut_date,
+                            datetime.strptime(
+                                checkpoint.committed_watermark, "%Y-%m-%dT%H:%M:%S%z"
+                            ).astimezone(timezone(self.setting.get("TIMEZONE", "UTC"))),
+                        )
+
                     if hours > 0.0:
                         end_date = cut_date + timedelta(hours=hours)
+                    if kwargs.get("fixed_window") and self.window_end_inclusive(
+                        kwargs.get("tx_type")
+                    ):
+                        # Backfill shards are half-open; the next shard reads
+                        # the boundary second.
+                        end_date -= timedelta(seconds=1)
+
+                    cut_date = cut_date.strftime("%Y-%m-%dT%H:%M:%S%z")
+                    end_date = end_date.strftime("%Y-%m-%dT%H:%M:%S%z")
+                    if resume is not None:
+                        self.logger.info(
+                            f"Resuming {checkpoint.key} at search {resume['search_id']}, "
+                            f"{len(resume['completed_pages'])}/{resume['total_pages']} pages done."
+                        )
+                        cut_date, end_date = resume["cut_date"], resume["end_date"]
+                    if checkpoint is not None:
+                        checkpoint.start(cut_date, end_date)
+                    # From here on the SyncCheckpoint object is passed instead.
+                    kwargs.pop("checkpoint", None)
 
                     kwargs = dict(
                         kwargs,
                         **{
-                            "cut_date": cut_date.strftime("%Y-%m-%dT%H:%M:%S%z"),
-                            "end_date": end_date.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                            "cut_date": cut_date,
+                            "end_date": end_date,
+                            "resume": resume,
+                            # Per call only: a generator where the caller
+                            # expects a list would never be consumed.
+                            "stream": bool(kwargs.get("stream", False)),
+                            "pipeline": bool(
+                                kwargs.get(
+                                    "pipeline",
+                                    self.setting.get("PIPELINE_MODE", False),
+                                )
+                            ),
                         },
                     )
 
                     tx_entity_src, raw_entities = func(self, *args, **kwargs)
+                    # Only the search needs it; the transforms do not.
+                    kwargs.pop("resume", None)
 
                     if kwargs.get("tx_type") == "product":
                         kwargs.update(
                             {"metadatas": self.get_product_metadatas(**kwargs)}
                         )
 
-                    # Define a wrapper worker for the asynchronous task
-                    async def task_wrapper(tx_entity_src, raw_entity, **kwargs):
-                        return await self.async_tx_entity_src(
-                            tx_entity_src, raw_entity, **kwargs
+                    if kwargs["stream"]:
+                        # raw_entities is an iterator of pages here.
+                        return self.stream_tx_entities_src(
+                            tx_entity_src, raw_entities, checkpoint=checkpoint, **kwargs
                         )
 
-                    ## Create a pool of 10 processes
-                    tasks = []
-                    with concurrent.futures.ThreadPoolExecutor(
-                        max_workers=50
-                    ) as executor:
-                        # Dispatch asynchronous tasks to different processes for raw_entity
-                        for raw_entity in raw_entities:
-                            tasks.append(
-                                executor.submit(
-                                    asyncio.run,
-                                    task_wrapper(tx_entity_src, raw_entity, **kwargs),
-                                )
+                    if kwargs["pipeline"]:
+                        entities = [
+                            entity
+                            for entities in self.stream_tx_entities_src(
+                                tx_entity_src,
+                                raw_entities,
+                                skip_unchanged=False,
+                                **kwargs,
                             )
+                            for entity in entities
+                        ]
+                        return self.stage_sync_state(checkpoint, entities, **kwargs)
 
-                    # Track progress and calculate the percentage
-                    total_tasks = len(tasks)
-                    completed_tasks = 0
+                    progress = self.get_progress_reporter(
+                        f"transferring {kwargs.get('tx_type')}", len(raw_entities)
+                    )
+
+                    raw_entities = self.enrich_raw_entities(raw_entities, **kwargs)
 
-                    # Gather the tasks' results from the processes
+                    # Gather the results from the shared transform pool.
                     entities = []
-                    for task in concurrent.futures.as_completed(tasks):
-                        result = task.result()
+                    for result in self.dispatch_tx_entity_src(
+                        tx_entity_src, raw_entities, **kwargs
+                    ):
                         entities.append(result)
-                        completed_tasks += 1
-                        progress_percent = (completed_tasks / total_tasks) * 100
-                        self.logger.info(
-                            f"Progress (transferring {kwargs.get('tx_type')}): {progress_percent:.2f}%"
-                        )
+                        progress.advance()
 
-                    # entities = list(
-                    #     map(
-                    #         lambda raw_entity: tx_entity_src(raw_entity, **kwargs),
-                    #         raw_entities,
-                    #     )
-                    # )
+                    entities = self.batch_tx_entities_src(entities, **kwargs)
+                    entities = self.stage_sync_state(checkpoint, entities, **kwargs)
+                    self.metrics.flush()
                     return entities
                 except Exception:
                     self.logger.info(kwargs)
@@ -163,42 +645,380 @@ class NSAgency(Agency):
 
         return decorator
 
+    @property
+    def checkpoint_store(self):
+        if self._checkpoint_store is None:
+            self._checkpoint_store = get_checkpoint_store(self.setting)
+        return self._checkpoint_store
+
+    def get_sync_checkpoint(self, **kwargs):
+        if self.checkpoint_store is None or kwargs.get("checkpoint") is False:
+            return None
+        return SyncCheckpoint(self.checkpoint_store, checkpoint_key(**kwargs))
+
+    def backfill(
+        self,
+        source,
+        cut_date,
+        end_date=None,
+        shard_hours=24,
+        partitions=None,
+        mode="process",
+        **kwargs,
+    ):
+        """Run a historical pull as independent time (and partition) shards.
+
+        `source` is "transactions", "assets" or "persons"; kwargs (tx_type,
+        target, ...) are passed to every shard. In "process" mode the shards
+        run in a local process pool and the merged entities are returned; in
+        "lambda" mode each shard is sent asynchronously to the function in
+        BACKFILL_FUNCTION_NAME (an NSAgent retrieve_entities_from_source
+        deployment) and the planned shards are returned.
+
+        Shards are half-open, [cut_date, cut_date + shard_hours), so a record
+        on a boundary is read by one shard only. In "process" mode every
+        shard's entities are held until all shards are merged; split a large
+        history into several calls, or use "lambda" mode, to bound memory.
+        """
+        end_date = end_date or datetime.now(
+            tz=timezone(self.setting.get("TIMEZONE", "UTC"))
+        )
+        shards = plan_backfill_shards(
+            cut_date, end_date, shard_hours, partitions=partitions, **kwargs
+        )
+        self.logger.info(f"Backfill {source}: {len(shards)} shards ({mode}).")
+
+        if mode == "lambda":
+            function_name = self.setting.get("BACKFILL_FUNCTION_NAME")
+            assert function_name, "BACKFILL_FUNCTION_NAME is required for lambda mode."
+            client = get_client(
+                "lambda",
+                region_name=self.setting.get("region_name"),
+                aws_access_key_id=self.setting.get("aws_access_key_id"),
+                aws_secret_access_key=self.setting.get("aws_secret_access_key"),
+            )
+            for shard in shards:
+                client.invoke(
+                    FunctionName=function_name,
+                    InvocationType="Event",
+                    Payload=json.dumps(
+                        dict(shard, **{"checkpoint": False, "fixed_window": True})
+                    ),
+                )
+            return shards
+
+        assert mode == "process", f"{mode} is not a supported backfill mode."
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=int(self.setting.get("BACKFILL_WORKERS", os.cpu_count() or 1))
+        ) as executor:
+            results = list(
+                executor.map(
+                    run_backfill_shard,
+                    itertools.repeat(self.__class__),
+                    itertools.repeat(
+                        dict(self.setting, **{"GOVERNOR_READ_PRIORITY": "backfill"})
+                    ),
+                    itertools.repeat(source),
+                    shards,
+                )
+            )
+        return merge_entities(shards, results)
+
+    @property
+    def fingerprint_store(self):
+        if self._fingerprint_store is None:
+            self._fingerprint_store = get_fingerprint_store(self.setting)
+        return self._fingerprint_store
+
+    def filter_unchanged_entities(self, entities, **kwargs):
+        # Drop entities whose transformed data hashes the same as what was
+        # last shipped; returns the rest and their new fingerprints.
+        if self.fingerprint_store is None or kwargs.get("fingerprint") is False:
+            return entities, {}
+
+        tx_type = kwargs.get("tx_type")
+        fingerprints = {
+            str(entity["src_id"]): fingerprint(entity["data"])
+            for entity in entities
+            if entity.get("tx_status") != "F"
+        }
+        shipped = self.fingerprint_store.get_many(
+            fingerprint_key(**kwargs), list(fingerprints.keys())
+        )
+        unchanged = {
+            src_id
+            for src_id, value in fingerprints.items()
+            if shipped.get(src_id) == value
+        }
+        if unchanged:
+            self.skipped_entities[tx_type] = self.skipped_entities.get(
+                tx_type, 0
+            ) + len(unchanged)
+            self.logger.info(f"Skipped {len(unchanged)} unchanged {tx_type} entities.")
+            entities = [
+                entity for entity in entities if str(entity["src_id"]) not in unchanged
+            ]
+        return entities, {
+            src_id: value
+            for src_id, value in fingerprints.items()
+            if src_id not in unchanged
+        }
+
+    def stage_sync_state(self, checkpoint, entities, **kwargs):
+        # A list result is only safe to checkpoint and fingerprint once it has
+        # been handed off, so both wait for commit_sync_state().
+        if checkpoint is not None:
+            for entity in entities:
+                checkpoint.observe(entity["updated_at"])
+            if self.keep_run_open(checkpoint):
+                self._staged_sync_state.append(
+                    functools.partial(
+                        self.save_read_pages, checkpoint, list(self.read_pages)
+                    )
+                )
+            else:
+                self._staged_sync_state.append(checkpoint.commit)
+
+        entities, fingerprints = self.filter_unchanged_entities(entities, **kwargs)
+        if fingerprints:
+            self._staged_sync_state.append(
+                functools.partial(
+                    self.fingerprint_store.put_many,
+                    fingerprint_key(**kwargs),
+                    fingerprints,
+                )
+            )
+        return entities
+
+    def keep_run_open(self, checkpoint):
+        # Pages that still failed (skip or defer) must not move the watermark
+        # past their records: the run stays open instead of committed.
+        failed = [page["page_index"] for page in self.failed_pages]
+        if failed:
+            self.logger.warning(
+                f"{checkpoint.key} left open; pages {failed} of this run failed."
+            )
+        return bool(failed)
+
+    def track_pages(self, pages):
+        # Note which pages of which search were read, for save_read_pages.
+        for page in pages:
+            self.read_pages.append(
+                (
+                    getattr(page, "search_id", None),
+                    getattr(page, "total_pages", None),
+                    getattr(page, "page_index", None),
+                )
+            )
+            yield page
+
+    def save_read_pages(self, checkpoint, read_pages):
+        # Progress of a list result that was handed off with failed pages.
+        # One saved search can be resumed for the missing pages; otherwise
+        # (no pages, or split windows) the next run starts over from the
+        # committed watermark.
+        searches = {(search_id, total_pages) for search_id, total_pages, _ in read_pages}
+        if len(searches) != 1 or None in next(iter(searches)):
+            self.logger.warning(
+                f"{checkpoint.key} cannot be resumed; the next run reads again "
+                "from the last committed watermark."
+            )
+            return
+        [(search_id, total_pages)] = searches
+        checkpoint.search_started(search_id, total_pages)
+        for _, _, page_index in read_pages:
+            checkpoint.page_completed(page_index)
+        self.logger.warning(
+            f"{checkpoint.key} left open at search {search_id}; the next run "
+            "reads only the missing pages."
+        )
+
+    def commit_sync_state(self):
+        while self._staged_sync_state:
+            self._staged_sync_state.pop(0)()
+
+    def stream_tx_entities_src(
+        self, tx_entity_src, raw_pages, checkpoint=None, skip_unchanged=True, **kwargs
+    ):
+        chunk_size = int(
+            kwargs.get("chunk_size", self.setting.get("STREAM_CHUNK_SIZE", 1000))
+        )
+        stats = {
+            "pages": 0,
+            "fetch": 0.0,
+            "fetch_blocked": 0.0,
+            "transform": 0.0,
+            "transform_blocked": 0.0,
+        }
+        if kwargs.get("pipeline"):
+            raw_pages = self.pipeline_pages(raw_pages, stats)
+
+        def filter_chunk(chunk):
+            chunk = self.batch_tx_entities_src(chunk, **kwargs)
+            if not skip_unchanged:
+                return chunk, {}
+            return self.filter_unchanged_entities(chunk, **kwargs)
+
+        def chunk_handed_off(page_indexes, fingerprints):
+            # The consumer asked for more, so it is done with earlier chunks.
+            if fingerprints:
+                self.fingerprint_store.put_many(fingerprint_key(**kwargs), fingerprints)
+            if checkpoint is not None:
+                for page_index in page_indexes:
+                    checkpoint.page_completed(page_index)
+            del page_indexes[:]
+
+        try:
+            start = time.perf_counter()
+            chunk = []
+            chunk_pages = []
+            for raw_entities in raw_pages:
+                if checkpoint is not None and getattr(raw_entities, "search_id", None):
+                    checkpoint.search_started(
+                        raw_entities.search_id, raw_entities.total_pages
+                    )
+                transform_start = time.perf_counter()
+                raw_entities = self.enrich_raw_entities(raw_entities, **kwargs)
+                for entity in self.dispatch_tx_entity_src(
+                    tx_entity_src, raw_entities, **kwargs
+                ):
+                    if checkpoint is not None:
+                        checkpoint.observe(entity["updated_at"])
+                    chunk.append(entity)
+                    if len(chunk) >= chunk_size:
+                        stats["transform"] += time.perf_counter() - transform_start
+                        chunk, fingerprints = filter_chunk(chunk)
+                        if chunk:
+                            yield chunk
+                        chunk_handed_off(chunk_pages, fingerprints)
+                        transform_start = time.perf_counter()
+                        chunk = []
+                stats["transform"] += time.perf_counter() - transform_start
+                if getattr(raw_entities, "page_index", None) is not None:
+                    chunk_pages.append(raw_entities.page_index)
+            chunk, fingerprints = filter_chunk(chunk)
+            if chunk:
+                yield chunk
+            chunk_handed_off(chunk_pages, fingerprints)
+            if checkpoint is not None and not self.keep_run_open(checkpoint):
+                checkpoint.commit()
+
+            if kwargs.get("pipeline"):
+                # Whichever side spent longer blocked on the queue is waiting
+                # on the other one: that other side is the bottleneck.
+                stats["wall"] = time.perf_counter() - start
+                for stage in [
+                    "fetch",
+                    "transform",
+                    "fetch_blocked",
+                    "transform_blocked",
+                    "wall",
+                ]:
+                    self.metrics.record(
+                        f"pipeline_{stage}", stats[stage], tx_type=kwargs.get("tx_type")
+                    )
+                self.metrics.incr(
+                    "pipeline_pages", stats["pages"], tx_type=kwargs.get("tx_type")
+                )
+            self.pipeline_stats = stats
+            self.metrics.flush()
+        except Exception:
+            self.logger.info(kwargs)
+            log = traceback.format_exc()
+            self.logger.exception(log)
+            raise
+
+    def pipeline_pages(self, raw_pages, stats):
+        # Producer thread pulls pages (search fetch + funct) into a bounded
+        # queue while the caller transforms the pages already queued.
+        pages = queue.Queue(maxsize=int(self.setting.get("PIPELINE_QUEUE_SIZE", 4)))
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            put_start = time.perf_counter()
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            stats["fetch_blocked"] += time.perf_counter() - put_start
+
+        def produce():
+            try:
+                while not stop.is_set():
+                    fetch_start = time.perf_counter()
+                    page = next(raw_pages, done)
+                    stats["fetch"] += time.perf_counter() - fetch_start
+                    if page is done:
+                        break
+                    stats["pages"] += 1
+                    put(page)
+            except Exception as e:
+                put(e)
+                return
+            put(done)
+
+        producer = threading.Thread(
+            target=produce, name="nsagency-page-producer", daemon=True
+        )
+        producer.start()
+        try:
+            while True:
+                get_start = time.perf_counter()
+                page = pages.get()
+                stats["transform_blocked"] += time.perf_counter() - get_start
+                if page is done:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            stop.set()
+            producer.join()
+
     ## We can move the function to the uplevel.
     def tx_entity_src_decorator():
         def decorator(func):
+            @functools.wraps(func)
             def wrapper(self, *args, **kwargs):
-                tx_type = kwargs.get("tx_type")
+                extractor = self.get_entity_extractor(kwargs.get("tx_type"))
 
-                self.logger.debug(
-                    f"Transferring {tx_type} for {args[0]['internalId']} at {time.strftime('%X')}."
-                )
+                if extractor.debug:
+                    self.logger.debug(
+                        f"Transferring {extractor.tx_type} for {args[0]['internalId']} at {time.strftime('%X')}."
+                    )
 
-                kwargs.update(
-                    {
-                        "entity": {
-                            "src_id": args[0][
-                                self.setting["src_metadata"][tx_type]["src_id"]
-                            ],
-                            "created_at": args[0][
-                                self.setting["src_metadata"][tx_type]["created_at"]
-                            ].astimezone(timezone("UTC")),
-                            "updated_at": args[0][
-                                self.setting["src_metadata"][tx_type]["updated_at"]
-                            ].astimezone(timezone("UTC")),
-                        }
-                    }
-                )
+                kwargs["entity"] = extractor(args[0])
 
-                entity = func(self, *args, **kwargs)
-                return entity
+                start = time.perf_counter()
+                try:
+                    return func(self, *args, **kwargs)
+                finally:
+                    self.metrics.record_key(
+                        extractor.metrics_key, time.perf_counter() - start
+                    )
 
             return wrapper
 
         return decorator
 
+    def get_entity_extractor(self, tx_type):
+        extractor = self._entity_extractors.get(tx_type)
+        if extractor is None:
+            extractor = EntityExtractor(
+                tx_type,
+                self.setting["src_metadata"][tx_type],
+                debug=self.logger.isEnabledFor(logging.DEBUG),
+            )
+            self._entity_extractors[tx_type] = extractor
+        return extractor
+
     ## We can move the function to the uplevel.
     def insert_update_decorator():
         def decorator(func):
+            @functools.wraps(func)
             def wrapper(self, *args, **kwargs):
                 tx_type = args[0].get("tx_type_src_id").split("-")[0]
                 try:
@@ -206,7 +1026,8 @@ class NSAgency(Agency):
                     assert record_type is not None, f"{tx_type} is not supported."
 
                     kwargs.update({"record_type": record_type})
-                    func(self, *args, **kwargs)
+                    with self.metrics.timer("upsert", record_type=record_type):
+                        func(self, *args, **kwargs)
                 except Exception:
                     log = traceback.format_exc()
                     args[0].update({"tx_status": "F", "tx_note": log, "tgt_id": "####"})
@@ -218,71 +1039,302 @@ class NSAgency(Agency):
 
         return decorator
 
-    # Define your asynchronous function here (async_worker)
-    async def async_worker(self, result_funct, record_type, **kwargs):
-        # Your asynchronous code here
-        return result_funct(record_type, **kwargs)
+    ## We can move the function to the uplevel.
+    def insert_update_list_decorator():
+        """Write a batch of entities of one type with a list operation.
+
+        The decorated function returns one result per entity, in order: the
+        tgt_id, or an Exception instance for a record that failed. Each
+        entity gets its own tx_status, tx_note and tgt_id from its result.
+        If the call raises, or returns a list of another length, every
+        entity of the batch fails with that error.
+        """
 
-    def dispatch_async_worker(self, record_type, result_funct, limit_pages, **params):
-        # Define a wrapper worker for the asynchronous task
-        async def task_wrapper(result_funct, record_type, **kwargs):
-            return await self.async_worker(result_funct, record_type, **kwargs)
-
-        tasks = []
-        # Create a multiprocessing Pool
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            # Dispatch asynchronous tasks to different processes for each page index
-            for i in range(2, limit_pages + 1):
-                tasks.append(
-                    executor.submit(
-                        asyncio.run,
-                        task_wrapper(
-                            result_funct,
-                            record_type,
-                            **dict(
-                                params,
-                                **{
-                                    "page_index": i,
-                                },
-                            ),
-                        ),
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(self, entities, **kwargs):
+                tx_type = entities[0].get("tx_type_src_id").split("-")[0]
+                try:
+                    record_type = self.get_record_type(tx_type)
+                    assert record_type is not None, f"{tx_type} is not supported."
+
+                    kwargs.update({"record_type": record_type})
+                    with self.metrics.timer("upsert_batch", record_type=record_type):
+                        results = func(self, entities, **kwargs)
+                    assert len(results) == len(
+                        entities
+                    ), f"{len(results)} results returned for {len(entities)} {tx_type} entities."
+                except Exception as e:
+                    results = [e] * len(entities)
+
+                # One result per entity: the tgt_id, or the exception it failed with.
+                for entity, result in zip(entities, results):
+                    if not isinstance(result, BaseException):
+                        entity.update({"tgt_id": result, "tx_status": "S"})
+                        continue
+
+                    log = "".join(
+                        traceback.format_exception(
+                            type(result), result, result.__traceback__
+                        )
                     )
-                )
+                    entity.update({"tx_status": "F", "tx_note": log, "tgt_id": "####"})
+                    self.logger.error(
+                        f"Failed to create order: {entity['tx_type_src_id']} with error: {log}"
+                    )
+
+            return wrapper
+
+        return decorator
 
-        # Track progress and calculate the percentage
-        total_tasks = len(tasks)
-        completed_tasks = 0
+    def dispatch_insert_update(
+        self, entities, insert_update_entity, insert_update_entity_list=None
+    ):
+        write_workers = int(self.setting.get("WRITE_WORKERS", 1))
+        batch_size = int(self.setting.get("WRITE_BATCH_SIZE", 1))
+
+        if batch_size > 1 and insert_update_entity_list is not None:
+            # List operations need one record type per request.
+            batches = collections.OrderedDict()
+            for entity in entities:
+                batches.setdefault(
+                    entity.get("tx_type_src_id").split("-")[0], []
+                ).append(entity)
+            tasks = [
+                (insert_update_entity_list, same_type[i : i + batch_size])
+                for same_type in batches.values()
+                for i in range(0, len(same_type), batch_size)
+            ]
+        else:
+            tasks = [(insert_update_entity, entity) for entity in entities]
 
-        # Gather the tasks' results from the processes
-        gathered_results = []
-        for task in concurrent.futures.as_completed(tasks):
-            result = task.result()
-            gathered_results.append(result)
-            completed_tasks += 1
-            progress_percent = (completed_tasks / total_tasks) * 100
-            self.logger.info(
-                f"Progress (get_records_all for {record_type}): {progress_percent:.2f}%"
+        if write_workers <= 1:
+            for funct, arg in tasks:
+                funct(arg)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=write_workers, thread_name_prefix="nsagency-write"
+            ) as executor:
+                for future in [executor.submit(funct, arg) for funct, arg in tasks]:
+                    future.result()
+
+        for entity in entities:
+            self.metrics.incr(
+                "upsert_status",
+                tx_type=entity.get("tx_type_src_id").split("-")[0],
+                status=entity.get("tx_status"),
             )
+        self.metrics.flush()
+        return entities
+
+    @property
+    def page_fetch_concurrency(self):
+        workers = int(self.setting.get("PAGE_FETCH_WORKERS", 2))
+        if not self.setting.get("ADAPTIVE_PAGE_FETCH", False):
+            return PageFetchConcurrency(workers)
+        return PageFetchConcurrency(
+            workers,
+            max_limit=int(self.setting.get("PAGE_FETCH_MAX_WORKERS", 10)),
+            adaptive=True,
+        )
+
+    def is_concurrency_fault(self, exception):
+        message = str(exception)
+        return any(
+            code in message
+            for code in self.setting.get(
+                "CONCURRENCY_FAULT_CODES", CONCURRENCY_FAULT_CODES
+            )
+        )
+
+    def is_transient_fault(self, exception):
+        if self.is_concurrency_fault(exception) or isinstance(
+            exception, (TimeoutError, ConnectionError)
+        ):
+            return True
+        message = f"{exception.__class__.__name__}: {exception}"
+        return any(
+            code in message
+            for code in self.setting.get("TRANSIENT_FAULT_CODES", TRANSIENT_FAULT_CODES)
+        )
+
+    def get_retry_delay(self, attempt):
+        # Exponential backoff with jitter, so pages that failed together
+        # are not retried together.
+        backoff = float(self.setting.get("PAGE_FETCH_BACKOFF", 1.0))
+        return min(
+            backoff * (2 ** (attempt - 1)),
+            float(self.setting.get("PAGE_FETCH_MAX_BACKOFF", 30)),
+        ) * (0.5 + random.random())
+
+    @property
+    def page_failure_policy(self):
+        policy = self.setting.get("PAGE_FAILURE_POLICY", "fail")
+        assert policy in (
+            "fail",
+            "skip",
+            "defer",
+        ), f"{policy} is not a supported PAGE_FAILURE_POLICY."
+        return policy
+
+    def page_failed(self, record_type, page_index, exception, policy):
+        self.metrics.incr("page_failures", record_type=record_type, policy=policy)
+        self.failed_pages.append(
+            {
+                "record_type": record_type,
+                "page_index": page_index,
+                "policy": policy,
+                "error": f"{exception.__class__.__name__}: {exception}",
+            }
+        )
+        self.logger.error(
+            f"Page {page_index} of {record_type} failed ({exception}); "
+            f"its records are left out of this run ({policy})."
+        )
+
+    def iter_async_worker(
+        self, record_type, result_funct, limit_pages, page_indexes=None, **params
+    ):
+        concurrency = self.page_fetch_concurrency
+        max_retries = int(self.setting.get("PAGE_FETCH_MAX_RETRIES", 5))
+        policy = self.page_failure_policy
+        if page_indexes is None:
+            page_indexes = range(2, limit_pages + 1)
+        progress = self.get_progress_reporter(
+            f"get_records_all for {record_type}", len(page_indexes)
+        )
+        page_indexes = iter(page_indexes)
+        retries = {}
+        # Pages given up on under "defer", fetched again once the rest are in.
+        deferred = []
+        passes = int(self.setting.get("PAGE_DEFER_PASSES", 1))
+
+        def fetch_page(page_index, delay):
+            if delay > 0:
+                time.sleep(delay)
+            with self.metrics.timer("page_fetch", record_type=record_type):
+                return result_funct(
+                    record_type, **dict(params, **{"page_index": page_index})
+                )
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency.max_limit
+        ) as executor:
+            # Only keep as many pages in flight as the current limit allows, so
+            # a slow consumer does not pile every page up in memory either.
+            pending = collections.deque()
+            tasks = {}
+
+            def fill():
+                while len(tasks) < concurrency.limit:
+                    if pending:
+                        page_index, delay = pending.popleft()
+                    else:
+                        page_index, delay = next(page_indexes, None), 0
+                        if page_index is None:
+                            return
+                    tasks[executor.submit(fetch_page, page_index, delay)] = (
+                        page_index,
+                        concurrency.generation,
+                    )
+
+            while True:
+                fill()
+                while tasks:
+                    done, _ = concurrent.futures.wait(
+                        tasks, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        page_index, generation = tasks.pop(task)
+                        try:
+                            result = task.result()
+                        except Exception as e:
+                            retries[page_index] = retries.get(page_index, 0) + 1
+                            if (
+                                self.is_transient_fault(e)
+                                and retries[page_index] <= max_retries
+                            ):
+                                self.metrics.incr(
+                                    "page_fetch_faults", record_type=record_type
+                                )
+                                if concurrency.adaptive and self.is_concurrency_fault(e):
+                                    if concurrency.on_fault(generation):
+                                        self.logger.warning(
+                                            f"Concurrency fault on page {page_index} for {record_type}; "
+                                            f"page fetch concurrency lowered to {concurrency.limit}."
+                                        )
+                                else:
+                                    self.logger.warning(
+                                        f"Transient fault on page {page_index} for {record_type} "
+                                        f"({e}); retry {retries[page_index]}/{max_retries}."
+                                    )
+                                pending.append(
+                                    (page_index, self.get_retry_delay(retries[page_index]))
+                                )
+                                continue
+
+                            if policy == "fail":
+                                raise
+                            if policy == "defer" and passes > 0:
+                                deferred.append(page_index)
+                            else:
+                                self.page_failed(record_type, page_index, e, policy)
+                            continue
+
+                        concurrency.on_success()
+                        progress.advance()
+                        yield result
+                    fill()
+
+                if not deferred:
+                    break
+                # Another pass over the deferred pages, with fresh retries.
+                self.logger.warning(
+                    f"Fetching deferred pages {deferred} of {record_type} again."
+                )
+                passes -= 1
+                page_indexes = iter(deferred)
+                deferred = []
+                retries.clear()
+
+    def dispatch_async_worker(self, record_type, result_funct, limit_pages, **params):
+        gathered_results = list(
+            self.iter_async_worker(record_type, result_funct, limit_pages, **params)
+        )
 
         record_list = [entry["records"] for entry in gathered_results]
         records = [record for sublist in record_list for record in sublist]
 
         return records
 
+    def search(self, record_type, result_funct, **params):
+        # First page of a new search; transient faults are retried like pages.
+        max_retries = int(self.setting.get("PAGE_FETCH_MAX_RETRIES", 5))
+        attempt = 0
+        while True:
+            try:
+                with self.metrics.timer("search", record_type=record_type):
+                    return result_funct(record_type, **params)
+            except Exception as e:
+                attempt += 1
+                if not self.is_transient_fault(e) or attempt > max_retries:
+                    raise
+                self.metrics.incr("page_fetch_faults", record_type=record_type)
+                self.logger.warning(
+                    f"Transient fault on the {record_type} search ({e}); "
+                    f"retry {attempt}/{max_retries}."
+                )
+                time.sleep(self.get_retry_delay(attempt))
+
     def get_records_all(self, record_type, result_funct, funct, **params):
-        limit_pages = int(self.setting.get("LIMIT_PAGES", 3))
-        result = result_funct(record_type, **params)
+        result = self.search(record_type, result_funct, **params)
         if result["total_records"] == 0:
             return []
 
         if result["total_pages"] == 1:
             return funct(record_type, result["records"], **params)
 
-        limit_pages = (
-            result["total_pages"]
-            if limit_pages == 0
-            else min(limit_pages, result["total_pages"])
-        )
+        limit_pages = self.get_limit_pages(record_type, result["total_pages"])
 
         records = self.dispatch_async_worker(
             record_type,
@@ -294,12 +1346,158 @@ class NSAgency(Agency):
 
         return funct(record_type, records, **params)
 
+    def get_page_funct(self, result_funct, funct, total_pages, **params):
+        # Run funct inside the page workers so it overlaps with other fetches.
+        def page_funct(record_type, **kwargs):
+            page = result_funct(record_type, **kwargs)
+            return RecordPage(
+                funct(record_type, page["records"], **params),
+                page_index=kwargs["page_index"],
+                search_id=kwargs["search_id"],
+                total_pages=page.get("total_pages", total_pages),
+            )
+
+        return page_funct
+
+    def get_limit_pages(self, record_type, total_pages):
+        limit_pages = int(self.setting.get("LIMIT_PAGES", 3))
+        if limit_pages == 0 or limit_pages >= total_pages:
+            return total_pages
+
+        self.logger.warning(
+            f"{record_type} search has {total_pages} pages; only {limit_pages} are read (LIMIT_PAGES)."
+        )
+        return limit_pages
+
+    def iter_records_pages(self, record_type, result_funct, funct, **params):
+        resume = params.pop("resume", None)
+
+        if resume is not None:
+            # Re-read only the pages a previous run did not finish, through
+            # the same saved search.
+            total_pages = resume["total_pages"]
+            limit_pages = self.get_limit_pages(record_type, total_pages)
+            page_indexes = [
+                page_index
+                for page_index in range(1, limit_pages + 1)
+                if page_index not in resume["completed_pages"]
+            ]
+            page_funct = self.get_page_funct(result_funct, funct, total_pages, **params)
+            search_params = dict(params, **{"search_id": resume["search_id"]})
+            if not page_indexes:
+                return
+            try:
+                first_page = page_funct(
+                    record_type, **dict(search_params, **{"page_index": page_indexes[0]})
+                )
+            except Exception as e:
+                self.logger.warning(
+                    f"Cannot resume search {resume['search_id']} for {record_type} ({e}); starting over."
+                )
+                if self.sync_checkpoint is not None:
+                    self.sync_checkpoint.restart()
+            else:
+                yield first_page
+                yield from self.iter_async_worker(
+                    record_type,
+                    page_funct,
+                    limit_pages,
+                    page_indexes=page_indexes[1:],
+                    **search_params,
+                )
+                return
+
+        result = self.search(record_type, result_funct, **params)
+        yield from self.iter_search_pages(
+            record_type, result_funct, funct, result, **params
+        )
+
+    def iter_search_pages(self, record_type, result_funct, funct, result, **params):
+        # Yield the pages of a search whose first page is `result`.
+        if result["total_records"] == 0:
+            return
+
+        total_pages = result["total_pages"]
+        yield RecordPage(
+            funct(record_type, result["records"], **params),
+            page_index=1,
+            search_id=result.get("search_id"),
+            total_pages=total_pages,
+        )
+        if total_pages == 1:
+            return
+
+        yield from self.iter_async_worker(
+            record_type,
+            self.get_page_funct(result_funct, funct, total_pages, **params),
+            self.get_limit_pages(record_type, total_pages),
+            **dict(params, **{"search_id": result["search_id"]}),
+        )
+
+    def iter_window_pages(self, record_type, result_funct, funct, **params):
+        # Bisect the cut_date..end_date window until each search fits in
+        # TARGET_WINDOW_PAGES pages, so LIMIT_PAGES never truncates it.
+        limit_pages = int(self.setting.get("LIMIT_PAGES", 3))
+        target_pages = int(
+            self.setting.get("TARGET_WINDOW_PAGES", limit_pages if limit_pages > 0 else 10)
+        )
+        min_window = timedelta(seconds=float(self.setting.get("MIN_WINDOW_SECONDS", 60)))
+        cut_date = datetime.strptime(params["cut_date"], "%Y-%m-%dT%H:%M:%S%z")
+        end_date = datetime.strptime(params["end_date"], "%Y-%m-%dT%H:%M:%S%z")
+
+        result = self.search(record_type, result_funct, **params)
+        if result["total_pages"] <= target_pages or end_date - cut_date <= min_window:
+            yield from self.iter_search_pages(
+                record_type, result_funct, funct, result, **params
+            )
+            return
+
+        mid_date = (cut_date + (end_date - cut_date) / 2).replace(microsecond=0)
+        self.logger.info(
+            f"{record_type} window {params['cut_date']}..{params['end_date']} has "
+            f"{result['total_pages']} pages; splitting at {mid_date}."
+        )
+        # The halves must neither overlap nor leave a gap: with an inclusive
+        # end the second half starts a second later, with a half-open one
+        # it starts at mid_date.
+        second_half = mid_date
+        if self.window_end_inclusive(params.get("tx_type")):
+            second_half += timedelta(seconds=1)
+        for window in [(cut_date, mid_date), (second_half, end_date)]:
+            for page in self.iter_window_pages(
+                record_type,
+                result_funct,
+                funct,
+                **dict(
+                    params,
+                    **{
+                        "cut_date": window[0].strftime("%Y-%m-%dT%H:%M:%S%z"),
+                        "end_date": window[1].strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    },
+                ),
+            ):
+                # Sub-window searches cannot be resumed as one search.
+                page.search_id = None
+                yield page
+
+    def window_end_inclusive(self, tx_type):
+        # SOAP searches match lastModifiedDate "within" cut_date and end_date,
+        # both ends included; SUITEQL_SOURCES queries filter
+        # >= cut_date AND < end_date.
+        return self.setting.get("SOURCE_MODES", {}).get(tx_type, "soap") == "soap"
+
     def get_records(self, record_type, result_funct, funct, **params):
         try:
             current_time = datetime.now(
                 tz=timezone(self.setting.get("TIMEZONE", "UTC"))
             )
-            hours = params.get("hours", 0.0)
+            hours = float(params.get("hours", 0.0))
+            # Backfill shards own exactly their window: an empty one is not
+            # widened into the next shard's range.
+            fixed_window = bool(params.get("fixed_window", False))
+            adaptive = self.setting.get("ADAPTIVE_WINDOW", False)
+            growth = float(self.setting.get("WINDOW_GROWTH_FACTOR", 2.0))
+            step = timedelta(hours=hours)
 
             if hours == 0.0:
                 end_time = current_time
@@ -312,40 +1510,204 @@ class NSAgency(Agency):
             while True:
                 self.logger.info(params)
 
-                records = self.get_records_all(
-                    record_type, result_funct, funct, **params
-                )
+                if params.get("resume"):
+                    pages = self.track_pages(
+                        self.iter_records_pages(
+                            record_type, result_funct, funct, **params
+                        )
+                    )
+                    if params.get("stream") or params.get("pipeline"):
+                        return pages
+                    return [record for page in pages for record in page]
+
+                # With a checkpoint, pages are tracked so a list result can
+                # record its progress once it has been handed off.
+                if (
+                    params.get("stream")
+                    or params.get("pipeline")
+                    or adaptive
+                    or self.sync_checkpoint is not None
+                ):
+                    # Peek at the first page so empty windows can still be widened.
+                    pages = (
+                        self.iter_window_pages if adaptive else self.iter_records_pages
+                    )(record_type, result_funct, funct, **params)
+                    first_page = next(pages, None)
+                    if first_page is not None:
+                        pages = self.track_pages(itertools.chain([first_page], pages))
+                    if (
+                        first_page is not None
+                        or end_time >= current_time
+                        or fixed_window
+                    ):
+                        if params.get("stream") or params.get("pipeline"):
+                            return pages
+                        return [record for page in pages for record in page]
+                else:
+                    records = self.get_records_all(
+                        record_type, result_funct, funct, **params
+                    )
 
-                if len(records) >= 1 or end_time >= current_time:
-                    return records
+                    if len(records) >= 1 or end_time >= current_time or fixed_window:
+                        return records
 
-                end_time += timedelta(hours=hours)
+                if adaptive:
+                    # Grow empty windows geometrically, up to now.
+                    end_time = min(end_time + step, current_time)
+                    step *= growth
+                else:
+                    end_time += step
                 params.update({"end_date": end_time.strftime("%Y-%m-%dT%H:%M:%S%z")})
         except Exception as e:
             log = traceback.format_exc()
             self.logger.exception(log)
             raise e
 
+    def get_transform_plan(self, metadatas):
+        # Plans are cached per metadatas object (one per target/record_type in
+        # self.map); None marks a mapping the plan compiler cannot handle.
+        cached = self._transform_plans.get(id(metadatas))
+        if cached is not None and cached[0] is metadatas:
+            return cached[1]
+
+        try:
+            plan = TransformPlan(metadatas)
+        except (UnsupportedMapping, SyntaxError, KeyError, TypeError) as e:
+            self.logger.warning(f"TXMAP falls back to transform_data: {e}")
+            plan = None
+        self._transform_plans[id(metadatas)] = (metadatas, plan)
+        return plan
+
     def transform_data(self, record, metadatas):
-        return super(NSAgency, self).transform_data(
-            record, metadatas, get_cust_value=self.get_custom_field_value
-        )
+        # Custom field indexes built during this call are reused by every
+        # @scriptId lookup on the same record, then dropped with the call.
+        local = self._custom_field_indexes
+        owner = getattr(local, "records", None) is None
+        if owner:
+            local.records = {}
+        try:
+            if self.setting.get("COMPILE_TXMAP", False) and metadatas is not None:
+                plan = self.get_transform_plan(metadatas)
+                if plan is not None:
+                    return plan.execute(
+                        record, get_cust_value=self.get_custom_field_value
+                    )
+
+            return super(NSAgency, self).transform_data(
+                record, metadatas, get_cust_value=self.get_custom_field_value
+            )
+        finally:
+            if owner:
+                local.records = None
+
+    def get_source_functs(self, tx_type, result_funct, funct):
+        # SOURCE_MODES picks the read path per tx_type: "soap" (default) or
+        # "suiteql" for a SUITEQL_SOURCES query through the REST connector.
+        mode = self.setting.get("SOURCE_MODES", {}).get(tx_type, "soap")
+        assert mode in ("soap", "suiteql"), f"{mode} is not a supported source mode."
+        if mode == "soap":
+            return result_funct, funct
+
+        source = self.get_suiteql_source(tx_type)
+
+        def suiteql_result_funct(record_type, **params):
+            query = source.query(
+                params["cut_date"], params["end_date"], params.get("projection")
+            )
+            offset = (params.get("page_index", 1) - 1) * source.page_size
+            with self.metrics.timer("suiteql_page", tx_type=tx_type):
+                result = self.execute_suiteql(query, source.page_size, offset)
+            total_records = int(result.get("totalResults", len(result["items"])))
+            return {
+                "total_records": total_records,
+                "total_pages": max(-(-total_records // source.page_size), 1),
+                "search_id": source.search_id(query),
+                "records": result["items"],
+            }
+
+        def suiteql_funct(record_type, rows, **params):
+            return source.build_records(
+                rows, self.execute_suiteql_all, params.get("projection")
+            )
+
+        return suiteql_result_funct, suiteql_funct
+
+    def get_suiteql_source(self, tx_type):
+        if tx_type not in self._suiteql_sources:
+            config = self.setting.get("SUITEQL_SOURCES", {}).get(tx_type)
+            assert config is not None, f"SUITEQL_SOURCES has no query for {tx_type}."
+            self._suiteql_sources[tx_type] = SuiteQLSource(
+                config, tz=self.setting.get("TIMEZONE", "UTC")
+            )
+        return self._suiteql_sources[tx_type]
+
+    def execute_suiteql(self, query, limit, offset):
+        # Adapter around the REST connector; returns the SuiteQL response
+        # body ({"items": [...], "totalResults": n, "hasMore": bool}).
+        return self.rest_connector.execute_suiteql(query, limit=limit, offset=offset)
+
+    def execute_suiteql_all(self, query, limit=1000):
+        rows = []
+        offset = 0
+        while True:
+            result = self.execute_suiteql(query, limit, offset)
+            rows.extend(result["items"])
+            if not result.get("hasMore") or not result["items"]:
+                return rows
+            offset += len(result["items"])
+
+    def get_search_params(self, metadatas, **kwargs):
+        # With FIELD_PUSHDOWN a SuiteQL source is told which body fields,
+        # sublists and custom fields the mapping reads, so it can leave out
+        # the rest of the record. SOAP searches return whole records.
+        tx_type = kwargs.get("tx_type")
+        if (
+            not self.setting.get("FIELD_PUSHDOWN", False)
+            or not metadatas
+            or self.setting.get("SOURCE_MODES", {}).get(tx_type, "soap") != "suiteql"
+        ):
+            return kwargs
+
+        cached = self._field_projections.get((id(metadatas), tx_type))
+        if cached is not None and cached[0] is metadatas:
+            projection = cached[1]
+        else:
+            projection = get_field_projection(
+                metadatas, self.setting.get("src_metadata", {}).get(tx_type)
+            )
+            self._field_projections[(id(metadatas), tx_type)] = (metadatas, projection)
+        return dict(kwargs, **{"projection": projection})
+
+    def get_custom_field_index(self, record):
+        records = getattr(self._custom_field_indexes, "records", None)
+        if records is not None:
+            cached = records.get(id(record))
+            if cached is not None and cached[0] is record:
+                return cached[1]
+
+        with self.metrics.timer("custom_field_index"):
+            index = {}
+            for custom_field in record["customFieldList"]["customField"]:
+                script_id = custom_field["scriptId"]
+                # A scriptId listed more than once has no single value.
+                index[script_id] = (
+                    _DUPLICATE_CUSTOM_FIELD
+                    if script_id in index
+                    else custom_field["value"]
+                )
+
+        if records is not None:
+            records[id(record)] = (record, index)
+        return index
 
     def get_custom_field_value(self, record, script_id):
-        value = None
         if record["customFieldList"] is None:
-            return value
-        _custom_fields = list(
-            filter(
-                lambda custom_field: (
-                    custom_field["scriptId"] == script_id.replace("@", "")
-                ),
-                record["customFieldList"]["customField"],
-            )
-        )
-        if len(_custom_fields) == 1:
-            value = _custom_fields[0]["value"]
-        return value
+            return None
+        key = _custom_field_keys.get(script_id)
+        if key is None:
+            key = _custom_field_keys.setdefault(script_id, script_id.replace("@", ""))
+        value = self.get_custom_field_index(record).get(key)
+        return None if value is _DUPLICATE_CUSTOM_FIELD else value
 
     ## We can move the function to the uplevel.
     @tx_entities_src_decorator()
@@ -355,9 +1717,14 @@ class NSAgency(Agency):
 
         raw_transactions = self.get_records(
             record_type,
-            self.soap_connector.get_transaction_result,
-            self.soap_connector.get_transactions,
-            **kwargs,
+            *self.get_source_functs(
+                kwargs.get("tx_type"),
+                self.soap_connector.get_transaction_result,
+                self.soap_connector.get_transactions,
+            ),
+            **self.get_search_params(
+                self.map.get(kwargs.get("target"), {}).get(record_type), **kwargs
+            ),
         )
 
         return self.tx_transaction_src, raw_transactions
@@ -392,11 +1759,19 @@ class NSAgency(Agency):
         record_type = self.get_record_type(kwargs.get("tx_type"))
         assert record_type is not None, f"{kwargs.get('tx_type')} is not supported."
 
+        if kwargs.get("tx_type") == "product" and self.setting.get("FIELD_PUSHDOWN"):
+            metadatas = self.get_product_metadatas(**kwargs)
+        else:
+            metadatas = self.map.get(kwargs.get("target"), {}).get(record_type)
+
         raw_assets = self.get_records(
             record_type,
-            self.soap_connector.get_item_result,
-            self.soap_connector.get_items,
-            **kwargs,
+            *self.get_source_functs(
+                kwargs.get("tx_type"),
+                self.soap_connector.get_item_result,
+                self.soap_connector.get_items,
+            ),
+            **self.get_search_params(metadatas, **kwargs),
         )
 
         return self.tx_asset_src, raw_assets
@@ -427,14 +1802,17 @@ class NSAgency(Agency):
                     }
                 )
             elif tx_type == "inventorylot":
-                inventorylots = list(
-                    map(
-                        lambda inventory_number: self.tx_inventorylot_src(
-                            inventory_number
-                        ),
-                        data.get("inventoryNumbers", []),
+                inventorylots = data.get("inventoryNumbers", [])
+                if not self.setting.get("COLUMNAR_ASSETS", False):
+                    # Otherwise batch_tx_entities_src filters the whole page.
+                    inventorylots = list(
+                        map(
+                            lambda inventory_number: self.tx_inventorylot_src(
+                                inventory_number
+                            ),
+                            inventorylots,
+                        )
                     )
-                )
                 asset.update(
                     {
                         "data": {"inventorylots": inventorylots},
@@ -458,6 +1836,58 @@ class NSAgency(Agency):
             self.logger.exception(log)
         return asset
 
+    @property
+    def join_engine(self):
+        if self._join_engine is None and (
+            self.join.get("base") or self.join.get("lines")
+        ):
+            # Kept for the agency, so its cache carries across pages and calls.
+            self._join_engine = JoinEngine(
+                self.join, cache_size=int(self.setting.get("JOIN_CACHE_SIZE", 10000))
+            )
+        return self._join_engine
+
+    def enrich_raw_entities(self, raw_entities, **kwargs):
+        # Merge the JOIN fields onto a page (or list) of raw records in place,
+        # with one bulk SuiteQL query per key set instead of one per record.
+        if self.join_engine is None or not raw_entities:
+            return raw_entities
+        record_type = self.get_record_type(kwargs.get("tx_type"))
+        with self.metrics.timer("join", record_type=record_type):
+            self.join_engine.enrich(record_type, raw_entities, self.execute_suiteql_all)
+        return raw_entities
+
+    def batch_tx_entities_src(self, entities, **kwargs):
+        # Page-level steps that tx_*_src leaves for the whole batch.
+        if kwargs.get("tx_type") != "inventorylot" or not self.setting.get(
+            "COLUMNAR_ASSETS", False
+        ):
+            return entities
+
+        assets = [asset for asset in entities if asset.get("tx_status") != "F"]
+        try:
+            with self.metrics.timer("batch", tx_type=kwargs.get("tx_type")):
+                filter_inventorylots(
+                    [
+                        inventory_number
+                        for asset in assets
+                        for inventory_number in asset["data"]["inventorylots"]
+                    ]
+                )
+        except Exception:
+            # Redo it per asset so a bad item only fails itself.
+            for asset in assets:
+                try:
+                    asset["data"]["inventorylots"] = [
+                        self.tx_inventorylot_src(inventory_number)
+                        for inventory_number in asset["data"]["inventorylots"]
+                    ]
+                except Exception:
+                    log = traceback.format_exc()
+                    asset.update({"tx_status": "F", "tx_note": log})
+                    self.logger.exception(log)
+        return entities
+
     def tx_inventorylot_src(self, inventory_number):
         if inventory_number["status"] == "Not in Stock":
             inventory_number["locations"] = []
@@ -490,9 +1920,15 @@ class NSAgency(Agency):
 
         raw_persons = self.get_records(
             record_type,
-            self.soap_connector.get_person_result,
-            self.soap_connector.get_persons,
-            **kwargs,
+            *self.get_source_functs(
+                kwargs.get("tx_type"),
+                self.soap_connector.get_person_result,
+                self.soap_connector.get_persons,
+            ),
+            **self.get_search_params(
+                self.map.get(kwargs.get("target"), {}).get(kwargs.get("tx_type")),
+                **kwargs,
+            ),
         )
 
         return self.tx_person_src, raw_persons
@@ -520,30 +1956,34 @@ class NSAgency(Agency):
         assert person["data"].get("email"), f"{person['src_id']} email is null in data."
 
     def tx_transaction_tgt(self, transaction):
-        if transaction["data"].get("paymentMethod"):
-            transaction["data"]["paymentMethod"] = self.payment_methods[
-                transaction["data"]["paymentMethod"]
-            ]
-            terms = self.get_term(transaction["data"]["paymentMethod"])
-            if terms is not None:
-                transaction["data"]["terms"] = terms
-
-        # Map the shipping method.
-        if transaction["data"].get("shipMethod"):
-            transaction["data"]["shipMethod"] = self.ship_methods[
-                transaction["data"]["shipMethod"]
-            ]
-
-        # Map country code.
-        if transaction["data"].get("billingAddress"):
-            transaction["data"]["billingAddress"]["country"] = self.countries[
-                transaction["data"]["billingAddress"]["country"]
-            ]
+        mapping = self.target_mapping
+        data = transaction["data"]
+        try:
+            if data.get("paymentMethod"):
+                data["paymentMethod"] = mapping.map(
+                    "paymentMethod", data["paymentMethod"]
+                )
+                terms = self.get_term(data["paymentMethod"])
+                if terms is not None:
+                    data["terms"] = terms
+
+            # Map the shipping method.
+            if data.get("shipMethod"):
+                data["shipMethod"] = mapping.map("shipMethod", data["shipMethod"])
+
+            # Map country code.
+            if data.get("billingAddress"):
+                data["billingAddress"]["country"] = mapping.map(
+                    "country", data["billingAddress"]["country"]
+                )
 
-        if transaction["data"].get("shippingAddress"):
-            transaction["data"]["shippingAddress"]["country"] = self.countries[
-                transaction["data"]["shippingAddress"]["country"]
-            ]
+            if data.get("shippingAddress"):
+                data["shippingAddress"]["country"] = mapping.map(
+                    "country", data["shippingAddress"]["country"]
+                )
+        except UnmappedCode as e:
+            self.count_unmapped_code(e)
+            raise
 
         return transaction
 
@@ -551,19 +1991,57 @@ class NSAgency(Agency):
         pass
 
     def insert_update_transactions(self, transactions):
-        for transaction in transactions:
-            self.insert_update_transaction(transaction)
-        return transactions
+        if self.unmapped_codes:
+            self.report_unmapped_codes()
+        transactions = self.resolve_references(transactions)
+        return self.dispatch_insert_update(
+            transactions,
+            self.insert_update_transaction,
+            (
+                self.insert_update_transaction_list
+                if self.soap_connector_has("insert_update_transactions")
+                else None
+            ),
+        )
 
     @insert_update_decorator()
     def insert_update_transaction(self, transaction, record_type=None):
-        if len(transaction["data"].get("files", [])) > 0:
-            transaction["data"]["files"] = self.process_files(transaction["data"].get("files", []))
-        transaction["tgt_id"] = self.soap_connector.insert_update_transaction(
-            record_type, transaction["data"]
-        )
+        self.prepare_transaction_files(transaction)
+        try:
+            transaction["tgt_id"] = self.soap_connector.insert_update_transaction(
+                record_type, transaction["data"]
+            )
+        finally:
+            release_file_contents(transaction["data"].get("files", []))
         transaction["tx_status"] = "S"
 
+    @insert_update_list_decorator()
+    def insert_update_transaction_list(self, transactions, record_type=None):
+        for transaction in transactions:
+            self.prepare_transaction_files(transaction)
+        try:
+            return self.soap_connector.insert_update_transactions(
+                record_type, [transaction["data"] for transaction in transactions]
+            )
+        finally:
+            for transaction in transactions:
+                release_file_contents(transaction["data"].get("files", []))
+
+    def prepare_transaction_files(self, transaction):
+        if len(transaction["data"].get("files", [])) == 0:
+            return
+
+        files_report = []
+        transaction["data"]["files"] = self.process_files(
+            transaction["data"].get("files", []), report=files_report
+        )
+        transaction["files_report"] = files_report
+        failed = [entry for entry in files_report if entry["status"] == "F"]
+        if failed:
+            transaction["tx_note"] = "Failed to process files: " + "; ".join(
+                f"{entry['url']} ({entry['error']})" for entry in failed
+            )
+
     def tx_person_tgt(self, person):
         tx_type = person.get("tx_type_src_id").split("-")[0]
 
@@ -573,9 +2051,15 @@ class NSAgency(Agency):
         pass
 
     def insert_update_persons(self, persons):
-        for person in persons:
-            self.insert_update_person(person)
-        return persons
+        return self.dispatch_insert_update(
+            persons,
+            self.insert_update_person,
+            (
+                self.insert_update_person_list
+                if self.soap_connector_has("insert_update_persons")
+                else None
+            ),
+        )
 
     @insert_update_decorator()
     def insert_update_person(self, person, record_type=None):
@@ -584,38 +2068,206 @@ class NSAgency(Agency):
         )
         person["tx_status"] = "S"
 
-    def process_files(self, files):
+    @insert_update_list_decorator()
+    def insert_update_person_list(self, persons, record_type=None):
+        return self.soap_connector.insert_update_persons(
+            record_type, [person["data"] for person in persons]
+        )
+
+    def process_files(self, files, report=None):
         ns_folder_internal_id = self.setting.get("ns_folder_internal_id")
-        max_workers = 5
+        max_workers = int(self.setting.get("FILE_WORKERS", 5))
+        retries = int(self.setting.get("FILE_DOWNLOAD_RETRIES", 2))
+        backoff = float(self.setting.get("FILE_RETRY_BACKOFF", 1.0))
+        options = {
+            "session": self.http_session,
+            "timeout": self.http_timeout,
+            "max_size": int(self.setting.get("FILE_MAX_SIZE", 50 * 1024 * 1024)),
+            "spool_size": int(self.setting.get("FILE_SPOOL_SIZE", 1024 * 1024)),
+        }
+
+        def download(file):
+            start = time.perf_counter()
+            entry = {"url": file.get("url"), "status": "S", "size": 0, "attempts": 0}
+            try:
+                while True:
+                    entry["attempts"] += 1
+                    try:
+                        result = get_file_content(file, **options)
+                        break
+                    except FileTooLarge:
+                        raise
+                    except Exception:
+                        if entry["attempts"] > retries:
+                            raise
+                        time.sleep(
+                            backoff * (2 ** (entry["attempts"] - 1)) * random.uniform(0.5, 1.5)
+                        )
+                if result is None:
+                    entry["status"] = "N"  # No url or 404.
+                else:
+                    entry["size"] = len(result["content"])
+            except Exception as e:
+                result = None
+                entry.update({"status": "F", "error": f"{type(e).__name__}: {e}"})
+            elapsed = time.perf_counter() - start
+            entry["elapsed"] = round(elapsed, 3)
+            self.metrics.record("file_download", elapsed, status=entry["status"])
+            return result, entry
+
         processed_files = []
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(
-                    lambda file: get_file_content(file),
-                    file
-                )
-                for file in files
-            ]
+            futures = [executor.submit(download, file) for file in files]
 
             for future in concurrent.futures.as_completed(futures):
-                try:
-                    future_result = future.result()
-                    if future_result is not None:
-                        future_result.update({"folder_internal_id": ns_folder_internal_id})
-                        processed_files.append(future_result)
-                except Exception as e:
-                    pass
+                future_result, entry = future.result()
+                if report is not None:
+                    report.append(entry)
+                if entry["status"] == "F":
+                    self.logger.warning(
+                        f"Failed to download {entry['url']} after {entry['attempts']} attempt(s): {entry['error']}"
+                    )
+                if future_result is not None:
+                    future_result.update({"folder_internal_id": ns_folder_internal_id})
+                    processed_files.append(future_result)
         return processed_files
 
-def get_file_content(file):
-    if file.get("url"):
-        r = requests.get(file.get("url"), allow_redirects=True)
+# Clients and sessions are shared for the process so connections are kept
+# alive across calls and warm invocations.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(
+    service_name,
+    region_name=None,
+    aws_access_key_id=None,
+    aws_secret_access_key=None,
+    max_pool_connections=10,
+    connect_timeout=5,
+    read_timeout=60,
+):
+    import boto3
+    from botocore.config import Config
+
+    if not (region_name and aws_access_key_id and aws_secret_access_key):
+        region_name = aws_access_key_id = aws_secret_access_key = None
+
+    key = (
+        service_name,
+        region_name,
+        aws_access_key_id,
+        aws_secret_access_key,
+        max_pool_connections,
+        connect_timeout,
+        read_timeout,
+    )
+    with _clients_lock:
+        if key not in _clients:
+            credentials = (
+                {
+                    "region_name": region_name,
+                    "aws_access_key_id": aws_access_key_id,
+                    "aws_secret_access_key": aws_secret_access_key,
+                }
+                if region_name
+                else {}
+            )
+            _clients[key] = boto3.client(
+                service_name,
+                config=Config(
+                    max_pool_connections=max_pool_connections,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                    tcp_keepalive=True,
+                ),
+                **credentials,
+            )
+        return _clients[key]
+
+
+def get_http_session(pool_size=10, max_retries=0):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    key = ("http", pool_size, max_retries)
+    with _clients_lock:
+        if key not in _clients:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=max_retries,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _clients[key] = session
+        return _clients[key]
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def get_file_content(
+    file,
+    session=None,
+    timeout=None,
+    max_size=None,
+    spool_size=1024 * 1024,
+    chunk_size=64 * 1024,
+):
+    # Stream the body; anything over spool_size is spilled to a temporary
+    # file and handed on as a read-only memory map instead of bytes.
+    if not file.get("url"):
+        return None
+
+    if session is None:
+        import requests as session
+
+    with session.get(
+        file.get("url"), allow_redirects=True, timeout=timeout, stream=True
+    ) as r:
         if r.status_code == 404:
             return None
-        else:
-            file.update({
-                "content": r.content
-            })
-            return file
-    else:
-        return None
\ No newline at end of file
+        r.raise_for_status()
+
+        length = int(r.headers.get("Content-Length") or 0)
+        if max_size and length > max_size:
+            raise FileTooLarge(f"{length} bytes exceeds FILE_MAX_SIZE {max_size}.")
+
+        size = 0
+        buffer = bytearray()
+        spool = None
+        try:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise FileTooLarge(f"More than FILE_MAX_SIZE {max_size} bytes.")
+                if spool is not None:
+                    spool.write(chunk)
+                    continue
+                buffer += chunk
+                if spool_size and len(buffer) > spool_size:
+                    spool = tempfile.TemporaryFile()
+                    spool.write(buffer)
+                    buffer = None
+
+            if spool is None:
+                content = bytes(buffer)
+            else:
+                spool.flush()
+                content = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            if spool is not None:
+                spool.close()
+
+    file.update({"content": content})
+    return file
+
+
+def release_file_contents(files):
+    for file in files:
+        if isinstance(file.get("content"), mmap.mmap):
+            file["content"].close()
+            file["content"] = None
@@ -57,3 +57,15 @@ def deploy() -> list:
 class NSAgent(NSAgency):
     def __init__(self, logger, **setting):
         NSAgency.__init__(self, logger, **setting)
+
+    def retrieve_entities_from_source(self, *args, **kwargs):
+        try:
+            result = NSAgency.retrieve_entities_from_source(self, *args, **kwargs)
+            # The entities have been handed to DataWald; move the sync
+            # watermarks and remember the fingerprints that were shipped.
+            self.commit_sync_state()
+            return result
+        finally:
+            # Release the transform pool, so process workers do not outlive
+            # the run.
+            self.close()
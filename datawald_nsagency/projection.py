@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+
+def _add_key(key, body_fields, custom_fields):
+    # "entity|name" needs the body field "entity"; "@custbody_x" needs the
+    # custom field custbody_x out of customFieldList.
+    if not key:
+        return
+    if key.startswith("@"):
+        custom_fields.add(key.replace("@", ""))
+        body_fields.add("customFieldList")
+        return
+    body_fields.add(key.split("|")[0])
+
+
+def _collect(metadatas, body_fields, sublists, custom_fields):
+    for metadata in metadatas.values():
+        sources = metadata.get("src", [])
+        if metadata.get("type") == "list":
+            key = sources[0].get("key") if sources else None
+            if not key:
+                continue
+            sublist = key.split("|")[0]
+            body_fields.add(sublist)
+            line_fields = sublists.setdefault(sublist, set())
+            if isinstance(metadata.get("funct"), dict):
+                _collect(metadata["funct"], line_fields, {}, custom_fields)
+            continue
+
+        for source in sources:
+            _add_key(source.get("key"), body_fields, custom_fields)
+
+
+def get_field_projection(metadatas, src_metadata=None):
+    """Fields a TXMAP mapping (or product metadatas) reads from a record.
+
+    Returns a JSON-serializable dict with the top-level `body_fields`, the
+    fields used on each line of a `sublists` entry, and the `custom_fields`
+    scriptIds, so a search can ask NetSuite for just those columns.
+    """
+    body_fields = {"internalId"}
+    sublists = {}
+    custom_fields = set()
+    _collect(metadatas or {}, body_fields, sublists, custom_fields)
+    for key in (src_metadata or {}).values():
+        _add_key(key, body_fields, custom_fields)
+
+    return {
+        "body_fields": sorted(body_fields),
+        "sublists": {
+            sublist: sorted(fields) for sublist, fields in sorted(sublists.items())
+        },
+        "custom_fields": sorted(custom_fields),
+    }
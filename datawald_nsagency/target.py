@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+from .join import LRUCache, get_path
+from .suiteql import SuiteQLSource, set_path
+
+
+class UnmappedCode(KeyError):
+    def __init__(self, field, code):
+        KeyError.__init__(self, code)
+        self.field = field
+        self.code = code
+
+    def __str__(self):
+        return f"{self.field} {self.code!r} is not mapped."
+
+
+class TargetMapping(object):
+    """PAYMENT_METHODS, SHIP_METHODS, COUNTRIES and TERMS resolved into
+    lookup tables once, instead of re-read (and TERMS scanned) per record."""
+
+    def __init__(self, payment_methods, ship_methods, countries, terms):
+        self.tables = {
+            "paymentMethod": dict(payment_methods),
+            "shipMethod": dict(ship_methods),
+            "country": dict(countries),
+        }
+        # Payment method -> term; the first term listing it wins, as the
+        # linear scan did.
+        self.terms = {}
+        for term, methods in terms.items():
+            for method in methods:
+                self.terms.setdefault(method, term)
+
+    def map(self, field, code):
+        try:
+            return self.tables[field][code]
+        except KeyError:
+            raise UnmappedCode(field, code)
+
+
+class ReferenceLookup(object):
+    """One REFERENCE_LOOKUPS entry: NetSuite internal ids looked up in bulk
+    by a natural key of the target data.
+
+    {
+        "query": "SELECT id, email FROM customer WHERE email IN ({ids})",
+        "key_column": "email",
+        "value_column": "id",
+        "source": "email",
+        "target": "entity|internalId"
+    }
+
+    `source` is read from each transaction's data (or each line of
+    `sublist`), and the id found for it is set at `target`. A custom
+    `loader(keys) -> {key: internal_id}` can replace the query.
+    """
+
+    def __init__(self, name, config, loader=None):
+        self.name = name
+        self.query = config.get("query")
+        self.key_column = config.get("key_column")
+        self.value_column = config.get("value_column", "id")
+        self.source = config["source"]
+        self.target = config["target"]
+        self.sublist = config.get("sublist")
+        self.chunk_size = int(config.get("chunk_size", 1000))
+        self.loader = loader
+        assert loader is not None or (
+            self.query and self.key_column
+        ), f"{name} reference lookup needs a query and key_column, or a loader."
+
+    def targets(self, transactions):
+        records = [transaction["data"] for transaction in transactions]
+        if self.sublist is None:
+            return records
+        return [
+            line for record in records for line in (get_path(record, self.sublist) or [])
+        ]
+
+    def load(self, keys, fetch_all):
+        if self.loader is not None:
+            return self.loader(keys)
+        found = {}
+        for i in range(0, len(keys), self.chunk_size):
+            query = self.query.format(
+                # Keys are quoted as they are: SKUs like "00123" and emails
+                # must match text, not numbers.
+                ids=", ".join(map(SuiteQLSource.literal, keys[i : i + self.chunk_size]))
+            )
+            for row in fetch_all(query):
+                found[str(row.get(self.key_column))] = row.get(self.value_column)
+        return found
+
+
+class ReferenceCache(object):
+    # Ids found stay cached for the agency; keys not found are asked again,
+    # since the record may be created in the meantime.
+    def __init__(self, lookups, cache_size=10000):
+        self.lookups = lookups
+        self.cache = LRUCache(cache_size)
+
+    def register(self, lookup):
+        self.lookups.append(lookup)
+
+    def resolve_many(self, lookup, keys, fetch_all):
+        found, missing = self.cache.get_many((lookup.name, key) for key in keys)
+        ids = {key: value for (_, key), value in found.items()}
+        if missing:
+            loaded = {
+                key: value
+                for key, value in lookup.load(
+                    sorted(key for _, key in missing), fetch_all
+                ).items()
+                if value is not None
+            }
+            self.cache.put_many({(lookup.name, key): value for key, value in loaded.items()})
+            ids.update(loaded)
+        return ids
+
+    def resolve(self, transactions, fetch_all):
+        """Set every lookup's target on `transactions`; returns the keys
+        that were not found per lookup."""
+        unresolved = {}
+        for lookup in self.lookups:
+            targets = lookup.targets(transactions)
+            keys = [get_path(target, lookup.source) for target in targets]
+            ids = self.resolve_many(
+                lookup, {str(key) for key in keys if key is not None}, fetch_all
+            )
+            for target, key in zip(targets, keys):
+                if key is None:
+                    continue
+                internal_id = ids.get(str(key))
+                if internal_id is None:
+                    unresolved.setdefault(lookup.name, set()).add(str(key))
+                    continue
+                set_path(target, lookup.target, internal_id)
+        return unresolved
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import builtins, dis, json, re, time
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from pytz import timezone
+
+# Names a TXMAP funct expression may use besides `src` and the builtins.
+FUNCT_GLOBALS = {
+    "timezone": timezone,
+    "datetime": datetime,
+    "date": date,
+    "timedelta": timedelta,
+    "Decimal": Decimal,
+    "json": json,
+    "re": re,
+    "time": time,
+}
+
+
+class UnsupportedMapping(Exception):
+    pass
+
+
+def _global_names(code):
+    names = {
+        instruction.argval
+        for instruction in dis.get_instructions(code)
+        if instruction.opname in ("LOAD_GLOBAL", "LOAD_NAME")
+    }
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            names |= _global_names(const)
+    return names
+
+
+def _path_getter(key):
+    path = tuple(key.split("|"))
+
+    def get(record, get_cust_value):
+        value = record
+        for k in path:
+            if value is None:
+                return None
+            value = value.get(k)
+        return value
+
+    return get
+
+
+def _custom_getter(key):
+    def get(record, get_cust_value):
+        return get_cust_value(record, key)
+
+    return get
+
+
+def _none_getter(record, get_cust_value):
+    return None
+
+
+def _getter(key):
+    if key is None:
+        return _none_getter
+    if key.startswith("@"):
+        return _custom_getter(key)
+    return _path_getter(key)
+
+
+class TransformPlan(object):
+    """A TXMAP mapping compiled once: funct strings become code objects and
+    src keys become ready-made getters, so a record is transformed without
+    re-reading the metadata."""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, metadatas, name="txmap"):
+        self.fields = [
+            (field, self.compile_field(f"{name}.{field}", metadata))
+            for field, metadata in metadatas.items()
+        ]
+
+    def compile_field(self, name, metadata):
+        if metadata.get("type") == "list":
+            getter = _getter(metadata["src"][0].get("key"))
+            plan = TransformPlan(metadata["funct"], name=name)
+
+            def list_field(record, get_cust_value):
+                values = getter(record, get_cust_value)
+                if values is None:
+                    return []
+                return [plan.execute(value, get_cust_value) for value in values]
+
+            return list_field
+
+        if metadata.get("type") != "attribute":
+            raise UnsupportedMapping(f"{name}: type {metadata.get('type')}.")
+
+        # A lambda keeps `src` visible inside comprehensions in the funct.
+        code = compile(f"lambda src: ({metadata['funct']}\n)", f"<{name}>", "eval")
+        unknown = _global_names(code) - set(FUNCT_GLOBALS) - set(dir(builtins))
+        if unknown:
+            raise UnsupportedMapping(f"{name}: unknown names {sorted(unknown)}.")
+        funct = eval(code, dict(FUNCT_GLOBALS))
+
+        sources = [
+            (source["label"], _getter(source.get("key")), source.get("default"))
+            for source in metadata["src"]
+        ]
+
+        def attribute_field(record, get_cust_value):
+            src = {}
+            for label, getter, default in sources:
+                value = getter(record, get_cust_value)
+                src[label] = default if value is None else value
+            return funct(src)
+
+        return attribute_field
+
+    def execute(self, record, get_cust_value=None):
+        return {
+            field: compiled(record, get_cust_value) for field, compiled in self.fields
+        }
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging, re, threading
+import pytest
+from datetime import datetime, timedelta
+from pytz import timezone
+from datawald_nsagency.nsagency import NSAgency
+
+UTC = timezone("UTC")
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+SETTING = {
+    "TXMAP": {
+        "dm": {
+            "salesOrder": {
+                "tran_id": {
+                    "type": "attribute",
+                    "funct": "src['tranId']",
+                    "src": [{"key": "tranId", "label": "tranId"}],
+                },
+            }
+        }
+    },
+    "data_type": {"order": "salesOrder"},
+    "src_metadata": {
+        "order": {
+            "src_id": "internalId",
+            "created_at": "createdDate",
+            "updated_at": "lastModifiedDate",
+        }
+    },
+    "LIMIT_PAGES": 0,
+    "PAGE_FETCH_BACKOFF": 0,
+    "METRICS_SINKS": [],
+}
+
+
+def make_records(count, start=datetime(2024, 1, 1, tzinfo=UTC), step=timedelta(minutes=1)):
+    return [
+        {
+            "internalId": str(i),
+            "tranId": f"SO-{i}",
+            "createdDate": start + step * i,
+            "lastModifiedDate": start + step * i,
+            "customFieldList": None,
+        }
+        for i in range(count)
+    ]
+
+
+class SearchConnector(object):
+    """Fake SOAP connector over `records`.
+
+    A search keeps the records whose lastModifiedDate is within cut_date and
+    end_date, both ends included like SOAP `within`, and serves them in pages
+    of `page_size` under a new search_id. `faults` maps a page index to the
+    exceptions its fetches raise, one per attempt.
+    """
+
+    def __init__(self, records=(), page_size=100, faults=None):
+        self.records = list(records)
+        self.page_size = page_size
+        self.faults = {page: list(errors) for page, errors in (faults or {}).items()}
+        self.searches = {}
+        self.windows = []
+        self.page_calls = []
+        self.lock = threading.Lock()
+
+    def get_transaction_result(self, record_type, **params):
+        search_id = params.get("search_id")
+        page_index = params.get("page_index", 1)
+        with self.lock:
+            if search_id is None:
+                cut_date = datetime.strptime(params["cut_date"], DATE_FORMAT)
+                end_date = datetime.strptime(params["end_date"], DATE_FORMAT)
+                self.windows.append((params["cut_date"], params["end_date"]))
+                search_id = f"search-{len(self.searches) + 1}"
+                self.searches[search_id] = [
+                    record
+                    for record in self.records
+                    if cut_date <= record["lastModifiedDate"] <= end_date
+                ]
+            elif search_id not in self.searches:
+                raise Exception(f"INVALID_SEARCH: {search_id} has expired.")
+            else:
+                self.page_calls.append(page_index)
+                if self.faults.get(page_index):
+                    raise self.faults[page_index].pop(0)
+        records = self.searches[search_id]
+        return {
+            "total_records": len(records),
+            "total_pages": -(-len(records) // self.page_size),
+            "search_id": search_id,
+            "records": records[(page_index - 1) * self.page_size : page_index * self.page_size],
+        }
+
+    def get_transactions(self, record_type, records, **params):
+        return records
+
+    get_item_result = get_transaction_result
+    get_items = get_transactions
+    get_person_result = get_transaction_result
+    get_persons = get_transactions
+
+
+class SuiteQLRows(object):
+    """Fake execute_suiteql over transaction rows with a `lastmodified`
+    column. The window is read back from the query's
+    `>= '<cut_date>'` and `< '<end_date>'` filters, end excluded."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.queries = []
+
+    def __call__(self, query, limit, offset):
+        self.queries.append((query, limit, offset))
+        cut_date = re.search(r">= '([^']+)'", query).group(1)
+        end_date = re.search(r"< '([^']+)'", query).group(1)
+        rows = [row for row in self.rows if cut_date <= row["lastmodified"] < end_date]
+        return {
+            "items": rows[offset : offset + limit],
+            "totalResults": len(rows),
+            "hasMore": offset + limit < len(rows),
+        }
+
+
+SUITEQL_SOURCE = {
+    "query": "SELECT {columns} FROM transaction WHERE lastmodifieddate >= '{cut_date}' "
+    "AND lastmodifieddate < '{end_date}' ORDER BY id",
+    "page_size": 10,
+    "fields": {
+        "internalId": "id",
+        "tranId": "tranid",
+        "createdDate": "lastmodified",
+        "lastModifiedDate": "lastmodified",
+    },
+    "datetime_fields": {"lastmodified": "%Y-%m-%d %H:%M:%S"},
+}
+
+
+def make_rows(count, start=datetime(2024, 1, 1), step=timedelta(seconds=30)):
+    return [
+        {
+            "id": i,
+            "tranid": f"SO-{i}",
+            "lastmodified": (start + step * i).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def suiteql_agency(make_agency):
+    # An agency reading "order" through SUITEQL_SOURCES from `rows`.
+    def make(rows, **setting):
+        agency = make_agency(
+            SOURCE_MODES={"order": "suiteql"},
+            SUITEQL_SOURCES={"order": SUITEQL_SOURCE},
+            **setting,
+        )
+        agency.execute_suiteql = SuiteQLRows(rows)
+        return agency
+
+    return make
+
+
+@pytest.fixture(name="make_rows")
+def make_rows_fixture():
+    return make_rows
+
+
+@pytest.fixture(name="make_records")
+def make_records_fixture():
+    return make_records
+
+
+@pytest.fixture
+def search_connector():
+    return SearchConnector
+
+
+@pytest.fixture
+def make_agency():
+    # NSAgency over a SearchConnector (empty unless one is given).
+    def make(connector=None, **setting):
+        agency = NSAgency(logging.getLogger("test"), **dict(SETTING, **setting))
+        agency.soap_connector = connector if connector is not None else SearchConnector()
+        return agency
+
+    return make
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+from datetime import datetime, timedelta
+from pytz import timezone
+from datawald_nsagency.backfill import plan_backfill_shards, shard_kwargs
+
+UTC = timezone("UTC")
+
+
+def test_plan_backfill_shards_crosses_windows_and_partitions():
+    shards = plan_backfill_shards(
+        datetime(2024, 1, 1, tzinfo=UTC),
+        datetime(2024, 1, 2, 12, tzinfo=UTC),
+        24,
+        partitions={"subsidiary": ["1", "3"]},
+        tx_type="order",
+    )
+    assert [
+        (shard["cut_date"], shard["hours"], shard["subsidiary"]) for shard in shards
+    ] == [
+        ("2024-01-01T00:00:00+0000", 24, "1"),
+        ("2024-01-01T00:00:00+0000", 24, "3"),
+        ("2024-01-02T00:00:00+0000", 12.0, "1"),
+        ("2024-01-02T00:00:00+0000", 12.0, "3"),
+    ]
+    assert shards[0]["shard_id"] == "2024-01-01T00:00:00+0000|subsidiary=1"
+    assert all(shard["tx_type"] == "order" for shard in shards)
+
+
+def test_shard_kwargs_pin_the_window():
+    shard = plan_backfill_shards(
+        datetime(2024, 1, 1, tzinfo=UTC), datetime(2024, 1, 2, tzinfo=UTC), 24
+    )[0]
+    kwargs = shard_kwargs(shard)
+    assert kwargs["cut_date"] == datetime(2024, 1, 1, tzinfo=UTC)
+    assert kwargs["checkpoint"] is False
+    assert kwargs["fixed_window"] is True
+    assert "shard_id" not in kwargs
+
+
+def test_empty_shard_is_not_widened(make_agency, search_connector):
+    connector = search_connector()
+    agency = make_agency(connector)
+    for shard in plan_backfill_shards(
+        datetime(2024, 1, 1, tzinfo=UTC),
+        datetime(2024, 1, 4, tzinfo=UTC),
+        24,
+        tx_type="order",
+        target="dm",
+    ):
+        assert agency.tx_transactions_src(**shard_kwargs(shard)) == []
+    assert connector.windows == [
+        ("2024-01-01T00:00:00+0000", "2024-01-01T23:59:59+0000"),
+        ("2024-01-02T00:00:00+0000", "2024-01-02T23:59:59+0000"),
+        ("2024-01-03T00:00:00+0000", "2024-01-03T23:59:59+0000"),
+    ]
+
+
+def test_boundary_records_are_read_by_one_shard(
+    make_agency, search_connector, make_records
+):
+    # Records every 12 hours, so every other one is on a shard boundary.
+    records = make_records(6, step=timedelta(hours=12))
+    agency = make_agency(search_connector(records))
+    src_ids = [
+        entity["src_id"]
+        for shard in plan_backfill_shards(
+            datetime(2024, 1, 1, tzinfo=UTC),
+            datetime(2024, 1, 4, tzinfo=UTC),
+            24,
+            tx_type="order",
+            target="dm",
+        )
+        for entity in agency.tx_transactions_src(**shard_kwargs(shard))
+    ]
+    assert sorted(src_ids) == ["0", "1", "2", "3", "4", "5"]
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import json, os
+import pytest
+from datawald_nsagency import cache
+from datawald_nsagency.cache import (
+    FileSystemObjectStore,
+    ObjectNotModified,
+    get_json_object,
+    get_value,
+    is_not_modified,
+)
+
+
+class CountingStore(FileSystemObjectStore):
+    def __init__(self, root):
+        FileSystemObjectStore.__init__(self, root)
+        self.calls = []
+
+    def get_object(self, **params):
+        self.calls.append(params)
+        return FileSystemObjectStore.get_object(self, **params)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def write(root, value):
+    os.makedirs(os.path.join(root, "bucket"), exist_ok=True)
+    with open(os.path.join(root, "bucket", "txmap.json"), "w") as f:
+        json.dump(value, f)
+
+
+def test_file_system_store_honours_if_none_match(tmp_path):
+    write(str(tmp_path), {"a": 1})
+    store = FileSystemObjectStore(str(tmp_path))
+    obj = store.get_object(Bucket="bucket", Key="txmap.json")
+    assert json.loads(obj["Body"].read()) == {"a": 1}
+    with pytest.raises(ObjectNotModified) as e:
+        store.get_object(Bucket="bucket", Key="txmap.json", IfNoneMatch=obj["ETag"])
+    assert is_not_modified(e.value)
+
+
+def test_get_json_object_revalidates_after_ttl(tmp_path):
+    write(str(tmp_path), {"a": 1})
+    store = CountingStore(str(tmp_path))
+
+    assert get_json_object(lambda: store, "bucket", "txmap.json") == {"a": 1}
+    assert get_json_object(lambda: store, "bucket", "txmap.json") == {"a": 1}
+    assert len(store.calls) == 1
+
+    # Expired and unchanged: a conditional GET keeps the cached value.
+    assert get_json_object(lambda: store, "bucket", "txmap.json", ttl=0) == {"a": 1}
+    assert "IfNoneMatch" in store.calls[-1]
+
+    write(str(tmp_path), {"a": 2})
+    assert get_json_object(lambda: store, "bucket", "txmap.json", ttl=0) == {"a": 2}
+    assert len(store.calls) == 3
+
+
+def test_get_value_caches_the_loader():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert get_value("key", loader) == 1
+    assert get_value("key", loader) == 1
+    assert get_value("key", loader, ttl=0) == 2
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import pytest
+from datetime import datetime, timedelta
+from pytz import timezone
+from datawald_nsagency.checkpoint import (
+    CheckpointStore,
+    FileCheckpointStore,
+    checkpoint_key,
+    get_checkpoint_store,
+)
+
+
+def running_checkpoint(search_id, total_pages, completed_pages):
+    return {
+        "status": "running",
+        "cut_date": "2024-01-01T00:00:00+0000",
+        "end_date": "2024-01-02T00:00:00+0000",
+        "search_id": search_id,
+        "total_pages": total_pages,
+        "completed_pages": completed_pages,
+    }
+
+
+def test_expired_search_restarts_the_checkpoint(tmp_path, make_agency):
+    store = FileCheckpointStore(str(tmp_path / "checkpoints.json"))
+    store.put(
+        "dm:order",
+        {
+            "status": "running",
+            "cut_date": "2024-01-01T00:00:00+0000",
+            "end_date": "2024-01-02T00:00:00+0000",
+            "search_id": "expired",
+            "total_pages": 3,
+            "completed_pages": [1],
+        },
+    )
+    agency = make_agency(CHECKPOINT_STORE=store)
+    assert (
+        agency.tx_transactions_src(
+            tx_type="order", target="dm", cut_date="2024-01-01T00:00:00+0000"
+        )
+        == []
+    )
+    state = store.get("dm:order")
+    assert state["search_id"] is None
+    assert state["completed_pages"] == []
+    # The next run starts the window over instead of the expired search.
+    assert agency.get_sync_checkpoint(target="dm", tx_type="order").resume is None
+
+
+def test_partial_store_fails_at_construction():
+    class ReadOnlyStore(CheckpointStore):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+
+
+@pytest.mark.parametrize("transform_mode", ["thread", "process"])
+def test_resume_reads_the_missing_pages(
+    tmp_path, make_agency, search_connector, make_records, transform_mode
+):
+    # The process pool pickles the transform kwargs; resume state must not
+    # carry anything that cannot be pickled.
+    config = {"type": "file", "path": str(tmp_path / "checkpoints.json")}
+    get_checkpoint_store({"CHECKPOINT_STORE": config}).put(
+        "dm:order", running_checkpoint("search-1", 3, [1, 3])
+    )
+    connector = search_connector(page_size=2)
+    connector.searches["search-1"] = make_records(6)
+    agency = make_agency(
+        connector, CHECKPOINT_STORE=config, TRANSFORM_MODE=transform_mode
+    )
+    try:
+        entities = agency.tx_transactions_src(
+            tx_type="order", target="dm", cut_date="2024-01-01T00:00:00+0000"
+        )
+    finally:
+        agency.close()
+    assert {entity["src_id"]: entity["data"]["tran_id"] for entity in entities} == {
+        "2": "SO-2",
+        "3": "SO-3",
+    }
+    assert connector.page_calls == [2]
+
+
+def test_checkpoint_key_hashes_search_params():
+    assert checkpoint_key(target="dm", tx_type="order", cut_date="x", hours=1) == (
+        "dm:order"
+    )
+    first = checkpoint_key(target="dm", tx_type="order", subsidiary="1")
+    assert first.startswith("dm:order:")
+    assert first == checkpoint_key(subsidiary="1", tx_type="order", target="dm")
+    assert first != checkpoint_key(target="dm", tx_type="order", subsidiary="3")
+
+
+def test_watermark_is_kept_per_search_params(
+    tmp_path, make_agency, search_connector, make_records
+):
+    store = FileCheckpointStore(str(tmp_path / "checkpoints.json"))
+    connector = search_connector(
+        make_records(
+            3, start=datetime(2024, 2, 28, tzinfo=timezone("UTC")), step=timedelta(days=1)
+        )
+    )
+    agency = make_agency(connector, CHECKPOINT_STORE=store)
+
+    def pull(subsidiary):
+        return agency.tx_transactions_src(
+            tx_type="order",
+            target="dm",
+            cut_date="2024-01-01T00:00:00+0000",
+            subsidiary=subsidiary,
+        )
+
+    assert len(pull("1")) == 3
+    agency.commit_sync_state()
+    # Subsidiary 1 is read from its watermark, subsidiary 3 from cut_date.
+    pull("1")
+    pull("3")
+    assert [window[0] for window in connector.windows] == [
+        "2024-01-01T00:00:00+0000",
+        "2024-03-01T00:00:00+0000",
+        "2024-01-01T00:00:00+0000",
+    ]
+
+
+def test_list_run_commits_the_watermark_after_hand_off(
+    tmp_path, make_agency, search_connector, make_records
+):
+    store = FileCheckpointStore(str(tmp_path / "checkpoints.json"))
+    connector = search_connector(make_records(3), page_size=2)
+    agency = make_agency(connector, CHECKPOINT_STORE=store)
+
+    def pull():
+        return agency.tx_transactions_src(
+            tx_type="order", target="dm", cut_date="2024-01-01T00:00:00+0000"
+        )
+
+    assert len(pull()) == 3
+    assert store.get("dm:order") is None
+    agency.commit_sync_state()
+    assert store.get("dm:order") == {
+        "status": "completed",
+        "watermark": "2024-01-01T00:02:00+0000",
+    }
+    pull()
+    assert connector.windows[1][0] == "2024-01-01T00:02:00+0000"
+
+
+def test_list_run_with_failed_pages_resumes_them(
+    tmp_path, make_agency, search_connector, make_records
+):
+    store = FileCheckpointStore(str(tmp_path / "checkpoints.json"))
+    # Page 2 fails its first fetch and the deferred pass.
+    connector = search_connector(
+        make_records(6), page_size=2, faults={2: [Exception("boom"), Exception("boom")]}
+    )
+    agency = make_agency(connector, CHECKPOINT_STORE=store, PAGE_FAILURE_POLICY="defer")
+
+    def pull():
+        entities = agency.tx_transactions_src(
+            tx_type="order", target="dm", cut_date="2024-01-01T00:00:00+0000"
+        )
+        agency.commit_sync_state()
+        return sorted(entity["src_id"] for entity in entities)
+
+    assert pull() == ["0", "1", "4", "5"]
+    state = store.get("dm:order")
+    assert state["status"] == "running"
+    assert state["search_id"] == "search-1"
+    assert sorted(state["completed_pages"]) == [1, 3]
+
+    calls = len(connector.page_calls)
+    assert pull() == ["2", "3"]
+    assert connector.page_calls[calls:] == [2]
+    assert store.get("dm:order") == {
+        "status": "completed",
+        "watermark": "2024-01-01T00:05:00+0000",
+    }
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import copy, random
+import pytest
+from datawald_nsagency.columnar import filter_inventorylots, row_totals
+from datawald_nsagency.nsagency import NSAgency
+
+
+def make_lots(seed, count=50):
+    rng = random.Random(seed)
+    keys = ["quantityOnHand", "quantityAvailable", "quantityOnOrder"]
+    lots = []
+    for n in range(count):
+        locations = []
+        for i in range(rng.randint(0, 4)):
+            location = {"location": f"WH{i}"}
+            # Different key sets and key orders across rows.
+            for key in rng.sample(keys, rng.randint(1, len(keys))):
+                location[key] = rng.choice([0, 0.0, 1, 2.5, -1, "n/a"])
+            locations.append(location)
+        lots.append(
+            {
+                "inventoryNumber": f"LOT{n}",
+                "status": rng.choice(["In Stock", "Not in Stock"]),
+                "locations": locations,
+            }
+        )
+    return lots
+
+
+def test_row_totals_uses_each_rows_own_keys():
+    rows = [{"loc": "A", "a": 0, "b": 0}, {"loc": "B", "a": 0, "c": 5}]
+    assert row_totals(rows) == [0, 5]
+
+
+def test_row_totals_skips_strings():
+    rows = [{"loc": "A", "a": 1, "b": "x"}, {"loc": "B", "a": 2, "b": 3}]
+    assert row_totals(rows) == [1, 5]
+
+
+def test_filter_keeps_in_stock_locations_with_other_keys():
+    lots = [
+        {
+            "status": "In Stock",
+            "locations": [{"loc": "A", "a": 0, "b": 0}, {"loc": "B", "a": 0, "c": 5}],
+        }
+    ]
+    assert filter_inventorylots(lots)[0]["locations"] == [{"loc": "B", "a": 0, "c": 5}]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_filter_matches_tx_inventorylot_src(seed):
+    lots = make_lots(seed)
+    # tx_inventorylot_src does not use the agency.
+    expected = [NSAgency.tx_inventorylot_src(None, lot) for lot in copy.deepcopy(lots)]
+    assert filter_inventorylots(lots) == expected
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging, threading
+import pytest
+from datawald_nsagency import nsagency
+from datawald_nsagency.nsagency import LazyConnector, NSAgency
+
+
+class Connector(object):
+    def __init__(self, logger, **setting):
+        self.setting = setting
+
+    def get_transaction_result(self, record_type, **params):
+        return record_type
+
+
+def test_connector_is_built_once_on_first_use():
+    built = []
+    barrier = threading.Barrier(4, timeout=5)
+
+    def factory():
+        built.append(1)
+        return Connector(None)
+
+    connector = LazyConnector(factory)
+    assert built == []
+
+    def use():
+        barrier.wait()
+        connector.get_transaction_result("salesOrder")
+
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert built == [1]
+
+
+def test_wrap_decorates_what_is_handed_out():
+    calls = []
+
+    def wrap(name, attribute):
+        calls.append(name)
+        return attribute
+
+    connector = LazyConnector(lambda: Connector(None), wrap=wrap)
+    assert connector.get_transaction_result("salesOrder") == "salesOrder"
+    assert calls == ["get_transaction_result"]
+
+
+@pytest.fixture
+def agency_class(monkeypatch):
+    # NSAgency building Connector for SOAP, counting the builds.
+    monkeypatch.setattr(nsagency, "_connectors", {})
+    built = []
+
+    class Agency(NSAgency):
+        def build_soap_connector(self):
+            built.append(self)
+            return Connector(self.logger, **self.setting)
+
+    Agency.built = built
+    return Agency
+
+
+def make(agency_class, **setting):
+    return agency_class(logging.getLogger("test"), METRICS_SINKS=[], **setting)
+
+
+def test_agency_builds_no_connector_until_used(agency_class):
+    agency = make(agency_class)
+    assert agency_class.built == []
+    agency.soap_connector.get_transaction_result("salesOrder")
+    agency.soap_connector.get_transaction_result("salesOrder")
+    assert agency_class.built == [agency]
+
+
+def test_connector_cache_is_shared_by_identical_settings(agency_class):
+    first = make(agency_class, CONNECTOR_CACHE=True, account="1")
+    second = make(agency_class, CONNECTOR_CACHE=True, account="1")
+    other = make(agency_class, CONNECTOR_CACHE=True, account="2")
+    for agency in [first, second, other]:
+        agency.soap_connector.get_transaction_result("salesOrder")
+    assert first.soap_connector.connector is second.soap_connector.connector
+    assert other.soap_connector.connector is not first.soap_connector.connector
+    assert len(agency_class.built) == 2
+
+
+def test_connectors_are_not_shared_without_the_cache(agency_class):
+    first = make(agency_class, account="1")
+    second = make(agency_class, account="1")
+    assert first.soap_connector.connector is not second.soap_connector.connector
+    assert len(agency_class.built) == 2
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import mmap
+import pytest
+from datawald_nsagency import nsagency
+from datawald_nsagency.nsagency import (
+    FileTooLarge,
+    NSAgency,
+    get_file_content,
+    release_file_contents,
+)
+
+
+class Response(object):
+    def __init__(self, body=b"", status_code=200, headers=None, chunk=3):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.chunk = chunk
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.body), self.chunk):
+            self.read += len(self.body[i : i + self.chunk])
+            yield self.body[i : i + self.chunk]
+
+
+class Session(object):
+    """Fake requests session: `responses` maps a url to what its gets
+    return (or raise), one per attempt."""
+
+    def __init__(self, responses):
+        self.responses = {url: list(items) for url, items in responses.items()}
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append(url)
+        response = self.responses[url].pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_small_body_is_returned_as_bytes():
+    session = Session({"u": [Response(b"0123456789")]})
+    file = get_file_content({"url": "u"}, session=session, spool_size=64)
+    assert file["content"] == b"0123456789"
+
+
+def test_missing_file_is_none():
+    session = Session({"u": [Response(status_code=404)]})
+    assert get_file_content({"url": "u"}, session=session) is None
+    assert get_file_content({"url": None}, session=session) is None
+
+
+def test_content_length_over_max_size_is_not_read():
+    response = Response(b"0123456789", headers={"Content-Length": "10"})
+    with pytest.raises(FileTooLarge):
+        get_file_content({"url": "u"}, session=Session({"u": [response]}), max_size=8)
+    assert response.read == 0
+
+
+def test_streamed_body_over_max_size_stops_reading():
+    response = Response(b"0123456789" * 10)
+    with pytest.raises(FileTooLarge):
+        get_file_content({"url": "u"}, session=Session({"u": [response]}), max_size=8)
+    assert response.read == 9
+
+
+def test_large_body_is_spooled_to_a_memory_map():
+    body = b"0123456789" * 10
+    session = Session({"u": [Response(body)]})
+    file = get_file_content({"url": "u"}, session=session, spool_size=16)
+    content = file["content"]
+    assert isinstance(content, mmap.mmap)
+    assert content[:] == body
+    release_file_contents([file])
+    assert file["content"] is None
+    assert content.closed
+
+
+@pytest.fixture
+def file_agency(make_agency, monkeypatch):
+    # An agency downloading through `session`, recording its retry delays.
+    delays = []
+    monkeypatch.setattr(nsagency.time, "sleep", delays.append)
+
+    def make(session, **setting):
+        monkeypatch.setattr(NSAgency, "http_session", session)
+        agency = make_agency(ns_folder_internal_id="7", **setting)
+        agency.delays = delays
+        return agency
+
+    return make
+
+
+def test_download_is_retried_with_backoff(file_agency):
+    session = Session(
+        {"u": [ConnectionError("reset"), TimeoutError("slow"), Response(b"ok")]}
+    )
+    agency = file_agency(session, FILE_DOWNLOAD_RETRIES=2, FILE_RETRY_BACKOFF=1)
+    report = []
+    files = agency.process_files([{"url": "u"}], report=report)
+    assert [(file["content"], file["folder_internal_id"]) for file in files] == [
+        (b"ok", "7")
+    ]
+    assert [(entry["status"], entry["attempts"], entry["size"]) for entry in report] == [
+        ("S", 3, 2)
+    ]
+    # Jittered exponential backoff: 1s, then 2s, each times 0.5-1.5.
+    assert 0.5 <= agency.delays[0] <= 1.5
+    assert 1.0 <= agency.delays[1] <= 3.0
+
+
+def test_failed_files_are_reported_on_the_transaction(file_agency):
+    session = Session(
+        {
+            "ok": [Response(b"ok")],
+            "gone": [Response(status_code=404)],
+            "big": [Response(b"0123456789", headers={"Content-Length": "10"})],
+            "down": [Exception("HTTP 503")] * 2,
+        }
+    )
+    agency = file_agency(session, FILE_DOWNLOAD_RETRIES=1, FILE_MAX_SIZE=8)
+    transaction = {
+        "data": {"files": [{"url": url} for url in ["ok", "gone", "big", "down"]]}
+    }
+    agency.prepare_transaction_files(transaction)
+
+    assert [file["url"] for file in transaction["data"]["files"]] == ["ok"]
+    report = {entry["url"]: entry for entry in transaction["files_report"]}
+    assert {url: entry["status"] for url, entry in report.items()} == {
+        "ok": "S",
+        "gone": "N",
+        "big": "F",
+        "down": "F",
+    }
+    # Too large is final; other errors are retried.
+    assert report["big"]["attempts"] == 1
+    assert report["down"]["attempts"] == 2
+    assert transaction["tx_note"].startswith("Failed to process files: ")
+    assert "big (FileTooLarge: 10 bytes exceeds FILE_MAX_SIZE 8.)" in transaction["tx_note"]
+    assert "down (Exception: HTTP 503)" in transaction["tx_note"]
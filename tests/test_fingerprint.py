@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from datawald_nsagency.fingerprint import (
+    FingerprintStore,
+    MemoryFingerprintStore,
+    SQLiteFingerprintStore,
+    fingerprint,
+    fingerprint_key,
+)
+
+
+def test_fingerprint_ignores_key_order():
+    data = {"amount": Decimal("1.50"), "date": datetime(2024, 1, 1), "lines": [1, 2]}
+    assert fingerprint(data) == fingerprint(dict(reversed(list(data.items()))))
+    assert fingerprint(data) != fingerprint(dict(data, lines=[2, 1]))
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_store_round_trip(kind, tmp_path):
+    if kind == "memory":
+        store = MemoryFingerprintStore()
+    else:
+        store = SQLiteFingerprintStore(str(tmp_path / "fingerprints.db"))
+    store.put_many("dm:order", {"1": "a", "2": "b"})
+    store.put_many("dm:invoice", {"1": "c"})
+    assert store.get_many("dm:order", ["1", "2", "3"]) == {"1": "a", "2": "b"}
+    assert store.get_many("dm:invoice", ["1", "2"]) == {"1": "c"}
+
+
+def test_partial_store_fails_at_construction():
+    class WriteOnlyStore(FingerprintStore):
+        def put_many(self, key, fingerprints):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnlyStore()
+
+
+def test_fingerprints_are_kept_per_target(make_agency, search_connector, make_records):
+    store = MemoryFingerprintStore()
+    connector = search_connector(make_records(2))
+    agency = make_agency(connector, FINGERPRINT_STORE=store)
+    agency.map = dict(agency.map, other=agency.map["dm"])
+
+    def pull(target):
+        entities = agency.tx_transactions_src(
+            tx_type="order",
+            target=target,
+            cut_date="2024-01-01T00:00:00+0000",
+            checkpoint=False,
+        )
+        agency.commit_sync_state()
+        return len(entities)
+
+    assert [pull("dm"), pull("dm"), pull("other")] == [2, 0, 2]
+    assert set(key for key, _ in store.fingerprints) == {
+        fingerprint_key(target="dm", tx_type="order"),
+        fingerprint_key(target="other", tx_type="order"),
+    }
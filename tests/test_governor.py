@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import pytest
+from datawald_nsagency.governor import (
+    Governor,
+    GovernorTimeout,
+    LocalGovernor,
+    PollingGovernor,
+    SQLiteGovernor,
+    can_acquire,
+)
+
+
+def test_partial_governors_fail_at_construction():
+    class AcquireOnly(Governor):
+        def acquire(self, priority):
+            return None
+
+    class NoCancel(PollingGovernor):
+        def try_acquire(self, priority, token):
+            return True
+
+        def release(self, priority, token):
+            pass
+
+    with pytest.raises(TypeError):
+        AcquireOnly(1)
+    with pytest.raises(TypeError):
+        NoCancel(1)
+
+
+def test_can_acquire_respects_limit_and_caps():
+    caps = {"backfill": 1}
+    assert can_acquire("read", 2, caps, {"read": 1}, {})
+    assert not can_acquire("read", 2, caps, {"read": 1, "write": 1}, {})
+    assert not can_acquire("backfill", 3, caps, {"backfill": 1}, {})
+    assert can_acquire("read", 3, caps, {"backfill": 1}, {})
+
+
+def test_can_acquire_leaves_slots_to_higher_priorities():
+    # A waiting write takes the free slot before a read or a backfill.
+    assert not can_acquire("read", 2, {}, {"read": 1}, {"write": 1})
+    assert not can_acquire("backfill", 2, {}, {"read": 1}, {"write": 1, "read": 1})
+    # Unless the waiting priority is capped out of it.
+    assert can_acquire("write", 2, {"read": 1}, {"read": 1}, {"read": 1})
+    assert can_acquire("read", 2, {}, {"read": 1}, {"backfill": 3})
+
+
+def test_local_governor_times_out():
+    governor = LocalGovernor(1, timeout=0.05)
+    with governor.slot("read"):
+        with pytest.raises(GovernorTimeout):
+            governor.acquire("write")
+    with governor.slot("write"):
+        pass
+
+
+def test_sqlite_governor_shares_slots(tmp_path):
+    path = str(tmp_path / "governor.db")
+    first = SQLiteGovernor(path, 1, timeout=0.1, poll=0.01)
+    second = SQLiteGovernor(path, 1, timeout=0.1, poll=0.01)
+    token = first.acquire("read")
+    with pytest.raises(GovernorTimeout):
+        second.acquire("read")
+    first.release("read", token)
+    second.release("read", second.acquire("read"))
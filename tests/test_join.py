@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import pytest
+from datawald_nsagency.join import JoinEngine
+
+
+def make_engine(**options):
+    return JoinEngine(
+        {
+            "base": [
+                dict(
+                    {
+                        "record_types": ["salesOrder"],
+                        "query": "SELECT createdfrom, tranid FROM transaction WHERE createdfrom IN ({ids})",
+                        "fields": ["invoice_tran_id|tranid"],
+                    },
+                    **options,
+                )
+            ]
+        }
+    )
+
+
+def test_keys_are_quoted_by_default():
+    queries = []
+
+    def fetch_all(query):
+        queries.append(query)
+        return [{"createdfrom": "00123", "tranid": "INV-1"}]
+
+    records = [{"internalId": "00123"}, {"internalId": "O'Neil"}]
+    make_engine().enrich("salesOrder", records, fetch_all)
+    assert queries == [
+        "SELECT createdfrom, tranid FROM transaction WHERE createdfrom IN ('00123', 'O''Neil')"
+    ]
+    assert records[0]["invoice_tran_id"] == "INV-1"
+    assert records[1]["invoice_tran_id"] is None
+
+
+def test_numeric_key_leaves_ids_unquoted():
+    queries = []
+
+    def fetch_all(query):
+        queries.append(query)
+        return [{"createdfrom": 12, "tranid": "INV-1"}]
+
+    records = [{"internalId": "12"}, {"internalId": "13"}]
+    engine = make_engine(numeric_key=True)
+    engine.enrich("salesOrder", records, fetch_all)
+    assert queries == [
+        "SELECT createdfrom, tranid FROM transaction WHERE createdfrom IN (12, 13)"
+    ]
+    assert [record["invoice_tran_id"] for record in records] == ["INV-1", None]
+
+    # Both keys, matched or not, are served from the cache on the next page.
+    engine.enrich("salesOrder", [{"internalId": "12"}, {"internalId": "13"}], fetch_all)
+    assert len(queries) == 1
+
+
+def test_entry_only_runs_on_its_record_types():
+    queries = []
+    records = [{"internalId": "12"}]
+    make_engine().enrich("customer", records, queries.append)
+    assert queries == []
+    assert records == [{"internalId": "12"}]
+
+
+def test_entry_needs_record_types():
+    with pytest.raises(AssertionError, match="needs record_types"):
+        make_engine(record_types=[])
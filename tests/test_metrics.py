@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import io, json, logging
+from datawald_nsagency.metrics import EMFSink, InMemorySink, Metrics, get_metrics
+
+
+def test_flush_aggregates_per_name_and_tags():
+    sink = InMemorySink()
+    metrics = Metrics([sink])
+    for seconds in [0.1, 0.3, 0.2]:
+        metrics.record("page_fetch", seconds, record_type="salesOrder")
+    metrics.record("page_fetch", 1.0, record_type="invoice")
+    metrics.incr("upsert_status", tx_type="order", status="S")
+    metrics.incr("upsert_status", 2, tx_type="order", status="S")
+
+    metrics.flush()
+    snapshot = sink.snapshots[0]
+    timings = {timing["record_type"]: timing for timing in snapshot["timings"]}
+    assert timings["salesOrder"]["count"] == 3
+    assert abs(timings["salesOrder"]["total"] - 0.6) < 1e-9
+    assert (timings["salesOrder"]["min"], timings["salesOrder"]["max"]) == (0.1, 0.3)
+    assert snapshot["counters"] == [
+        {"name": "upsert_status", "tx_type": "order", "status": "S", "value": 3}
+    ]
+
+    # Flushing resets; an empty flush emits nothing.
+    metrics.flush()
+    assert len(sink.snapshots) == 1
+
+
+def test_emf_sink_writes_one_document_per_metric():
+    stream = io.StringIO()
+    metrics = Metrics([EMFSink(namespace="Test", stream=stream)])
+    metrics.record("join", 0.5, tx_type="order")
+    metrics.incr("unmapped_codes", 4, field="shipMethod")
+    metrics.flush()
+    documents = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [
+        document.get("count", document.get("value")) for document in documents
+    ] == [1, 4]
+    assert documents[0]["total_ms"] == 500.0
+    [dimensions] = documents[1]["_aws"]["CloudWatchMetrics"][0]["Dimensions"]
+    assert sorted(dimensions) == ["field", "name"]
+
+
+def test_get_metrics_sinks():
+    metrics = get_metrics({"METRICS_SINKS": ["memory"]}, logging.getLogger("test"))
+    assert isinstance(metrics.sinks[0], InMemorySink)
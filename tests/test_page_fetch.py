@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging, threading
+import pytest
+from datawald_nsagency.checkpoint import FileCheckpointStore
+from datawald_nsagency.nsagency import NSAgency, PageFetchConcurrency
+
+
+def test_one_decrease_per_congestion_event():
+    concurrency = PageFetchConcurrency(8, max_limit=10, adaptive=True)
+    generation = concurrency.generation
+    # Eight pages in flight fault together: the limit is halved once.
+    assert [concurrency.on_fault(generation) for _ in range(8)] == [True] + [False] * 7
+    assert concurrency.limit == 4
+    assert concurrency.max_limit == 10
+
+    # A page submitted after the decrease faulting is a new event.
+    assert concurrency.on_fault(concurrency.generation) is True
+    assert concurrency.limit == 2
+
+
+def test_limit_grows_back_to_the_configured_ceiling():
+    concurrency = PageFetchConcurrency(4, max_limit=6, adaptive=True)
+    concurrency.on_fault(concurrency.generation)
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.limit == 6
+
+
+def test_faults_of_pages_in_flight_lower_the_limit_once(caplog):
+    agency = NSAgency(
+        logging.getLogger("test"),
+        PAGE_FETCH_WORKERS=4,
+        PAGE_FETCH_MAX_WORKERS=4,
+        ADAPTIVE_PAGE_FETCH=True,
+        PAGE_FETCH_BACKOFF=0,
+        METRICS_SINKS=[],
+    )
+    # Pages 2-5 are in flight together and all hit the concurrency limit.
+    barrier = threading.Barrier(4, timeout=5)
+    faulted = set()
+
+    def result_funct(record_type, page_index=None, **params):
+        if page_index not in faulted:
+            faulted.add(page_index)
+            barrier.wait()
+            raise Exception("ExceededConcurrentRequestLimitFault")
+        return {"records": [page_index]}
+
+    with caplog.at_level(logging.WARNING, logger="test"):
+        pages = list(agency.iter_async_worker("salesOrder", result_funct, 5))
+    assert sorted(page["records"][0] for page in pages) == [2, 3, 4, 5]
+    lowered = [
+        record.getMessage()
+        for record in caplog.records
+        if "concurrency lowered" in record.getMessage()
+    ]
+    assert len(lowered) == 1
+    assert lowered[0].endswith("page fetch concurrency lowered to 2.")
+
+
+def pull_with_failed_page(tmp_path, make_agency, search_connector, make_records, policy):
+    # Six records in pages of two; page 2 fails its first fetch only.
+    store = FileCheckpointStore(str(tmp_path / "checkpoints.json"))
+    connector = search_connector(
+        make_records(6), page_size=2, faults={2: [Exception("boom")]}
+    )
+    agency = make_agency(connector, CHECKPOINT_STORE=store, PAGE_FAILURE_POLICY=policy)
+    entities = agency.tx_transactions_src(
+        tx_type="order", target="dm", cut_date="2024-01-01T00:00:00+0000"
+    )
+    agency.commit_sync_state()
+    return agency, store, sorted(entity["src_id"] for entity in entities)
+
+
+def test_fail_policy_fails_the_call(tmp_path, make_agency, search_connector, make_records):
+    with pytest.raises(Exception, match="boom"):
+        pull_with_failed_page(tmp_path, make_agency, search_connector, make_records, "fail")
+
+
+def test_skip_policy_leaves_the_run_open(
+    tmp_path, make_agency, search_connector, make_records
+):
+    agency, store, src_ids = pull_with_failed_page(
+        tmp_path, make_agency, search_connector, make_records, "skip"
+    )
+    assert src_ids == ["0", "1", "4", "5"]
+    assert [(page["page_index"], page["policy"]) for page in agency.failed_pages] == [
+        (2, "skip")
+    ]
+    # The watermark is not committed past the skipped records.
+    state = store.get("dm:order")
+    assert state["status"] == "running"
+    assert state.get("watermark") is None
+    assert sorted(state["completed_pages"]) == [1, 3]
+
+
+def test_defer_policy_reads_the_page_again(
+    tmp_path, make_agency, search_connector, make_records
+):
+    agency, store, src_ids = pull_with_failed_page(
+        tmp_path, make_agency, search_connector, make_records, "defer"
+    )
+    assert src_ids == ["0", "1", "2", "3", "4", "5"]
+    assert agency.failed_pages == []
+    assert store.get("dm:order") == {
+        "status": "completed",
+        "watermark": "2024-01-01T00:05:00+0000",
+    }
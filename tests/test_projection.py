@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging
+from datawald_nsagency.nsagency import NSAgency
+from datawald_nsagency.projection import get_field_projection
+from datawald_nsagency.suiteql import SuiteQLSource
+
+METADATAS = {
+    "tran_id": {"src": [{"key": "tranId"}]},
+    "customer": {"src": [{"key": "entity|name"}]},
+    "channel": {"src": [{"key": "@custbody_channel"}]},
+    "items": {
+        "type": "list",
+        "src": [{"key": "itemList|item"}],
+        "funct": {"sku": {"src": [{"key": "item|name"}]}},
+    },
+}
+SRC_METADATA = {"src_id": "internalId", "updated_at": "lastModifiedDate"}
+
+
+def make_source():
+    return SuiteQLSource(
+        {
+            "query": "SELECT {columns} FROM transaction WHERE lastmodifieddate >= '{cut_date}' ORDER BY id",
+            "fields": {
+                "internalId": "id",
+                "tranId": "tranid",
+                "memo": "memo",
+                "entity|name": "entity_name",
+                "lastModifiedDate": "lastmodified",
+                "@custbody_channel": "custbody_channel",
+                "@custbody_other": "custbody_other",
+            },
+            "lines": {
+                "itemList|item": {
+                    "query": "SELECT {columns} FROM transactionline WHERE transaction IN ({ids})",
+                    "key": "transaction",
+                    "fields": {"item|name": "item", "quantity": "quantity"},
+                },
+                "shipGroupList|shipGroup": {
+                    "query": "SELECT {columns} FROM shipgroup WHERE transaction IN ({ids})",
+                    "key": "transaction",
+                    "fields": {"weight": "weight"},
+                },
+            },
+        }
+    )
+
+
+def test_get_field_projection():
+    assert get_field_projection(METADATAS, SRC_METADATA) == {
+        "body_fields": [
+            "customFieldList",
+            "entity",
+            "internalId",
+            "itemList",
+            "lastModifiedDate",
+            "tranId",
+        ],
+        "sublists": {"itemList": ["item"]},
+        "custom_fields": ["custbody_channel"],
+    }
+
+
+def test_query_selects_projected_columns():
+    source = make_source()
+    projection = get_field_projection(METADATAS, SRC_METADATA)
+    assert source.query(
+        "2024-01-01T00:00:00+0000", "2024-01-02T00:00:00+0000", projection
+    ) == (
+        "SELECT id, tranid, entity_name, lastmodified, custbody_channel "
+        "FROM transaction WHERE lastmodifieddate >= '2024-01-01 00:00:00' ORDER BY id"
+    )
+    # Without a projection every mapped column is selected.
+    assert source.query(
+        "2024-01-01T00:00:00+0000", "2024-01-02T00:00:00+0000"
+    ).startswith(
+        "SELECT id, tranid, memo, entity_name, lastmodified, custbody_channel, custbody_other "
+    )
+
+
+def test_build_records_skips_unread_sublists():
+    source = make_source()
+    projection = get_field_projection(METADATAS, SRC_METADATA)
+    queries = []
+
+    def fetch_all(query):
+        queries.append(query)
+        return [{"transaction": 1, "item": "SKU-1", "quantity": 2}]
+
+    records = source.build_records(
+        [{"id": 1, "tranid": "SO-1", "memo": "m", "custbody_channel": "web"}],
+        fetch_all,
+        projection,
+    )
+    assert queries == [
+        "SELECT transaction, item FROM transactionline WHERE transaction IN (1)"
+    ]
+    assert records[0]["itemList"] == {"item": [{"item": {"name": "SKU-1"}, "customFieldList": None}]}
+    assert "memo" not in records[0]
+    assert records[0]["customFieldList"] == {
+        "customField": [{"scriptId": "custbody_channel", "value": "web"}]
+    }
+
+
+def test_projection_only_for_suiteql_sources():
+    agency = NSAgency(
+        logging.getLogger("test"),
+        FIELD_PUSHDOWN=True,
+        SOURCE_MODES={"order": "suiteql"},
+        src_metadata={"order": SRC_METADATA},
+        METRICS_SINKS=[],
+    )
+    assert "projection" not in agency.get_search_params(METADATAS, tx_type="invoice")
+    assert agency.get_search_params(METADATAS, tx_type="order")[
+        "projection"
+    ] == get_field_projection(METADATAS, SRC_METADATA)
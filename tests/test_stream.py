@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import types
+from datawald_nsagency.checkpoint import FileCheckpointStore
+from datawald_nsagency.fingerprint import MemoryFingerprintStore
+
+
+def pull(agency, **kwargs):
+    return agency.tx_transactions_src(
+        tx_type="order",
+        target="dm",
+        cut_date="2024-01-01T00:00:00+0000",
+        end_date="2024-01-02T00:00:00+0000",
+        **kwargs,
+    )
+
+
+def test_setting_does_not_turn_on_streaming(make_agency):
+    # retrieve_entities_from_source expects a list.
+    assert pull(make_agency(STREAM_MODE=True)) == []
+
+
+def test_stream_per_call(make_agency):
+    chunks = pull(make_agency(), stream=True)
+    assert isinstance(chunks, types.GeneratorType)
+    assert list(chunks) == []
+
+
+def test_stream_marks_pages_after_each_chunk_is_taken(
+    tmp_path, make_agency, search_connector, make_records
+):
+    # Pages of 3, 3, 3 and 1 records, fetched in order and handed out in
+    # chunks of 4.
+    store = FileCheckpointStore(str(tmp_path / "checkpoints.json"))
+    fingerprints = MemoryFingerprintStore()
+    agency = make_agency(
+        search_connector(make_records(10), page_size=3),
+        CHECKPOINT_STORE=store,
+        FINGERPRINT_STORE=fingerprints,
+        PAGE_FETCH_WORKERS=1,
+    )
+    chunks = pull(agency, stream=True, chunk_size=4)
+
+    def progress():
+        return store.get("dm:order")["completed_pages"], len(fingerprints.fingerprints)
+
+    # Nothing is marked until the consumer asks for the next chunk.
+    assert len(next(chunks)) == 4
+    assert progress() == ([], 0)
+    assert len(next(chunks)) == 4
+    assert progress() == ([1], 4)
+    assert len(next(chunks)) == 2
+    assert progress() == ([1, 2], 8)
+    assert next(chunks, None) is None
+    assert store.get("dm:order") == {
+        "status": "completed",
+        "watermark": "2024-01-01T00:09:00+0000",
+    }
+    assert len(fingerprints.fingerprints) == 10
+
+
+def test_pipeline_matches_the_list_result(
+    tmp_path, make_agency, search_connector, make_records
+):
+    store = FileCheckpointStore(str(tmp_path / "checkpoints.json"))
+    agency = make_agency(
+        search_connector(make_records(10), page_size=3), CHECKPOINT_STORE=store
+    )
+    entities = pull(agency, pipeline=True, checkpoint=False)
+    assert isinstance(entities, list)
+    assert sorted(entities, key=lambda entity: int(entity["src_id"])) == sorted(
+        pull(agency, checkpoint=False), key=lambda entity: int(entity["src_id"])
+    )
+    assert agency.pipeline_stats["pages"] == 4
+
+    # With a checkpoint the watermark waits for the hand-off.
+    pull(agency, pipeline=True)
+    assert store.get("dm:order") is None
+    agency.commit_sync_state()
+    assert store.get("dm:order")["watermark"] == "2024-01-01T00:09:00+0000"
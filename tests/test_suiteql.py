@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+from datetime import datetime
+from pytz import timezone
+
+WINDOW = {"cut_date": "2024-01-01T00:00:00+0000", "end_date": "2024-01-02T00:00:00+0000"}
+
+
+def test_pages_are_read_by_offset(suiteql_agency, make_rows):
+    # 25 rows in pages of 10.
+    agency = suiteql_agency(make_rows(25))
+    result_funct, funct = agency.get_source_functs("order", None, None)
+
+    pages = [
+        result_funct("salesOrder", page_index=page_index, **WINDOW)
+        for page_index in [1, 2, 3]
+    ]
+    assert [(limit, offset) for _, limit, offset in agency.execute_suiteql.queries] == [
+        (10, 0),
+        (10, 10),
+        (10, 20),
+    ]
+    assert [(page["total_records"], page["total_pages"]) for page in pages] == [
+        (25, 3)
+    ] * 3
+    assert [len(page["records"]) for page in pages] == [10, 10, 5]
+    # The same query resumes as the same search; another window does not.
+    assert len({page["search_id"] for page in pages}) == 1
+    assert pages[0]["search_id"].startswith("suiteql:")
+    other = result_funct(
+        "salesOrder", **dict(WINDOW, end_date="2024-01-01T00:05:00+0000")
+    )
+    assert other["search_id"] != pages[0]["search_id"]
+    assert (other["total_records"], other["total_pages"]) == (10, 1)
+
+    records = funct("salesOrder", pages[2]["records"])
+    assert [record["internalId"] for record in records] == [20, 21, 22, 23, 24]
+    assert records[0]["lastModifiedDate"] == datetime(
+        2024, 1, 1, 0, 10, tzinfo=timezone("UTC")
+    )
+
+
+def test_empty_window_is_one_page(suiteql_agency):
+    result_funct, _ = suiteql_agency([]).get_source_functs("order", None, None)
+    result = result_funct("salesOrder", **WINDOW)
+    assert (result["total_records"], result["total_pages"], result["records"]) == (
+        0,
+        1,
+        [],
+    )
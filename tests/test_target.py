@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging
+import pytest
+from datawald_nsagency.nsagency import NSAgency
+from datawald_nsagency.target import (
+    ReferenceCache,
+    ReferenceLookup,
+    TargetMapping,
+    UnmappedCode,
+)
+
+
+def make_mapping(terms):
+    return TargetMapping(
+        {"cc": "Visa", "inv": "Net Terms"}, {"ups": "UPS"}, {"US": "_unitedStates"}, terms
+    )
+
+
+def scan_terms(terms, payment_method):
+    # The linear scan TargetMapping.terms replaces.
+    for term, payment_methods in terms.items():
+        if payment_method in payment_methods:
+            return term
+    return None
+
+
+def test_terms_index_matches_linear_scan():
+    terms = {
+        "Net 15": ["Net Terms", "Wire"],
+        "Net 30": ["Net Terms"],
+        "Credit Card": ["Visa", "Wire"],
+    }
+    mapping = make_mapping(terms)
+    for payment_method in ["Net Terms", "Wire", "Visa", "Cash"]:
+        assert mapping.terms.get(payment_method) == scan_terms(terms, payment_method)
+
+
+def test_unmapped_code_is_a_key_error():
+    mapping = make_mapping({})
+    assert mapping.map("shipMethod", "ups") == "UPS"
+    with pytest.raises(KeyError) as e:
+        mapping.map("shipMethod", "fedex")
+    assert isinstance(e.value, UnmappedCode)
+    assert (e.value.field, e.value.code) == ("shipMethod", "fedex")
+
+
+def test_reference_lookup_quotes_every_key():
+    queries = []
+
+    def fetch_all(query):
+        queries.append(query)
+        return [{"id": "7", "itemid": "00123"}]
+
+    lookup = ReferenceLookup(
+        "item_by_sku",
+        {
+            "query": "SELECT id, itemid FROM item WHERE itemid IN ({ids})",
+            "key_column": "itemid",
+            "sublist": "itemList|item",
+            "source": "sku",
+            "target": "item|internalId",
+        },
+    )
+    transactions = [
+        {"data": {"itemList": {"item": [{"sku": "00123"}, {"sku": "ABC-1"}]}}}
+    ]
+    unresolved = ReferenceCache([lookup]).resolve(transactions, fetch_all)
+    assert queries == [
+        "SELECT id, itemid FROM item WHERE itemid IN ('00123', 'ABC-1')"
+    ]
+    assert transactions[0]["data"]["itemList"]["item"][0]["item"] == {"internalId": "7"}
+    assert unresolved == {"item_by_sku": {"ABC-1"}}
+
+
+def test_reference_cache_keeps_found_ids_only():
+    queries = []
+
+    def fetch_all(query):
+        queries.append(query)
+        return [{"id": "1", "email": "a@x"}]
+
+    cache = ReferenceCache(
+        [
+            ReferenceLookup(
+                "customer_by_email",
+                {
+                    "query": "SELECT id, email FROM customer WHERE email IN ({ids})",
+                    "key_column": "email",
+                    "source": "email",
+                    "target": "entity|internalId",
+                },
+            )
+        ]
+    )
+    for _ in range(2):
+        cache.resolve([{"data": {"email": "a@x"}}, {"data": {"email": "b@x"}}], fetch_all)
+    # a@x is cached after the first batch; b@x is asked again.
+    assert queries[1] == "SELECT id, email FROM customer WHERE email IN ('b@x')"
+
+
+def test_failed_lookup_leaves_the_batch_unresolved():
+    agency = NSAgency(
+        logging.getLogger("test"),
+        REFERENCE_LOOKUPS={
+            "customer_by_email": {
+                "query": "SELECT id, email FROM customer WHERE email IN ({ids})",
+                "key_column": "email",
+                "source": "email",
+                "target": "entity|internalId",
+            }
+        },
+        METRICS_SINKS=[],
+    )
+
+    def fetch_all(query, limit=1000):
+        raise ConnectionError("SuiteQL is down")
+
+    agency.execute_suiteql_all = fetch_all
+    transactions = [{"tx_status": "N", "data": {"email": "a@x"}}]
+    assert agency.resolve_references(transactions) is transactions
+    assert transactions == [{"tx_status": "N", "data": {"email": "a@x"}}]
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging
+import pytest
+from datetime import datetime
+from pytz import timezone
+from datawald_nsagency.nsagency import NSAgency
+from datawald_nsagency.transform_plan import TransformPlan, UnsupportedMapping
+
+TXMAP = {
+    "order_number": {
+        "type": "attribute",
+        "funct": "src['tranId']",
+        "src": [{"key": "tranId", "label": "tranId"}],
+    },
+    "customer": {
+        "type": "attribute",
+        "funct": "src['name'].upper()",
+        "src": [{"key": "entity|name", "label": "name", "default": "guest"}],
+    },
+    "order_date": {
+        "type": "attribute",
+        "funct": "src['tranDate'].astimezone(timezone('UTC')).strftime('%Y-%m-%d')",
+        "src": [{"key": "tranDate", "label": "tranDate"}],
+    },
+    "channel": {
+        "type": "attribute",
+        "funct": "src['channel']",
+        "src": [{"key": "@custbody_channel", "label": "channel"}],
+    },
+    "tags": {
+        "type": "attribute",
+        "funct": "','.join([tag['name'] for tag in src['tags']]) if src['tags'] is not None else ''",
+        "src": [{"key": "tags", "label": "tags"}],
+    },
+    "items": {
+        "type": "list",
+        "src": [{"key": "itemList|item"}],
+        "funct": {
+            "sku": {
+                "type": "attribute",
+                "funct": "src['sku']",
+                "src": [{"key": "item|name", "label": "sku"}],
+            },
+            "qty": {
+                "type": "attribute",
+                "funct": "int(src['qty'])",
+                "src": [{"key": "quantity", "label": "qty", "default": 0}],
+            },
+        },
+    },
+}
+
+
+def make_record(i):
+    return {
+        "tranId": f"SO-{i}",
+        "entity": {"name": f"customer {i}"} if i % 3 else None,
+        "tranDate": timezone("US/Pacific").localize(datetime(2024, 1, 1 + i % 28, 20)),
+        "customFieldList": (
+            {"customField": [{"scriptId": "custbody_channel", "value": f"web{i}"}]}
+            if i % 2
+            else None
+        ),
+        "tags": [{"name": "a"}, {"name": str(i)}] if i % 4 else None,
+        "itemList": {
+            "item": [
+                {"item": {"name": f"SKU-{j}"}, "quantity": j if j else None}
+                for j in range(i % 3)
+            ]
+        }
+        if i % 5
+        else None,
+    }
+
+
+def test_plan_matches_transform_data():
+    interpreted = NSAgency(logging.getLogger("test"), METRICS_SINKS=[])
+    compiled = NSAgency(logging.getLogger("test"), COMPILE_TXMAP=True, METRICS_SINKS=[])
+    assert compiled.get_transform_plan(TXMAP) is not None
+    for i in range(30):
+        record = make_record(i)
+        assert compiled.transform_data(record, TXMAP) == interpreted.transform_data(
+            record, TXMAP
+        )
+
+
+def test_unknown_names_fall_back():
+    metadatas = {
+        "total": {
+            "type": "attribute",
+            "funct": "round_up(src['total'])",
+            "src": [{"key": "total", "label": "total"}],
+        }
+    }
+    with pytest.raises(UnsupportedMapping):
+        TransformPlan(metadatas)
+    agency = NSAgency(logging.getLogger("test"), COMPILE_TXMAP=True, METRICS_SINKS=[])
+    assert agency.get_transform_plan(metadatas) is None
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging
+import pytest
+from datawald_nsagency.nsagency import NSAgency
+from datawald_nsagency.nsagent import NSAgent
+
+KWARGS = {"tx_type": "order", "target": "dm"}
+
+
+def test_pool_modes_match_the_serial_transform(make_agency, make_records):
+    records = make_records(40)
+    legacy = make_agency()
+    expected = sorted(
+        (legacy.tx_transaction_src(record, **KWARGS) for record in records),
+        key=lambda entity: entity["src_id"],
+    )
+    assert len(expected) == 40
+
+    for mode in ["thread", "process"]:
+        agency = make_agency(TRANSFORM_MODE=mode, NUM_ASYNC_TASKS=4)
+        try:
+            entities = agency.dispatch_tx_entity_src(
+                agency.tx_transaction_src, records, **KWARGS
+            )
+            assert sorted(entities, key=lambda entity: entity["src_id"]) == expected
+        finally:
+            agency.close()
+
+
+@pytest.mark.parametrize("fails", [False, True])
+def test_agent_closes_the_pool_after_a_run(monkeypatch, fails):
+    def retrieve_entities_from_source(self, **kwargs):
+        self.transform_executor.submit(sum, [1, 2]).result()
+        if fails:
+            raise Exception("boom")
+        return "done"
+
+    monkeypatch.setattr(
+        NSAgency,
+        "retrieve_entities_from_source",
+        retrieve_entities_from_source,
+        raising=False,
+    )
+    agent = NSAgent(logging.getLogger("test"), METRICS_SINKS=[])
+    if fails:
+        with pytest.raises(Exception, match="boom"):
+            agent.retrieve_entities_from_source()
+    else:
+        assert agent.retrieve_entities_from_source() == "done"
+    assert agent._transform_executor is None
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+from datetime import datetime, timedelta
+from pytz import timezone
+
+UTC = timezone("UTC")
+START = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def test_split_soap_windows_do_not_overlap(make_agency, search_connector, make_records):
+    # One record a minute; SOAP windows include both ends.
+    connector = search_connector(make_records(121), page_size=60)
+    agency = make_agency(connector, LIMIT_PAGES=1, ADAPTIVE_WINDOW=True)
+    entities = agency.tx_transactions_src(
+        tx_type="order", target="dm", cut_date=START, hours=2
+    )
+    assert sorted(int(entity["src_id"]) for entity in entities) == list(range(121))
+    assert connector.windows[:3] == [
+        ("2024-01-01T00:00:00+0000", "2024-01-01T02:00:00+0000"),
+        ("2024-01-01T00:00:00+0000", "2024-01-01T01:00:00+0000"),
+        ("2024-01-01T00:00:00+0000", "2024-01-01T00:30:00+0000"),
+    ]
+    assert ("2024-01-01T01:00:01+0000", "2024-01-01T02:00:00+0000") in connector.windows
+
+
+def test_split_half_open_windows_miss_nothing(suiteql_agency, make_rows):
+    # 240 rows 30s apart over [start, start + 2h); SuiteQL windows exclude
+    # their end, so a split at mid_date must start the second half there.
+    agency = suiteql_agency(make_rows(240), LIMIT_PAGES=1, ADAPTIVE_WINDOW=True)
+    entities = agency.tx_transactions_src(
+        tx_type="order", target="dm", cut_date=START, hours=2
+    )
+    assert sorted(int(entity["src_id"]) for entity in entities) == list(range(240))
+    windows = sorted(
+        {
+            (query.split("'")[1], query.split("'")[3])
+            for query, _, _ in agency.execute_suiteql.queries
+        }
+    )
+    assert ("2024-01-01 00:00:00", "2024-01-01 01:00:00") in windows
+    assert ("2024-01-01 01:00:00", "2024-01-01 02:00:00") in windows
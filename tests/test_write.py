@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging, threading
+from datawald_nsagency.nsagency import LazyConnector, NSAgency
+
+
+class ListConnector(object):
+    """Fake SOAP connector with a list operation for persons.
+
+    `results` maps a record's email to what the list operation returns for
+    it (default: `tgt-<email>`); `short` drops the last result of a batch.
+    """
+
+    def __init__(self, results=None, short=False):
+        self.results = results or {}
+        self.short = short
+        self.batches = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def insert_update_persons(self, record_type, data_list):
+        with self.lock:
+            self.batches.append((record_type, [data["email"] for data in data_list]))
+            self.threads.add(threading.current_thread().name)
+        results = [
+            self.results.get(data["email"], f"tgt-{data['email']}") for data in data_list
+        ]
+        return results[:-1] if self.short else results
+
+    def insert_update_person(self, record_type, data):
+        return self.insert_update_persons(record_type, [data])[0]
+
+
+def make_persons(*tx_types):
+    return [
+        {"tx_type_src_id": f"{tx_type}-{i}", "data": {"email": f"{tx_type}{i}"}}
+        for i, tx_type in enumerate(tx_types)
+    ]
+
+
+def write_agency(make_agency, connector, **setting):
+    return make_agency(
+        connector,
+        data_type={"customer": "customer", "vendor": "vendor"},
+        WRITE_BATCH_SIZE=3,
+        **setting,
+    )
+
+
+def test_partial_list_failure_is_reported_per_entity(make_agency):
+    connector = ListConnector(results={"customer1": Exception("DUP_RECORD")})
+    agency = write_agency(make_agency, connector)
+    persons = agency.insert_update_persons(make_persons("customer", "customer", "customer"))
+    assert [(person["tx_status"], person["tgt_id"]) for person in persons] == [
+        ("S", "tgt-customer0"),
+        ("F", "####"),
+        ("S", "tgt-customer2"),
+    ]
+    assert "DUP_RECORD" in persons[1]["tx_note"]
+    assert "tx_note" not in persons[0]
+
+
+def test_short_result_list_fails_the_batch(make_agency):
+    agency = write_agency(make_agency, ListConnector(short=True))
+    persons = agency.insert_update_persons(make_persons("customer", "customer", "customer"))
+    assert [person["tx_status"] for person in persons] == ["F", "F", "F"]
+    assert all(
+        "2 results returned for 3 customer entities" in person["tx_note"]
+        for person in persons
+    )
+
+
+def test_parallel_batches_keep_one_record_type(make_agency):
+    connector = ListConnector()
+    agency = write_agency(make_agency, connector, WRITE_WORKERS=4)
+    persons = agency.insert_update_persons(
+        make_persons(*["customer", "vendor"] * 4, "customer")
+    )
+    assert all(
+        person["tgt_id"] == f"tgt-{person['data']['email']}" for person in persons
+    )
+    assert sorted(connector.batches) == [
+        ("customer", ["customer0", "customer2", "customer4"]),
+        ("customer", ["customer6", "customer8"]),
+        ("vendor", ["vendor1", "vendor3", "vendor5"]),
+        ("vendor", ["vendor7"]),
+    ]
+    assert all(name.startswith("nsagency-write") for name in connector.threads)
+
+
+def test_list_operation_is_looked_up_without_building_the_connector():
+    class Agency(NSAgency):
+        soap_connector_class = ListConnector
+
+    agency = Agency(logging.getLogger("test"), METRICS_SINKS=[])
+    assert isinstance(agency.soap_connector, LazyConnector)
+    assert agency.soap_connector_has("insert_update_persons")
+    assert not agency.soap_connector_has("insert_update_transactions")
+    assert agency.soap_connector._connector is None